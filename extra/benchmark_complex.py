@@ -0,0 +1,103 @@
+# benchmarks the compiled engines in utils_complex against the original implementations
+# run from the repository root: python extra/benchmark_complex.py
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from time import perf_counter
+from utils.utils_complex import *
+from utils.utils_complex import _ising_metropolis
+
+
+def timeit(f, *args, repeat=3, **kwargs):
+    best = np.inf
+    for _ in range(repeat):
+        start = perf_counter()
+        f(*args, **kwargs)
+        best = min(best, perf_counter() - start)
+    return best
+
+def benchmark_ising():
+    print('# Ising: time per attempted spin flip')
+    ising_checkerboard(16, 2, .44)  # compile
+
+    size, nsteps = 50, 10**4
+    t = timeit(_ising_metropolis, size, nsteps, .44, 4, repeat=1)
+    print(f'metropolis    size={size:4d}  {nsteps:8d} flips   {t:8.3f} s   {t/nsteps*1e9:10.1f} ns/flip')
+
+    for size, nsweeps in [(50, 1000), (128, 500), (512, 100)]:
+        t = timeit(ising_checkerboard, size, nsweeps, .44)
+        nflips = nsweeps*size**2
+        print(f'checkerboard  size={size:4d}  {nflips:8d} flips   {t:8.3f} s   {t/nflips*1e9:10.1f} ns/flip')
+
+    for size, nsweeps in [(128, 50), (512, 10)]:
+        lattice = PackedIsing((size, size), .44, nreplicas=64) ; lattice.sweep()
+        t = timeit(lattice.sweep, nsweeps)
+        nflips = nsweeps*size**2*64
+        print(f'packed x64    size={size:4d}  {nflips:8d} flips   {t:8.3f} s   {t/nflips*1e9:10.1f} ns/flip')
+
+def benchmark_ising_critical(size=32, nsweeps=4000):
+    print(f'# Ising at beta=0.44, size={size}: autocorrelation of |M| and cost per independent sample')
+    for method, res in compare_ising_methods(size, .44, nsweeps).items():
+        tau, t = res['tau |M| (sweeps)'], res['time per sweep (s)']
+        print(f'{method:14s}  tau={tau:8.2f} sweeps   {t*1e6:8.1f} us/sweep   {2*tau*t*1e6:10.1f} us/independent sample')
+
+def _run_fractals_reference(size_fractal, a ,n):
+    # run_fractals as it was before the escape-time engine, without the plot
+    def stable(z):
+        try: return False if abs(z) > 2 else True
+        except OverflowError: return False
+    stable = np.vectorize(stable)
+
+    def mandelbrot(c, a, n=50):
+        z = 0
+        for i in range(n): z = z**a + c
+        return z
+
+    def makeGrid(resolution, lims=[-1.85, 1.25, -1.45, 1.45]):
+        re = np.linspace(lims[0], lims[1], resolution)[::-1]
+        im = np.linspace(lims[2], lims[3], resolution)
+        re, im = np.meshgrid(re,im)
+        return re+im*1j
+
+    with np.errstate(all='ignore'):
+        return stable(mandelbrot(makeGrid(size_fractal,  lims=[-1.85, 1.25, -1.3, 1.3]), a=a, n=n))
+
+def benchmark_fractals():
+    print('# Fractals: time per render')
+    escape_time(16, 2.3, 10) ; escape_time(16, 2.3, 10, dtype=np.float32)  # compile
+    for size in [512, 1024]:
+        t = timeit(_run_fractals_reference, size, 2.3, 50, repeat=1)
+        print(f'reference         {size:5d}^2   {t:8.3f} s')
+    for dtype in [np.float64, np.float32]:
+        for a in [2., 2.3]:
+            for size in [1024, 4096]:
+                t = timeit(escape_time, size, a, 50, lims=[-1.85, 1.25, -1.3, 1.3], dtype=dtype, repeat=1)
+                print(f'escape-time {np.dtype(dtype).name} a={a}  {size:5d}^2   {t:8.3f} s')
+
+def benchmark_box_counts():
+    print('# Box counting: every box size from 2 to N/15')
+    _, res = escape_time(4096, 2., 50)
+    box_counts(res[:64, :64], method='numba')  # compile
+    for size in [1024, 4096]:
+        for method in ['numpy', 'numba']:
+            t = timeit(box_counts, res[:size, :size], method=method)
+            print(f'{method:6s}  {size:5d}^2   {t*1e3:8.1f} ms')
+
+def benchmark_layout():
+    print('# Network layout: networkx spring layout vs multilevel Barnes-Hut')
+    force_layout(makeBetheLattice(64, 3, sparse=True))  # compile
+    for n in [400, 3000]:
+        A = preferential_attachment_csr(n, 2, seed=0)
+        t = timeit(nx.spring_layout, nx.from_scipy_sparse_array(A), repeat=1)
+        print(f'networkx     n={n:6d}   {t:8.3f} s')
+        t = timeit(force_layout, A, repeat=1)
+        print(f'multilevel   n={n:6d}   {t:8.3f} s')
+
+
+if __name__ == '__main__':
+    benchmark_ising()
+    benchmark_ising_critical()
+    benchmark_fractals()
+    benchmark_box_counts()
+    benchmark_layout()
@@ -0,0 +1,35 @@
+# writes the bundled price sample in assets/complex/data/prices (one npz per ticker)
+# downloads from yahoo when online, otherwise writes geometric Brownian motion marked as synthetic
+# run from the repository root: python extra/make_sample_prices.py [--synthetic]
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.utils_complex import *
+from utils.utils_complex import _download_prices, _price_file
+
+start, end = '2018-01-01', '2023-01-01'
+# ticker: (starting price, yearly drift, yearly volatility) for the synthetic series
+tickers = {'GOOGL' : (53., .15, .30), 'AAPL' : (43., .25, .33), 'TSLA' : (21., .60, .65)}
+
+def synthetic_prices(ticker, start, end, seed=0):
+    S0, mu, sigma = tickers[ticker]
+    rng = np.random.default_rng([seed, sum(map(ord, ticker))])
+    dates = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D'))
+    dates = dates[np.is_busday(dates)]
+    dt = 1/252
+    close = S0*np.exp(np.cumsum((mu - sigma**2/2)*dt + sigma*np.sqrt(dt)*rng.standard_normal(len(dates))))
+    return {'date' : dates, 'close' : close, 'adj_close' : close, 'start' : np.datetime64(start, 'D'), 
+            'end' : np.datetime64(end, 'D'), 'source' : np.array('synthetic')}
+
+
+if __name__ == '__main__':
+    os.makedirs(price_data_path, exist_ok=True)
+    for ticker in tickers:
+        try:
+            if '--synthetic' in sys.argv: raise ConnectionError
+            prices = _download_prices(ticker, start, end)
+        except Exception:
+            prices = synthetic_prices(ticker, start, end)
+        np.savez_compressed(_price_file(ticker, price_data_path), **prices)
+        print(ticker, prices['source'], len(prices['date']))
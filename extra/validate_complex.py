@@ -0,0 +1,39 @@
+# regression checks of the estimators in utils_complex against known answers
+# run from the repository root: python extra/validate_complex.py
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.utils_complex import *
+from scipy.special import gammaln
+
+
+def check_power_law_fit(alpha=2.5, n=100000, seed=0):
+    # discrete MLE on a Zipf sample of known exponent, at a fixed and at the KS-chosen xmin
+    x = np.random.default_rng(seed).zipf(alpha, n)
+    for xmin in [5, None]:
+        fit = power_law_fit(x, xmin=xmin)
+        assert abs(fit['alpha'] - alpha) < 3*fit['alpha_err'], (xmin, fit)
+        print(f"power_law_fit  xmin={fit['xmin']}  alpha={fit['alpha']:.3f} ± {fit['alpha_err']:.3f}  (true {alpha})")
+
+def check_first_return_survival(nwalks=20000, nsteps=200, seed=0):
+    # survival after step i is one minus the first-return probability up to step i+1, 
+    # and for the 1d lattice walk the return times follow the exact first-return pmf
+    res = random_walk_ensemble(nwalks, nsteps, dim=1, seed=seed, chunk_size=2**12)
+    returns = res['return_time'][res['return_time'] > 0]
+    pmf = np.bincount(returns, minlength=nsteps+1)[1:] / nwalks
+    assert np.allclose(res['survival'], 1 - np.cumsum(pmf)), 'survival is not 1 - cumsum(first-return pmf)'
+
+    # f(2k) = C(2k, k) / ((2k-1) 4^k), the remaining probability of the simple walk
+    k = np.arange(1, nsteps//2 + 1)
+    exact = np.exp(gammaln(2*k+1) - 2*gammaln(k+1) - k*np.log(4)) / (2*k - 1)
+    pmf_exact = np.zeros(nsteps) ; pmf_exact[2*k-1] = exact
+    S_exact = 1 - np.cumsum(pmf_exact)
+    err = np.abs(res['survival'] - S_exact).max()
+    assert err < 4*np.sqrt(.25/nwalks), err
+    print(f'random_walk_ensemble  max |S(t) - exact| = {err:.4f} over {nsteps} steps')
+
+
+if __name__ == '__main__':
+    check_power_law_fit()
+    check_first_return_survival()
@@ -60,14 +60,16 @@ def statisticalMechanics():
         ### Ising 2d Simulation  
         Snapshots of the output of a simulation of the 2d Ising model using the metropolis algorithm.
         """)
+    method = st.radio('method', ['metropolis', 'checkerboard', 'packed', 'wolff', 'swendsen-wang'], horizontal=True)
     cols = st.columns(3)
-    size = cols[0].slider('size',3,100,10)
+    size = cols[0].slider('size',3,100 if method=='metropolis' else 512,10)
     beta = cols[1].slider('beta',0.01,5.,1.)
-    nsteps = cols[2].slider('nsteps',3,10000,100)
-    
+    nsteps = cols[2].slider({'metropolis':'nsteps', 'checkerboard':'nsweeps', 'packed':'nsweeps', 
+                             'wolff':'ncluster flips', 'swendsen-wang':'nupdates'}[method],3,10000,100)
+
 
-    nsnapshots = 4 #  multiples of 4 
-    results, data = ising(size, nsteps, beta, nsnapshots)
+    nsnapshots = 4 #  multiples of 4
+    results, data = ising(size, nsteps, beta, nsnapshots, method=method)
      
     
     st.pyplot(plotSnapshots(results, nsnapshots))
@@ -75,7 +77,15 @@ def statisticalMechanics():
     st.markdown(r"""A time series indicates whether we have entered steady-state, and the susceptibility plots indicates (🤞) the phase-transition. *Phase transitions are trypically soft in the small $L$ regime.*""")
     cols = st.columns(2)
     cols[0].pyplot(plotEnergy_magnetization(results))
-    cols[1].pyplot(plotSusceptibility(data))
+    cols[1].pyplot(plotSusceptibility(data, method))
+    st.caption(r"Integrated autocorrelation time of $|M|$ after burn-in: $\tau_{int}=$" + f"{results['tau']:.1f} steps")
+
+    st.markdown(r"""
+        ### Thermodynamics at all temperatures
+        Instead of one simulation per $\beta$, a Wang-Landau random walk in energy estimates the density of states $g(E)$ once per lattice size. Any canonical average then follows by reweighting, $\langle A\rangle_\beta = \sum_E A(E)\, g(E) e^{-\beta E} / Z$.
+        """)
+    size_wl = st.select_slider('size (Wang-Landau)', [4, 8, 16], 8)
+    st.pyplot(plotWangLandau(wang_landau(size_wl), beta))
      
 def phaseTransitions_CriticalPhenomena():
     text_dict = getText_prep(filename = textfile_path+'phaseTransitions.md', split_level = 2)
@@ -102,13 +112,14 @@ def phaseTransitions_CriticalPhenomena():
     Let's have a look at how this approximation compares to the typical approach. I'll run the 1d Ising with NN with and without the mean-field approximation.
     """)
     #with st.sidebar:
+    backend = st.radio('backend (packed: nsteps counts sweeps)', ['python', 'packed'], horizontal=True)
     cols = st.columns(3)
     size = cols[0].slider('size',3,100,30)
     beta = cols[1].slider('beta',0.01,5.,1.5)
     nsteps = cols[2].slider('nsteps',3,10000,100)
 
     
-    fig, _ = ising_1d(size, beta, nsteps)
+    fig, _ = ising_1d(size, beta, nsteps, backend=backend)
     st.pyplot(fig)
 
     st.markdown(r"Hmmm, my implementation is probably bad...")
@@ -146,10 +157,10 @@ def percolation_and_fractals():
     """)
     
     p_percolation = cols[0].slider("""p =""",       0.01, 1. , .1)
-    fig_percolation, domains = percolation(size, seed, p_percolation,marker, devmod=False)
-    #domains
+    fig_percolation, labels, sizes = percolation(size, seed, p_percolation,marker, devmod=False)
+    #labels
     cols[1].pyplot(fig_percolation)
-    cols[0].latex(r"""N({}) = {}""".format(p_percolation, len(domains)))
+    cols[0].latex(r"""N({}) = {}""".format(p_percolation, len(sizes)))
     
     fig = percolation_many_ps(n_ps, size, seed)
     cols[1].pyplot(fig)
@@ -161,6 +172,11 @@ def percolation_and_fractals():
         st.video('assets/complex/images/percolation_animation.mp4')
     st.markdown(r"""Notice, at $p=p_c=\frac{1}{2}$ a domain starts to dominate.""")
 
+    st.markdown(r"""The order parameter $P_\infty$ (the fraction of sites in the spanning cluster) and the mean size of the finite clusters show the transition clearly, here for a square and a cubic lattice.""")
+    cols = st.columns(2)
+    cols[0].pyplot(plotPercolationObservables(128, np.linspace(.4,.8,41), seed, dim=2))
+    cols[1].pyplot(plotPercolationObservables(32, np.linspace(.15,.5,36), seed, dim=3))
+
 
     # Bethe lattice
     st.markdown(r"""
@@ -243,15 +259,35 @@ def percolation_and_fractals():
                 z = z**a + c
             return z
         """))
+
+    st.markdown(r"""
+    ### Deep zoom
+    The view below is stitched from $256\times256$ tiles, each keyed by zoom level, tile index, $a$ and $n$ and kept in a cache, so panning or returning to a previous view only computes the tiles not seen before. Coarser zoom levels are drawn first while the sharp tiles are computed.
+    """)
+    cols = st.columns(4)
+    center_re = cols[0].number_input('Re(center)', -2., 1., -.75, step=.01, format='%.6f')
+    center_im = cols[1].number_input('Im(center)', -1.5, 1.5, .1, step=.01, format='%.6f')
+    zoom = cols[2].slider('zoom level', 0, 30, 4)
+    n_zoom = cols[3].slider('n (zoom)', 10, 1000, 200)
+    placeholder = st.empty()
+    for level, img in fractal_view_progressive((center_re, center_im), zoom, a, n_zoom, shape=(384, 384)):
+        placeholder.pyplot(plotFractalView(img, n_zoom, (center_re, center_im), level))
+
     st.markdown(r"""
     ## Fractal Dimension
     After we get the formulae for this, we could look at the fractal dimension of the mandelbrot set at different zoom-levels, and find out whether its scale free.
 
 
     """)
-    fig, fig2 = fractal_dimension(res)
+    fig, fig2, counts = fractal_dimension(res)
     st.pyplot(fig)
     st.pyplot(fig2)
+    dims = box_dimensions(counts)
+    st.markdown(r"""
+    The same box masses give the information dimension, from the entropy of the mass in each box, and the correlation dimension, from $\sum_i p_i^2$. These two measure the set itself rather than its boundary:
+    """ + f"""
+    $D_\\text{{boundary}} = {dims['box']:.3f}, \\quad D_1 = {dims['information']:.3f}, \\quad D_2 = {dims['correlation']:.3f}$
+    """)
     st.markdown('### Resources\n' + text_dict['Resources'])
 
 def selfOrganizedCriticality():
@@ -279,13 +315,13 @@ def selfOrganizedCriticality():
     key = 'Bak-Sneppen 2'
     cols[0].markdown(text_dict[key])
 
-    skip_init = skipInit(chains, patience=1000, tol=0.0001)
-    avalanches_dict = avalanches(idx_arr, skip_init)
+    skip_init = skipInit(L, patience=1000, tol=0.0001)
+    aval = avalanches(idx_arr, skip_init)
 
-    fig_baksneppen_fill = bakSneppen_plot_initial(chains, skip_init, idx_arr)
+    fig_baksneppen_fill = bakSneppen_plot_initial(L, skip_init, idx_arr)
     cols[1].pyplot(fig_baksneppen_fill)
     
-    st.pyplot(plotAvalanches(idx_arr, skip_init, avalanches_dict))
+    st.pyplot(plotAvalanches(idx_arr, skip_init, aval))
     
 
     st.markdown(r"""
@@ -294,8 +330,10 @@ def selfOrganizedCriticality():
 
     In 1 dimension, we either take a step right or a step left at each iteration. It should be very likely that we return to the origin, however some *walks* may take us on a long trip.
     """)
-    run_firstReturn1D = st.button('run: First return of 1d randomwalk')
-    if run_firstReturn1D: firstReturn1D()
+    cols = st.columns(2)
+    run_firstReturn1D = cols[0].button('run: First return of 1d randomwalk')
+    nwalks_1d = int(10**cols[1].slider('nwalks (log)', 1.7, 5., 1.7, key='nwalks_1d'))
+    if run_firstReturn1D: firstReturn1D(nwalks=nwalks_1d)
 
     st.markdown(r"""
     In 2 dimensions, we generate a random angle and take a step in that direction.
@@ -310,8 +348,11 @@ def selfOrganizedCriticality():
     st.markdown(r"""
     When looking for first return in 2d with floating point angles, we must consider a region around origo to be *home*. I implement this by looking when the agent enters the unit circle after having been a distance greater than $\frac{3}{2}$ from the origin.
     """)
-    run_firstReturn2D = st.button('run: First return of 2d randomwalk')
-    if run_firstReturn2D: firstReturn2D()
+    cols = st.columns(3)
+    run_firstReturn2D = cols[0].button('run: First return of 2d randomwalk')
+    nwalks_2d = int(10**cols[1].slider('nwalks (log)', 1.3, 5., 1.3, key='nwalks_2d'))
+    kind_2d = cols[2].radio('step lengths', ['angle', 'levy'], format_func={'angle':'unit', 'levy':'Lévy'}.get, horizontal=True)
+    if run_firstReturn2D: firstReturn2D(nwalks=nwalks_2d, kind=kind_2d)
     
     
     st.markdown(r"""
@@ -338,7 +379,10 @@ def selfOrganizedCriticality():
     st.markdown(r"""
     After a while, the model reaches steady state. Analyzing the distribution of avalanche sizes in steady state, reveals the ...
     """)
-    st.image('assets/complex/images/sandpile_2d_aval_dist.png') ; #st.markdown('## Evolution Model')
+    cols = st.columns(2)
+    size_sandpile = cols[0].select_slider('size (avalanche statistics)', [32, 64, 128], 64)
+    ngrains_sandpile = cols[1].select_slider('grains', [10**4, 10**5, 2*10**5, 10**6], 2*10**5)
+    st.pyplot(plotSandpileAvalanches(sandpile(size_sandpile, ngrains_sandpile, seed=42))) ; #st.markdown('## Evolution Model')
 
 def networks():
     st.title('Networks')
@@ -355,23 +399,47 @@ def networks():
         st.markdown(text_dict["Metrics and features of networks"])
 
     cols = st.columns(2)
-    network_type = cols[0].radio('network type',['bethe', 'random'])
-    N = cols[0].slider('N',1,420,22)
+    network_type = cols[0].radio('network type',['bethe', 'random', 'preferential attachment'])
+    N = int(10**cols[0].slider('N (log)', .5, 5., 1.34))
+    # large networks stay sparse and are not drawn
+    is_sparse = N > 420
     if network_type == 'random':
-        a = cols[0].slider('alpha', 0.9,1.,0.99)
+        # above the drawing limit the link probability shrinks with N, keeping the mean degree fixed
+        if is_sparse: a = 1 - cols[0].slider('mean degree', 1., 20., 4.)/(N-1)
+        else:         a = cols[0].slider('alpha', 0.9,1.,0.99)
     if network_type == 'bethe':
         degree = cols[0].slider('degree', 2,5,3)
-        
-    net = make_network(N,a) if network_type == 'random' else makeBetheLattice(N,degree)
-    fig, G = draw_from_matrix(net)
-    cols[1].pyplot(fig)
+    if network_type == 'preferential attachment':
+        m = cols[0].slider('links per new node', 1,5,2)
+    
+    if network_type == 'random': net = make_network(N, a, sparse=is_sparse)
+    elif network_type == 'bethe': net = makeBetheLattice(N, degree, sparse=is_sparse)
+    else:                         net = preferential_attachment_csr(max(N, m+1), m)
+    if N <= 420:
+        fig, pos = draw_from_matrix(net)
+        cols[1].pyplot(fig)
 
 
     # lets take a look at the degree dist
-
-    fig = network_analysis(net, G)
+    # betweenness from 256 random pivots on large networks
+    fig = network_analysis(net, k=256 if N > 1000 else None)
     st.pyplot(fig)
 
+    st.markdown('**Epidemics**')
+    cols = st.columns(3)
+    model = cols[0].radio('model', ['SIR', 'SIS'])
+    beta = cols[1].slider('infection rate per link', 0.05, 2., .5)
+    gamma = cols[2].slider('recovery rate', 0.1, 2., 1.)
+    # about 1e5 events at most: SIS stays endemic, so its time window shrinks with N
+    mean_degree = sparse.csr_matrix(net).nnz/N
+    t_max = 50 if model == 'SIR' else min(50, 1e5/(N*(gamma + beta*mean_degree)))
+    res = epidemic(net, beta, gamma, model, initial=max(1, N//100), t_max=t_max)
+    sizes = outbreak_sizes(net, beta, gamma, nruns=min(1000, 10**6//N)) if model == 'SIR' else None
+    st.pyplot(plotEpidemic(res, sizes))
+    if N <= 420:
+        fig, pos = draw_from_matrix(net, sick=(res['infected_time'] < np.inf).astype(int), pos=pos)
+        st.pyplot(fig)
+
 def agent_event_models():
     st.title('Agent/event based models')
     text_dict = getText_prep(filename = textfile_path+'agentbased.md', split_level = 3)
@@ -380,69 +448,25 @@ def agent_event_models():
     key = 'Game of life'
     cols = st.columns(2)
     cols[0].markdown(text_dict[key])
-    initial_config = cols[1].selectbox('initial config', ['glider','square', "boat", "loaf", "ship"])
-    st.pyplot(game_of_life(initial_config=initial_config))
+    initial_config = cols[1].selectbox('initial config', ['glider','square', "boat", "loaf", "ship", "glider gun"])
+    every = cols[1].select_slider('generations per frame', [1, 10, 100, 1000, 10**6], 1)
+    # long runs go on the open plane with hashlife, short ones on a fixed grid
+    backend = 'hashlife' if every > 100 else 'roll'
+    size_life = 40 if initial_config == 'glider gun' else 6
+    st.pyplot(game_of_life(size_life, initial_config=initial_config, every=every, backend=backend))
     st.markdown(text_dict['Game of life 2'])
 
     key = 'Stochastic simulation'
     st.markdown('### '+key)
     st.markdown(text_dict[key])
     
-    class Agent():
-        def __init__(self, pos, type='Rabbit', mapsize=10):
-            self.pos = pos
-            self.type = type
-            self.mapsize = mapsize
-
-        def step(self):
-            (update_x, update_y) = (np.random.choice([-1,0,1]) for _ in range(2))
-            self.pos[0] = self.pos[0] + update_x if ((self.pos[0] + update_x) >=0) and ((self.pos[0] + update_x) <self.mapsize) else self.pos[0]
-
-            self.pos[1] = self.pos[1] + update_y if ((self.pos[1] + update_y) >=0) and ((self.pos[1] + update_y) <self.mapsize) else self.pos[1]
-
-        def __repr__(self) -> str:
-            return f"{self.type} at {tuple(self.pos)}"
-
-    # Init
-    size = 10
-    
-    agents = []
-    foxes = [(0,1), (2,2)]
-    for f in foxes: 
-        agents.append(Agent(pos=list(f), type='Fox'))
-    rabbits = [(4,1), (1,5), (3,9), (8,7), (9, 1), (5,5)]
-    for r in rabbits: 
-        agents.append(Agent(pos=list(r), type='Rabbit'))
-    
-    #agents
-    # fill map
-    X = np.zeros((size,size))
-    for agent in agents:
-        
-        X[tuple(agent.pos)] = 1 if agent.type=='Rabbit' else 2
-
-    fig, ax = plt.subplots(1,2,figsize=(16,8))
-    ax[0].imshow(X, aspect=.4)
-
-    # step
-    for agent in agents:
-        agent.step()
-        
-    # fill map
-    occupied_positons = []
-    X = np.zeros((size,size))
-    for agent in agents:
-        
-        X[tuple(agent.pos)] = 1 if agent.type=='Rabbit' else 2
-        occupied_positons.append(tuple(agent.pos))
-
-    ax[1].imshow(X, aspect=.4)
-
-    
-
-    #plt.grid()
-    
-    st.pyplot(fig)
+    cols = st.columns(4)
+    size_map = cols[0].slider('map size', 10, 300, 100)
+    nrabbits = cols[1].slider('rabbits', 10, 100000, 2000)
+    nfoxes = cols[2].slider('foxes', 1, 10000, 200)
+    nsteps_agents = cols[3].slider('steps', 1, 2000, 300)
+    res_agents = fox_rabbit(size_map, nrabbits, nfoxes, nsteps_agents, snapshot_steps=[0, nsteps_agents], seed=42)
+    st.pyplot(plotFoxRabbit(res_agents))
 
     """ **Rules**
     * at each timestep, all agents step to a random nieghboring site.
@@ -450,13 +474,14 @@ def agent_event_models():
     * if two rabbits meet, they will procreate
     * if a fox hasn't eaten in 3 days, it will die
     * if foxes meet, they will procreate
+    * rabbits only procreate on sites with fewer than 4 rabbits
     """
 
 
     """
     Hmm, question is: *should I do this object oriented style, or with matricies?*
 
-    I'll come back to this. Main take away is that this is a different and usually more realistic method for time-evolving dynamic systems than just applying forward-Euler to the partial differential equations.
+    Matrices it is: positions, kinds and hunger are arrays with one entry per agent, and the per-site meetings are counted with `np.bincount`, so $10^5$ agents run for thousands of steps. Main take away is that this is a different and usually more realistic method for time-evolving dynamic systems than just applying forward-Euler to the partial differential equations.
     """
 
     others = ['Gillespie algorithm, ', 'Example of agent based simulation', 'Advantages of agent based models']
@@ -472,15 +497,19 @@ def econophysics():
     cols=st.columns(2)
     cols[0].markdown(r'If we pull a stock')
     ticker = cols[1].selectbox('Ticker',['GOOGL', 'AAPL', 'TSLA'])
-    fig, timeseries = var_of_stock(ticker = ticker)
+    fig, prices = var_of_stock(ticker = ticker)
+    synthetic = str(prices['source']) == 'synthetic'
+    if synthetic: cols[0].caption('Prices could not be downloaded, showing a bundled synthetic sample (geometric Brownian motion) instead.')
     st.pyplot(fig)
 
     st.markdown(text_dict['Brownian Motion 2'])
 
 
     st.markdown('#### Hurst exponent\n' + text_dict['Hurst exponent'])
-    fig = hurstExponent(timeseries)
+    fig = hurstExponent(prices['close'], title=ticker + (' (synthetic sample)' if synthetic else ''))
     st.pyplot(fig)
+    nseries = int(10**st.slider('random walks (log)', 1., 4., 3.))
+    st.pyplot(hurstEnsemble(nseries))
     st.markdown('#### Fear-factor model\n' + text_dict['Fear-factor model'])
     st.markdown('#### Bet-Hedghing Model\n' + text_dict['Bet-Hedghing Model'])
 
@@ -493,9 +522,15 @@ def econophysics():
     invest_per_round = cols[0].slider('invest per round', 0.,1.,.5) 
     nsteps = cols[0].slider('nsteps    ',1,3000,500)
     
-    fig = betHedging(p, noise, invest_per_round, nsteps, win_multiplier, loss_multiplier)
+    nruns = int(10**cols[0].slider('trajectories (log)', 1., 4., 3.))
+    
+    fig = betHedging(p, noise, invest_per_round, nsteps, win_multiplier, loss_multiplier, nruns)
     cols[1].pyplot(fig)
 
+    # growth rate for every investment fraction and noise level
+    fig = kellyCurves(p, nsteps, win_multiplier, loss_multiplier, nruns=nruns)
+    st.pyplot(fig)
+
 # Navigator
 topic_dict = {
     'Contents' :                               homeComplex,
@@ -1,8 +1,23 @@
 from utils.utils_global import *
 import yfinance as yf
 import networkx as nx # having trouble with this when hosted
+from numba import prange, jit, set_num_threads
+import os
+import sqlite3
+import heapq
+import hashlib
+import multiprocessing
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from functools import lru_cache
+from scipy.stats import binom
+import scipy.sparse as sparse
+from matplotlib.collections import LineCollection
 
 textfile_path = 'assets/complex/text/'
+cache_path = 'assets/complex/cache/'  # runtime results, not tracked
+ising_db_path = cache_path + 'ising_results.db'
 
 
 
@@ -61,8 +76,7 @@ def power_law_on_hist(hist, ax=plt, p0=[.1, 420, 5,-100], legend=False):
 
 
 # statatistical mechanics
-@function_profiler
-def ising(size, nsteps, beta, nsnapshots):
+def _ising_metropolis(size, nsteps, beta, nsnapshots):
     # initialize
     X = np.random.rand(size,size)
     X[X>0.5] =1 ; X[X!=1] =-1
@@ -98,16 +112,621 @@ def ising(size, nsteps, beta, nsnapshots):
         results['Magnetization'].append(np.sum(X))
         if step in np.arange(nsnapshots)*nsteps//nsnapshots:
             results['snapshots'][step]=X.copy()
+    return results
+
+@jit(nopython=True)
+def _seed_numba(seed):
+    # numba keeps its own random state, seperate from numpy's
+    np.random.seed(seed)
+
+def ising_energy(X):
+    # periodic nearest-neighbour energy with J=1, each bond counted once
+    X = X.astype(np.int64)
+    return -np.sum(X * (np.roll(X, 1, axis=0) + np.roll(X, 1, axis=1)))
+
+def ising_acceptance_table(beta):
+    # dE = 2*s*sum(neighbours) only takes five values; index with (s*sum + 4)//2
+    return np.minimum(1., np.exp(-2 * beta * np.arange(-4, 5, 2)))
+
+def _ising_checkerboard_sweep(X, acc):
+    # red/black update: sites of one colour share no bonds, so each
+    # half-sweep can be done in parallel
+    size = X.shape[0]
+    dE, dM = 0, 0
+    for color in range(2):
+        for i in prange(size):
+            for j in range((i + color) % 2, size, 2):
+                s = X[i, j]
+                sum_neighbors = X[(i+1)%size, j] + X[i-1, j] + X[i, (j+1)%size] + X[i, j-1]
+                if np.random.random() < acc[(s * sum_neighbors + 4) // 2]:
+                    X[i, j] = -s
+                    dE += 2 * s * sum_neighbors
+                    dM -= 2 * s
+    return dE, dM
+
+# with periodic boundaries an odd lattice can't be two-coloured, so it gets the serial kernel
+_ising_checkerboard_sweep_parallel = jit(nopython=True, parallel=True)(_ising_checkerboard_sweep)
+_ising_checkerboard_sweep_serial = jit(nopython=True)(_ising_checkerboard_sweep)
+
+@function_profiler
+def ising_checkerboard(size, nsweeps, beta, nsnapshots=4, record_every=1, seed=None, X=None):
+    """
+    Compiled 2d Ising engine doing full-lattice checkerboard Metropolis sweeps.
+    Energy and magnetization are tracked incrementally and recorded every
+    `record_every` sweeps. Returns the same dict layout as `ising`.
+    """
+    if seed is not None: 
+        np.random.seed(seed) ; _seed_numba(seed)
+    if X is None: X = np.where(np.random.rand(size,size) > 0.5, 1, -1)
+    X = X.astype(np.int8)
+
+    sweep = _ising_checkerboard_sweep_parallel if size%2==0 else _ising_checkerboard_sweep_serial
+    acc = ising_acceptance_table(beta)
+    E, M = ising_energy(X), int(np.sum(X, dtype=np.int64))
+
+    energies = np.empty(nsweeps//record_every + 1) ; energies[0] = E
+    magnetizations = np.empty(nsweeps//record_every + 1) ; magnetizations[0] = M
+    snapshot_sweeps = set((np.arange(nsnapshots)*nsweeps//nsnapshots).tolist())
+    snapshots = {}
+    for n in range(nsweeps):
+        if n in snapshot_sweeps: snapshots[n] = X.copy()
+        dE, dM = sweep(X, acc)
+        E += dE ; M += dM
+        if (n+1) % record_every == 0:
+            energies[(n+1)//record_every] = E
+            magnetizations[(n+1)//record_every] = M
+
+    return {"Energy" : energies, 
+            "Magnetization" : magnetizations, 
+            "snapshots" : snapshots}
+
+# neighbour offsets on the square lattice
+_DI = np.array([1, -1, 0, 0])
+_DJ = np.array([0, 0, 1, -1])
+
+@jit(nopython=True)
+def _uf_find(parent, k):
+    # union-find root with path halving
+    while parent[k] != k:
+        parent[k] = parent[parent[k]]
+        k = parent[k]
+    return k
+
+@jit(nopython=True)
+def _uf_union(parent, a, b):
+    a, b = _uf_find(parent, a), _uf_find(parent, b)
+    if a < b: parent[b] = a
+    elif b < a: parent[a] = b
+
+@jit(nopython=True)
+def _wolff_update(X, p_add, cluster, in_cluster):
+    # grow one cluster with an array-based queue, flip it, return (dE, dM, cluster size)
+    size = X.shape[0]
+    i0, j0 = np.random.randint(0, size), np.random.randint(0, size)
+    s = X[i0, j0]
+    cluster[0] = i0*size + j0 ; in_cluster[i0, j0] = True
+    head, n = 0, 1
+    while head < n:
+        i, j = cluster[head]//size, cluster[head]%size ; head += 1
+        for d in range(4):
+            ni, nj = (i + _DI[d]) % size, (j + _DJ[d]) % size
+            if X[ni, nj] == s and not in_cluster[ni, nj] and np.random.random() < p_add:
+                in_cluster[ni, nj] = True
+                cluster[n] = ni*size + nj ; n += 1
+
+    # only bonds on the cluster boundary change energy
+    dE = 0
+    for c in range(n):
+        i, j = cluster[c]//size, cluster[c]%size
+        for d in range(4):
+            ni, nj = (i + _DI[d]) % size, (j + _DJ[d]) % size
+            if not in_cluster[ni, nj]: dE += 2 * s * X[ni, nj]
+    for c in range(n):
+        i, j = cluster[c]//size, cluster[c]%size
+        X[i, j] = -s ; in_cluster[i, j] = False
+    return dE, -2 * s * n, n
+
+@jit(nopython=True)
+def _swendsen_wang_update(X, p_add, parent, flip):
+    # bond clusters with union-find, flip each with probability 1/2, return (E, M, n clusters)
+    size = X.shape[0]
+    for k in range(size*size): 
+        parent[k] = k ; flip[k] = -1
+    for i in range(size):
+        for j in range(size):
+            if X[i, j] == X[(i+1)%size, j] and np.random.random() < p_add:
+                _uf_union(parent, i*size + j, ((i+1)%size)*size + j)
+            if X[i, j] == X[i, (j+1)%size] and np.random.random() < p_add:
+                _uf_union(parent, i*size + j, i*size + (j+1)%size)
+
+    E, M, nclusters = 0, 0, 0
+    for i in range(size):
+        for j in range(size):
+            root = _uf_find(parent, i*size + j)
+            if flip[root] == -1:
+                flip[root] = 1 if np.random.random() < .5 else 0
+                nclusters += 1
+            if flip[root] == 1: X[i, j] = -X[i, j]
+    for i in range(size):
+        for j in range(size):
+            E -= X[i, j] * (X[(i+1)%size, j] + X[i, (j+1)%size])
+            M += X[i, j]
+    return E, M, nclusters
+
+@jit(nopython=True)
+def _wolff_run(X, p_add, n0, n1, energies, magnetizations, cluster_sizes, cluster, in_cluster):
+    E, M = energies[n0], magnetizations[n0]
+    for n in range(n0, n1):
+        dE, dM, cluster_sizes[n] = _wolff_update(X, p_add, cluster, in_cluster)
+        E += dE ; M += dM
+        energies[n+1], magnetizations[n+1] = E, M
+
+@jit(nopython=True)
+def _swendsen_wang_run(X, p_add, n0, n1, energies, magnetizations, cluster_sizes, parent, flip):
+    for n in range(n0, n1):
+        energies[n+1], magnetizations[n+1], cluster_sizes[n] = _swendsen_wang_update(X, p_add, parent, flip)
 
-    # load, fill and save susceptibility data
-    try: data = np.load('pages/data.npz', allow_pickle=True)[np.load('pages/data.npz', allow_pickle=True).files[0]].item()
-    except: data = {};  np.savez('pages/data', data)
+@function_profiler
+def ising_cluster(size, nsteps, beta, nsnapshots=4, method='wolff', seed=None, X=None):
+    """
+    Cluster updates of the 2d Ising model. For 'wolff' a step is one cluster 
+    flip, for 'swendsen-wang' a step is one update of the whole lattice. 
+    'Cluster sizes' holds the flipped cluster size (wolff) or the number of 
+    clusters (swendsen-wang) per step.
+    """
+    if seed is not None: 
+        np.random.seed(seed) ; _seed_numba(seed)
+    if X is None: X = np.where(np.random.rand(size,size) > 0.5, 1, -1)
+    X = X.astype(np.int8)
+
+    run, work = {
+            'wolff' : (_wolff_run, (np.empty(size*size, dtype=np.int64), np.zeros((size,size), dtype=np.bool_))),
+            'swendsen-wang' : (_swendsen_wang_run, (np.empty(size*size, dtype=np.int64), np.empty(size*size, dtype=np.int8))),
+        }[method]
+
+    p_add = 1 - np.exp(-2*beta)
+    energies, magnetizations = np.empty(nsteps+1), np.empty(nsteps+1)
+    energies[0], magnetizations[0] = ising_energy(X), np.sum(X, dtype=np.int64)
+    cluster_sizes = np.empty(nsteps, dtype=np.int64)
+    
+    # run compiled between snapshots
+    snapshot_steps = np.arange(nsnapshots)*nsteps//nsnapshots
+    segments = np.unique(np.r_[0, snapshot_steps, nsteps])
+    snapshots = {}
+    for n0, n1 in zip(segments[:-1], segments[1:]):
+        if n0 in snapshot_steps: snapshots[n0] = X.copy()
+        run(X, p_add, n0, n1, energies, magnetizations, cluster_sizes, *work)
+
+    return {"Energy" : energies, 
+            "Magnetization" : magnetizations, 
+            "Cluster sizes" : cluster_sizes,
+            "snapshots" : snapshots}
+
+def integrated_autocorrelation_time(x, c=5):
+    """Integrated autocorrelation time of x in units of its sampling interval, 
+    using Sokal's automatic window (smallest M with M >= c*tau(M))."""
+    x = np.asarray(x, dtype=float) - np.mean(x)
+    n = len(x)
+    f = np.fft.rfft(x, 2*n)
+    acf = np.fft.irfft(f * np.conj(f))[:n]
+    if acf[0] == 0: return np.nan
+    taus = 2*np.cumsum(acf/acf[0]) - 1
+    window = np.arange(n) >= c*taus
+    return taus[np.argmax(window)] if window.any() else taus[-1]
 
-    susceptibility = np.var(results['Magnetization'][-nsteps//4*3:])
-    data[beta] = {'sus': susceptibility, 'nsteps':nsteps, 'size':size}
-    np.savez('pages/data', data)
+@function_profiler
+def compare_ising_methods(size=32, beta=0.44, nsweeps=2000, 
+                          methods=['checkerboard', 'wolff', 'swendsen-wang'], burn=.2):
+    """
+    Runs each method for roughly `nsweeps` sweeps worth of spin flips and 
+    reports the integrated autocorrelation time of |M| and E in sweeps, plus 
+    the wall time per sweep, so tau*time is the cost of an independent sample.
+    """
+    N = size**2
+    out = {}
+    # compile outside the timings
+    ising_checkerboard(4, 1, beta) ; ising_cluster(4, 1, beta, method='wolff') ; ising_cluster(4, 1, beta, method='swendsen-wang')
+    for method in methods:
+        start = time()
+        if method == 'wolff':
+            # first guess the mean cluster size, then match the work of nsweeps sweeps
+            mean_cluster = max(1, ising_cluster(size, 200, beta, method='wolff')['Cluster sizes'].mean())
+            nsteps = int(nsweeps * N / mean_cluster)
+            start = time()
+            results = ising_cluster(size, nsteps, beta, method='wolff')
+            sweeps_per_sample = results['Cluster sizes'].mean() / N
+        elif method == 'swendsen-wang':
+            results = ising_cluster(size, nsweeps, beta, method='swendsen-wang')
+            sweeps_per_sample = 1
+        elif method == 'checkerboard':
+            results = ising_checkerboard(size, nsweeps, beta)
+            sweeps_per_sample = 1
+        elif method == 'metropolis':
+            results = _ising_metropolis(size, nsweeps*N, beta, 4)
+            sweeps_per_sample = 1/N
+        run_time = time() - start
+
+        nsamples = len(results['Energy'])
+        M, E = (np.asarray(results[key])[int(burn*nsamples):] for key in ['Magnetization', 'Energy'])
+        out[method] = {
+            'tau |M| (sweeps)' : integrated_autocorrelation_time(np.abs(M)) * sweeps_per_sample,
+            'tau E (sweeps)' : integrated_autocorrelation_time(E) * sweeps_per_sample,
+            'time per sweep (s)' : run_time / (nsamples * sweeps_per_sample),
+        }
+    return out
+
+# multi-spin coding: 64 replicas per uint64 word
+@jit(nopython=True)
+def _xorshift64(states, k):
+    x = states[k]
+    x ^= x >> np.uint64(12)
+    x ^= x << np.uint64(25)
+    x ^= x >> np.uint64(27)
+    states[k] = x
+    return x * np.uint64(2685821657736338717)
+
+@jit(nopython=True)
+def _bernoulli_word(P, nbits, states, k):
+    # every bit is set with probability P/2**nbits, built from the binary expansion of P
+    if P >> np.uint64(nbits): return ~np.uint64(0)
+    r = np.uint64(0)
+    for b in range(nbits):
+        if (P >> np.uint64(b)) & np.uint64(1): r |= _xorshift64(states, k)
+        elif r: r &= _xorshift64(states, k)
+    return r
+
+def _packed_ising_sweep2d(W, P4, nbits, states):
+    # x = s ^ neighbour marks antiparallel bonds; with n of them dE = 8 - 4n,
+    # so flip if n >= 2, with prob exp(-4 beta) if n == 1 and exp(-8 beta) if n == 0
+    nwords, size = W.shape[0], W.shape[1]
+    for color in range(2):
+        for i in prange(size):
+            for w in range(nwords):
+                for j in range((i + color) % 2, size, 2):
+                    s = W[w, i, j]
+                    x1, x2 = s ^ W[w, (i+1)%size, j], s ^ W[w, i-1, j]
+                    x3, x4 = s ^ W[w, i, (j+1)%size], s ^ W[w, i, j-1]
+                    any_ = x1 | x2 | x3 | x4
+                    flip = (x1 & x2) | (x3 & x4) | ((x1 | x2) & (x3 | x4))
+                    one, zero = any_ & ~flip, ~any_
+                    if one: flip |= one & _bernoulli_word(P4, nbits, states, i)
+                    if zero: flip |= zero & _bernoulli_word(P4, nbits, states, i) & _bernoulli_word(P4, nbits, states, i)
+                    W[w, i, j] = s ^ flip
+
+_packed_ising_sweep2d_parallel = jit(nopython=True, parallel=True)(_packed_ising_sweep2d)
+_packed_ising_sweep2d_serial = jit(nopython=True)(_packed_ising_sweep2d)
+
+@jit(nopython=True, parallel=True)
+def _packed_ising_sweep1d(W, P4, nbits, states):
+    # dE = 4 - 4n for n antiparallel bonds, so only fully aligned spins need a random word
+    nwords, size = W.shape
+    for w in prange(nwords):
+        for color in range(2):
+            for j in range(color, size, 2):
+                s = W[w, j]
+                any_ = (s ^ W[w, (j+1)%size]) | (s ^ W[w, j-1])
+                flip = any_
+                if ~any_: flip |= ~any_ & _bernoulli_word(P4, nbits, states, w)
+                W[w, j] = s ^ flip
+
+def _count_bits_per_replica(A):
+    # A has shape (nwords, ...); returns the number of set bits per replica
+    nwords = A.shape[0]
+    bits = np.unpackbits(A.astype('<u8').reshape(nwords, -1).view(np.uint8), axis=-1, bitorder='little')
+    return bits.reshape(nwords, -1, 64).sum(axis=1, dtype=np.int64).reshape(-1)
+
+class PackedIsing():
+    """
+    Bit-packed Ising lattice (1d chain or 2d periodic square lattice, J=1).
+    Bit b of the word at a site is the spin (1 -> +1, 0 -> -1) of replica
+    64*w + b, so `words` has shape (nwords, *shape) and every bitwise
+    operation updates 64 independent replicas at once. Acceptance
+    probabilities are resolved to 2**-nbits.
+    """
+    def __init__(self, shape, beta, nreplicas=64, seed=None, nbits=16, words=None):
+        self.shape = (shape,) if np.ndim(shape) == 0 else tuple(shape)
+        self.nreplicas, self.nwords, self.nbits = nreplicas, -(-nreplicas//64), nbits
+        rng = np.random.default_rng(seed)
+        umax = np.iinfo(np.uint64).max
+        self.words = rng.integers(0, umax, (self.nwords, *self.shape), dtype=np.uint64, endpoint=True) if words is None else words
+        self.states = rng.integers(1, umax, max(self.shape[0], self.nwords), dtype=np.uint64, endpoint=True)
+        self.set_beta(beta)
+
+    def set_beta(self, beta):
+        self.beta = beta
+        self.P4 = np.uint64(round(np.exp(-4*beta) * 2**self.nbits))
+
+    def sweep(self, nsweeps=1):
+        if len(self.shape) == 1: 
+            sweep = _packed_ising_sweep1d
+        else: 
+            sweep = _packed_ising_sweep2d_parallel if self.shape[0]%2==0 else _packed_ising_sweep2d_serial
+        for _ in range(nsweeps): sweep(self.words, self.P4, self.nbits, self.states)
+
+    def magnetization(self):
+        ups = _count_bits_per_replica(self.words)[:self.nreplicas]
+        return 2*ups - np.prod(self.shape)
+
+    def energy(self):
+        antiparallel = sum(_count_bits_per_replica(self.words ^ np.roll(self.words, 1, axis=axis))
+                           for axis in range(1, len(self.shape)+1))[:self.nreplicas]
+        nbonds = len(self.shape) * np.prod(self.shape)
+        return 2*antiparallel - nbonds
+
+    def spins(self, replica=0):
+        w, b = divmod(replica, 64)
+        return np.where((self.words[w] >> np.uint64(b)) & np.uint64(1), 1, -1).astype(np.int8)
+
+@function_profiler
+def ising_packed(size, nsweeps, beta, nsnapshots=4, nreplicas=64, record_every=1, seed=None):
+    """
+    2d Ising on the bit-packed lattice. 'Energy', 'Magnetization' and the 
+    snapshots follow replica 0, 'Replica energies' and 'Replica magnetizations'
+    hold every replica (shape nrecords x nreplicas).
+    """
+    lattice = PackedIsing((size, size), beta, nreplicas, seed)
+    nrec = nsweeps//record_every + 1
+    energies, magnetizations = np.empty((nrec, nreplicas)), np.empty((nrec, nreplicas))
+    energies[0], magnetizations[0] = lattice.energy(), lattice.magnetization()
+    snapshot_sweeps = set((np.arange(nsnapshots)*nsweeps//nsnapshots).tolist())
+    snapshots = {}
+    for n in range(nsweeps):
+        if n in snapshot_sweeps: snapshots[n] = lattice.spins(0)
+        lattice.sweep()
+        if (n+1) % record_every == 0:
+            energies[(n+1)//record_every] = lattice.energy()
+            magnetizations[(n+1)//record_every] = lattice.magnetization()
+
+    return {"Energy" : energies[:, 0],
+            "Magnetization" : magnetizations[:, 0],
+            "Replica energies" : energies,
+            "Replica magnetizations" : magnetizations,
+            "snapshots" : snapshots}
+
+# nsteps counts single flips for 'metropolis', full-lattice sweeps for 'checkerboard' and 'packed',
+# cluster flips for 'wolff' and full-lattice cluster updates for 'swendsen-wang'
+ising_methods = {
+        'metropolis' : _ising_metropolis,
+        'checkerboard' : ising_checkerboard,
+        'packed' : ising_packed,
+        'wolff' : lambda *args: ising_cluster(*args, method='wolff'),
+        'swendsen-wang' : lambda *args: ising_cluster(*args, method='swendsen-wang'),
+    }
+
+def _check_ising_method(method):
+    if method not in ising_methods: 
+        raise ValueError(f"unknown Ising method '{method}', expected one of {list(ising_methods)}")
+
+@function_profiler
+def ising(size, nsteps, beta, nsnapshots, method='metropolis'):
+    _check_ising_method(method)
+    results = ising_methods[method](size, nsteps, beta, nsnapshots)
+    results['tau'] = integrated_autocorrelation_time(np.abs(results['Magnetization'][-nsteps//4*3:]))
+
+    ising_store_append([_ising_summary(results, beta, size, nsteps, method)])
+    # reruns with the same settings show only their latest row
+    data = ising_store_load(method=method, latest=True)
     return results, data
 
+# results store: sqlite in WAL mode lets several sessions append at once
+def _ising_db(db_path=ising_db_path):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    con = sqlite3.connect(db_path, timeout=60)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute("""CREATE TABLE IF NOT EXISTS ising (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created TEXT, beta REAL, size INTEGER, nsteps INTEGER, method TEXT,
+                    sus REAL, energy REAL, abs_mag REAL)""")
+    return con
+
+def ising_store_append(rows, db_path=ising_db_path):
+    # append-only, every call is a single transaction
+    with closing(_ising_db(db_path)) as con, con:
+        con.executemany("""INSERT INTO ising (created, beta, size, nsteps, method, sus, energy, abs_mag)
+                           VALUES (:created, :beta, :size, :nsteps, :method, :sus, :energy, :abs_mag)""", 
+                        [dict(row, created=str(datetime.now())) for row in rows])
+
+def ising_store_load(db_path=ising_db_path, size=None, method=None, latest=False):
+    # with latest, only the newest row per (method, size, beta, nsteps)
+    query, args = 'SELECT beta, size, nsteps, method, sus, energy, abs_mag FROM ising', []
+    conditions = [c + ' = ?' for c, v in [('size', size), ('method', method)] if v is not None]
+    args = [v for v in [size, method] if v is not None]
+    if latest: conditions.append('id IN (SELECT MAX(id) FROM ising GROUP BY method, size, beta, nsteps)')
+    if conditions: query += ' WHERE ' + ' AND '.join(conditions)
+    with closing(_ising_db(db_path)) as con:
+        df = pd.read_sql_query(query + ' ORDER BY id', con, params=args)
+    return {col : df[col].values for col in df.columns}
+
+def _ising_summary(results, beta, size, nsteps, method):
+    # the first quarter of the run is discarded as burn-in
+    M = np.asarray(results['Magnetization'])[-nsteps//4*3:]
+    E = np.asarray(results['Energy'])[-nsteps//4*3:]
+    return {'beta' : float(beta), 'size' : int(size), 'nsteps' : int(nsteps), 'method' : method,
+            'sus' : float(np.var(M)), 'energy' : float(np.mean(E)), 'abs_mag' : float(np.mean(np.abs(M)))}
+
+def ising_parallel_tempering(size, betas, nsweeps, exchange_every=1, seed=None):
+    """
+    Replica exchange: one checkerboard replica per beta, neighbouring betas 
+    try to swap configurations every `exchange_every` sweeps. Energy and 
+    magnetization are recorded per beta (columns follow the sorted betas).
+    """
+    if seed is not None: 
+        np.random.seed(seed) ; _seed_numba(seed)
+    betas = np.sort(betas)
+    R = len(betas)
+    X = np.where(np.random.rand(R, size, size) > 0.5, 1, -1).astype(np.int8)
+    sweep = _ising_checkerboard_sweep_parallel if size%2==0 else _ising_checkerboard_sweep_serial
+    accs = [ising_acceptance_table(beta) for beta in betas]
+    E = np.array([ising_energy(x) for x in X])
+    M = X.sum(axis=(1,2), dtype=np.int64)
+
+    energies, magnetizations = np.empty((nsweeps+1, R)), np.empty((nsweeps+1, R))
+    energies[0], magnetizations[0] = E, M
+    swaps_accepted, swaps_attempted = np.zeros(R-1), np.zeros(R-1)
+    for n in range(nsweeps):
+        for r in range(R):
+            dE, dM = sweep(X[r], accs[r])
+            E[r] += dE ; M[r] += dM
+
+        if (n+1) % exchange_every == 0:
+            # alternate between even and odd pairs
+            for r in range((n//exchange_every) % 2, R-1, 2):
+                swaps_attempted[r] += 1
+                delta = (betas[r+1] - betas[r]) * (E[r+1] - E[r])
+                if delta >= 0 or np.random.rand() < np.exp(delta):
+                    X[[r, r+1]] = X[[r+1, r]]
+                    E[[r, r+1]], M[[r, r+1]] = E[[r+1, r]], M[[r+1, r]]
+                    swaps_accepted[r] += 1
+        energies[n+1], magnetizations[n+1] = E, M
+
+    return {'betas' : betas,
+            'Energy' : energies,
+            'Magnetization' : magnetizations,
+            'swap acceptance' : swaps_accepted / np.maximum(swaps_attempted, 1)}
+
+def _ising_sweep_worker(task):
+    # one process per task, so keep numba to a single thread
+    beta, size, nsteps, method, seed = task
+    set_num_threads(1)
+    np.random.seed(seed) ; _seed_numba(seed)
+    results = ising_methods[method](size, nsteps, beta, 0)
+    return [_ising_summary(results, beta, size, nsteps, method)]
+
+def _ising_tempering_worker(task):
+    betas, size, nsteps, exchange_every, seed = task
+    set_num_threads(1)
+    results = ising_parallel_tempering(size, betas, nsteps, exchange_every, seed=seed)
+    return [_ising_summary({'Magnetization' : results['Magnetization'][:, r], 'Energy' : results['Energy'][:, r]}, 
+                           beta, size, nsteps, 'tempering') for r, beta in enumerate(results['betas'])]
+
+@function_profiler
+def ising_sweep(betas, sizes, nsteps=1000, method='checkerboard', tempering=False, exchange_every=1,
+                seed=None, n_workers=None, store=True, db_path=ising_db_path):
+    """
+    Runs every (beta, size) across a process pool with independent random 
+    streams and appends the summaries to the results store. With 
+    tempering=True each size is one replica-exchange run over all betas.
+    """
+    if not tempering: _check_ising_method(method)
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(betas)*len(sizes))]
+    if tempering:
+        worker = _ising_tempering_worker
+        tasks = [(betas, size, nsteps, exchange_every, seed_) for size, seed_ in zip(sizes, seeds)]
+    else:
+        worker = _ising_sweep_worker
+        tasks = [(beta, size, nsteps, method, seeds[i*len(betas)+j]) for i, size in enumerate(sizes) 
+                                                                     for j, beta in enumerate(betas)]
+
+    # spawn rather than fork, numba's thread pool is not fork-safe
+    with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        rows = [row for rows in pool.map(worker, tasks) for row in rows]
+
+    if store: ising_store_append(rows, db_path)
+    return pd.DataFrame(rows)
+
+# Wang-Landau density of states
+@jit(nopython=True)
+def _wang_landau_run(X, E, M, lng, hist, abs_M_sum, M2_sum, M_counts, ln_f, nflips, accumulate):
+    # random walk in energy with acceptance g(E)/g(E'); energies are binned as (E + 2N)//4
+    size = X.shape[0]
+    offset = 2*size*size
+    for _ in range(nflips):
+        i, j = np.random.randint(0, size), np.random.randint(0, size)
+        s = X[i, j]
+        dE = 2 * s * (X[(i+1)%size, j] + X[i-1, j] + X[i, (j+1)%size] + X[i, j-1])
+        if np.log(np.random.random()) < lng[(E + offset)//4] - lng[(E + dE + offset)//4]:
+            X[i, j] = -s
+            E += dE ; M -= 2*s
+        b = (E + offset)//4
+        lng[b] += ln_f ; hist[b] += 1
+        if accumulate:
+            abs_M_sum[b] += abs(M) ; M2_sum[b] += M*M ; M_counts[b] += 1
+    return E, M
+
+_wang_landau_cache = {}
+
+@function_profiler
+def wang_landau(size, ln_f_final=1e-6, flatness=.8, check_every=100, accumulate_below=1e-3, seed=None, use_cache=True):
+    """
+    Wang-Landau estimate of ln g(E) for the 2d periodic Ising model (J=1).
+    The modification factor is halved whenever the energy histogram is flat,
+    i.e. min > flatness*mean over the visited energies, checked every 
+    `check_every` sweeps. Microcanonical <|M|> and <M^2> are collected once 
+    ln f < accumulate_below. Results are cached in memory and on disk per size 
+    and run parameters.
+    """
+    key = (size, ln_f_final, flatness, check_every, accumulate_below)
+    filename = cache_path + f'wang_landau_L{size}_f{ln_f_final:g}_flat{flatness:g}_check{check_every}_acc{accumulate_below:g}.npz'
+    if use_cache and key in _wang_landau_cache: return _wang_landau_cache[key]
+    if use_cache and os.path.exists(filename):
+        _wang_landau_cache[key] = dict(np.load(filename))
+        return _wang_landau_cache[key]
+
+    if seed is not None: 
+        np.random.seed(seed) ; _seed_numba(seed)
+    N = size**2
+    X = np.where(np.random.rand(size,size) > 0.5, 1, -1).astype(np.int8)
+    E, M = ising_energy(X), int(np.sum(X, dtype=np.int64))
+    nbins = N + 1
+    lng, hist = np.zeros(nbins), np.zeros(nbins, dtype=np.int64)
+    abs_M_sum, M2_sum, M_counts = np.zeros(nbins), np.zeros(nbins), np.zeros(nbins, dtype=np.int64)
+    
+    ln_f = 1.
+    while ln_f > ln_f_final:
+        hist[:] = 0
+        while True:
+            E, M = _wang_landau_run(X, E, M, lng, hist, abs_M_sum, M2_sum, M_counts, 
+                                    ln_f, check_every*N, ln_f < accumulate_below)
+            h = hist[hist > 0]
+            if h.min() > flatness * h.mean(): break
+        ln_f /= 2
+
+    # normalise to the two ground states
+    visited = lng > 0
+    E_levels = (np.arange(nbins)*4 - 2*N)[visited]
+    lng = lng[visited] - lng[visited][0] + np.log(2)
+    M_counts = np.maximum(M_counts[visited], 1)
+    wl = {'size' : size,
+          'E' : E_levels, 
+          'lng' : lng, 
+          'abs_M' : abs_M_sum[visited] / M_counts,
+          'M2' : M2_sum[visited] / M_counts}
+
+    os.makedirs(cache_path, exist_ok=True)
+    np.savez(filename, **wl)
+    _wang_landau_cache[key] = wl
+    return wl
+
+def wang_landau_thermodynamics(wl, betas):
+    # canonical averages by reweighting g(E)*exp(-beta*E), all per spin
+    betas = np.atleast_1d(betas)[:, None]
+    N, E = wl['size']**2, wl['E'][None, :]
+    logw = wl['lng'][None, :] - betas*E
+    w = np.exp(logw - logw.max(axis=1, keepdims=True))
+    w /= w.sum(axis=1, keepdims=True)
+    U, E2 = (w*E).sum(axis=1), (w*E**2).sum(axis=1)
+    abs_M, M2 = (w*wl['abs_M']).sum(axis=1), (w*wl['M2']).sum(axis=1)
+    betas = betas[:, 0]
+    return {'beta' : betas,
+            'energy' : U/N,
+            'heat capacity' : betas**2 * (E2 - U**2) / N,
+            '|magnetization|' : abs_M/N,
+            'susceptibility' : betas * (M2 - abs_M**2) / N}
+
+@function_profiler
+def plotWangLandau(wl, beta=None, betas=np.linspace(.1, 1., 400)):
+    thermo = wang_landau_thermodynamics(wl, betas)
+    keys = ['energy', 'heat capacity', '|magnetization|', 'susceptibility']
+    fig, ax = plt.subplots(1, 4, figsize=(12,3))
+    for i, key in enumerate(keys):
+        ax[i].plot(thermo['beta'], thermo[key], c='cyan')
+        if beta is not None: ax[i].axvline(beta, c='r', ls='--')
+        ax[i].set_xlabel(r'Inverse temperature, $\beta$', color='white')
+        ax[i].set_title(key + ' per spin', color='white')
+    plt.tight_layout()
+    plt.close()
+    return fig
+
 @function_profiler
 def plotSnapshots(results, nsnapshots):
     
@@ -136,13 +755,17 @@ def plotEnergy_magnetization(results):
     return fig
 
 @function_profiler
-def plotSusceptibility(data):
-    ## susceptibility plot
+def plotSusceptibility(data=None, method=None):
+    ## susceptibility plot, nsteps means different things per method so only one method is shown
+    data = ising_store_load() if data is None else data
+    if method is None and len(data['method']): method = data['method'][-1]
+    keep = np.asarray(data['method'], dtype=str) == method
+    data = {key : np.asarray(val)[keep] for key, val in data.items()}
 
     fig, ax = plt.subplots( figsize=(5,3))
-    ax.scatter(x = list(data.keys()), 
-                    y = [data[key]['sus'] for key in data.keys()],
-                    s = [data[key]['size'] for key in data.keys()],
+    ax.scatter(x = data['beta'], 
+                    y = data['sus'],
+                    s = data['size'],
                     color='cyan')
     ax.set_ylabel(r'Susceptibility, $\chi$', color='white')
     ax.set_xlabel(r'Inverse temperature, $\beta$', color='white')
@@ -166,6 +789,228 @@ def metropolisVisualization(beta):
 
 
 # Percolation and Fractals
+@jit(nopython=True)
+def _hoshen_kopelman2d(open_arr):
+    h, w = open_arr.shape
+    labels = np.zeros((h, w), dtype=np.int32)
+    parent = np.zeros((h*w + 1)//2 + 2, dtype=np.int32)
+    n = 1
+    for i in range(h):
+        for j in range(w):
+            if open_arr[i, j]:
+                up = labels[i-1, j] if i > 0 else 0
+                left = labels[i, j-1] if j > 0 else 0
+                if up == 0 and left == 0:
+                    parent[n] = n ; labels[i, j] = n ; n += 1
+                elif up and left:
+                    _uf_union(parent, up, left)
+                    labels[i, j] = _uf_find(parent, up)
+                else:
+                    labels[i, j] = up + left
+    return labels, _relabel(labels.ravel(), parent, n)
+
+@jit(nopython=True)
+def _relabel(flat_labels, parent, n):
+    # number clusters 1..K in order of first appearance (roots are the smallest
+    # provisional label of their cluster), returns the sizes
+    new = np.zeros(n, dtype=np.int32)
+    count = 0
+    for k in range(1, n):
+        root = _uf_find(parent, k)
+        if root == k: 
+            count += 1 ; new[k] = count
+        else: 
+            new[k] = new[root]
+    sizes = np.zeros(count + 1, dtype=np.int64)
+    for idx in range(flat_labels.size):
+        flat_labels[idx] = new[flat_labels[idx]]
+        sizes[flat_labels[idx]] += 1
+    return sizes[1:]
+
+@jit(nopython=True)
+def _hoshen_kopelman3d(open_arr):
+    d, h, w = open_arr.shape
+    labels = np.zeros((d, h, w), dtype=np.int32)
+    parent = np.zeros(d*h*w + 1, dtype=np.int32)
+    n = 1
+    for i in range(d):
+        for j in range(h):
+            for k in range(w):
+                if not open_arr[i, j, k]: continue
+                label = 0
+                for neighbour in (labels[i-1, j, k] if i > 0 else 0, 
+                                  labels[i, j-1, k] if j > 0 else 0, 
+                                  labels[i, j, k-1] if k > 0 else 0):
+                    if neighbour == 0: continue
+                    if label == 0: label = neighbour
+                    else: _uf_union(parent, label, neighbour)
+                if label == 0:
+                    parent[n] = n ; labels[i, j, k] = n ; n += 1
+                else:
+                    labels[i, j, k] = _uf_find(parent, label)
+    return labels, _relabel(labels.ravel(), parent, n)
+
+@function_profiler
+def hoshen_kopelman(open_arr):
+    """
+    Hoshen-Kopelman labelling of nearest-neighbour clusters of open (True) sites
+    on a 2d or 3d grid. Returns an int32 label image, 0 for closed sites and 
+    1..K for the clusters, and the K cluster sizes.
+    """
+    open_arr = np.ascontiguousarray(open_arr, dtype=np.bool_)
+    return {2 : _hoshen_kopelman2d, 3 : _hoshen_kopelman3d}[open_arr.ndim](open_arr)
+
+@function_profiler
+def percolation_observables(labels, sizes, axis=0):
+    """
+    Observables of a labelled grid (2d or 3d, without padding). A cluster spans
+    if it touches both faces normal to `axis`. Returns the spanning labels, 
+    P_inf (fraction of all sites in spanning clusters), the 'mean finite 
+    cluster size' sum(s^2)/sum(s) over the non-spanning clusters (the 
+    susceptibility) and the radius of gyration of every cluster.
+    """
+    first, last = np.take(labels, 0, axis=axis), np.take(labels, -1, axis=axis)
+    spanning = np.intersect1d(first[first > 0], last[last > 0])
+    finite = np.ones(len(sizes), dtype=bool) ; finite[spanning-1] = False
+
+    flat = labels.ravel()
+    occupied = np.flatnonzero(flat)
+    lab, sizes_ = flat[occupied], np.maximum(sizes, 1)
+    rg2 = np.zeros(len(sizes))
+    for x in np.unravel_index(occupied, labels.shape):
+        mean = np.bincount(lab, weights=x, minlength=len(sizes)+1)[1:] / sizes_
+        mean2 = np.bincount(lab, weights=x.astype(float)**2, minlength=len(sizes)+1)[1:] / sizes_
+        rg2 += mean2 - mean**2
+
+    return {'spanning' : spanning,
+            'percolates' : len(spanning) > 0,
+            'P_inf' : sizes[spanning-1].sum() / labels.size,
+            'mean finite cluster size' : (sizes[finite].astype(float)**2).sum() / max(sizes[finite].sum(), 1),
+            'radius of gyration' : np.sqrt(np.maximum(rg2, 0))}
+
+@function_profiler
+def percolation_3d(size=32, p=0.3116, seed=None):
+    # site percolation on a size^3 cubic grid, p_c ~ 0.3116
+    np.random.seed(seed)
+    labels, sizes = hoshen_kopelman(np.random.uniform(0,1,(size,size,size)) < p)
+    return labels, sizes, percolation_observables(labels, sizes)
+
+@function_profiler
+def plotPercolationObservables(size, ps, seed=42, dim=2):
+    P_inf, chi = [], []
+    for p in ps:
+        np.random.seed(seed)
+        labels, sizes = hoshen_kopelman(np.random.uniform(0,1,(size,)*dim) < p)
+        obs = percolation_observables(labels, sizes)
+        P_inf.append(obs['P_inf']) ; chi.append(obs['mean finite cluster size'])
+
+    fig, ax = plt.subplots(1,2, figsize=(8,2.5))
+    ax[0].plot(ps, P_inf, c='white')
+    ax[0].set_ylabel(r'$P_\infty$', color='white')
+    ax[1].plot(ps, chi, c='white')
+    ax[1].set_ylabel(r'Mean finite cluster size, $\chi$', color='white')
+    for a in ax: a.set_xlabel(r'$p$', color='white')
+    fig.suptitle(f'{dim}d site percolation, L={size}', color='white')
+    plt.close()
+    return fig
+
+@jit(nopython=True)
+def _newman_ziff2d(order, h, w, snapshot_ns):
+    # occupy sites in the given order, merging clusters by size with union-find.
+    # Index n of the outputs holds the state with n occupied sites.
+    N = h*w
+    parent = np.full(N, -1, dtype=np.int64)  # -1 is an empty site
+    csize = np.zeros(N, dtype=np.int64)
+    n_clusters, largest = np.zeros(N+1, dtype=np.int64), np.zeros(N+1, dtype=np.int64)
+    sum_s2 = np.zeros(N+1)
+    snapshots = np.zeros((len(snapshot_ns), h, w), dtype=np.int64)
+    nc, big, s2, snap = 0, 0, 0., 0
+    while snap < len(snapshot_ns) and snapshot_ns[snap] == 0: snap += 1
+    for n in range(N):
+        site = order[n]
+        parent[site], csize[site] = site, 1
+        nc += 1 ; s2 += 1 ; big = max(big, 1)
+        i, j = site//w, site%w
+        for d in range(4):
+            ni, nj = i + _DI[d], j + _DJ[d]
+            if ni < 0 or nj < 0 or ni >= h or nj >= w or parent[ni*w + nj] == -1: continue
+            a, b = _uf_find(parent, site), _uf_find(parent, ni*w + nj)
+            if a == b: continue
+            if csize[a] < csize[b]: a, b = b, a
+            s2 += 2. * csize[a] * csize[b]
+            parent[b] = a ; csize[a] += csize[b]
+            nc -= 1 ; big = max(big, csize[a])
+        n_clusters[n+1], largest[n+1], sum_s2[n+1] = nc, big, s2
+        while snap < len(snapshot_ns) and snapshot_ns[snap] == n+1:
+            for k in range(N):
+                if parent[k] != -1: snapshots[snap, k//w, k%w] = _uf_find(parent, k) + 1
+            snap += 1
+    return n_clusters, largest, sum_s2, snapshots
+
+@jit(nopython=True, parallel=True)
+def _newman_ziff_batch(h, w, seeds, n_clusters, largest, sum_s2):
+    for k in prange(len(seeds)):
+        np.random.seed(seeds[k])
+        n_clusters[k], largest[k], sum_s2[k], _ = _newman_ziff2d(np.random.permutation(h*w), h, w, np.zeros(0, dtype=np.int64))
+
+@function_profiler
+def newman_ziff(size, seed=None, snapshot_ps=[]):
+    """
+    Newman-Ziff site percolation on a size x size grid (open boundaries): sites
+    are added in random order and every observable is recorded as a function of 
+    the number of occupied sites n in a single pass. Use `newman_ziff_canonical` 
+    to get them at any p. `snapshot_ps` gives label images (and cluster sizes) 
+    at n = round(p*N), all from the same sequence of added sites. The 'site 
+    weighted cluster size' is sum(s^2)/n over all clusters, the largest included.
+    """
+    np.random.seed(seed)
+    N = size**2
+    snapshot_ns = np.round(np.asarray(snapshot_ps, dtype=float)*N).astype(np.int64)
+    sort = np.argsort(snapshot_ns, kind='stable')
+    n_clusters, largest, sum_s2, snapshots = _newman_ziff2d(np.random.permutation(N), size, size, snapshot_ns[sort])
+
+    n = np.arange(N+1)
+    results = {'n' : n,
+               'number of clusters' : n_clusters, 
+               'largest cluster' : largest, 
+               'site weighted cluster size' : sum_s2 / np.maximum(n, 1),
+               'snapshots' : {}}
+    for k, idx in enumerate(sort):
+        # make labels contiguous, 1..K
+        uniq, inv = np.unique(snapshots[k], return_inverse=True)
+        labels = (inv.reshape(size, size) if uniq[0] == 0 else inv.reshape(size, size) + 1).astype(np.int32)
+        results['snapshots'][snapshot_ps[idx]] = (labels, np.bincount(labels.ravel())[1:])
+    return results
+
+@function_profiler
+def newman_ziff_ensemble(size, nseeds, seed=None, chunk=64):
+    """Average the Newman-Ziff curves over `nseeds` independent orderings,
+    run `chunk` at a time in parallel."""
+    N = size**2
+    seeds = np.random.SeedSequence(seed).generate_state(nseeds)
+    means = {key : np.zeros(N+1) for key in ['number of clusters', 'largest cluster', 'site weighted cluster size']}
+    for start in range(0, nseeds, chunk):
+        batch = seeds[start:start+chunk]
+        n_clusters, largest = np.empty((len(batch), N+1), dtype=np.int64), np.empty((len(batch), N+1), dtype=np.int64)
+        sum_s2 = np.empty((len(batch), N+1))
+        _newman_ziff_batch(size, size, batch, n_clusters, largest, sum_s2)
+        means['number of clusters'] += n_clusters.sum(axis=0) / nseeds
+        means['largest cluster'] += largest.sum(axis=0) / nseeds
+        means['site weighted cluster size'] += sum_s2.sum(axis=0) / np.maximum(np.arange(N+1), 1) / nseeds
+    return dict(n=np.arange(N+1), **means)
+
+def newman_ziff_canonical(results, ps, keys=['number of clusters', 'largest cluster', 'site weighted cluster size']):
+    # Q(p) = sum_n B(N, n, p) Q_n, summed where the binomial weight is non-negligible
+    N = len(results['n']) - 1
+    out = {'p' : np.asarray(ps)}
+    for key in keys: out[key] = np.empty(len(ps))
+    for k, p in enumerate(ps):
+        sd = np.sqrt(N*p*(1-p))
+        lo, hi = max(0, int(N*p - 10*sd) - 1), min(N, int(N*p + 10*sd) + 1)
+        weights = binom.pmf(np.arange(lo, hi+1), N, p)
+        for key in keys: out[key][k] = np.dot(weights, results[key][lo:hi+1])
+    return out
+
 @function_profiler
 def percolation(size=10, seed=69, p=0.4,marker='.', devmod=False):
     def makeGrid(size, seed=42): 
@@ -174,83 +1019,37 @@ def percolation(size=10, seed=69, p=0.4,marker='.', devmod=False):
         grid[1:-1, 1:-1] = np.random.uniform(0,1,(size,size))
         return grid
 
-    def checkNeighbours(pos, grid, domain, visited):
-        (i,j) = pos
-        neighbours = [(i-1,j), (i+1,j), (i,j-1), (i, j+1)]
-        for n in neighbours:
-            if (n[0]>=0) and (n[1]>=0) and (n[0]<len(grid)) and (n[1]<len(grid)):
-                if grid[n] and (n not in visited):
-                    domain.add(n) ; visited.add(n)
-                    domain_, visited_ = checkNeighbours(n, grid, domain, visited)
-                    domain = domain.union(domain_)
-                    visited = visited.union(visited_)
-                else: visited.add(n)
-        return domain, visited
-
-    def getDomains(grid, p=.5):
-        open_arr = grid < p
-        domains = {} ; index = 0; visited = set()
-        for i, _ in enumerate(open_arr):
-            for j, val in enumerate(open_arr[i]):
-                if val:
-                    if (i,j) in visited:
-                        domain, visited_ = checkNeighbours((i,j), open_arr, domain=set(), visited=visited)
-                    else:
-                        visited.add((i,j))
-                        domain, visited_ = checkNeighbours((i,j), open_arr, domain=set([(i,j)]), visited=visited)
-                    
-                    visited = visited.union(visited_)
-                    if len(domain) > 0:
-                        domains[index] = domain
-                        index+=1
-                else: visited.add((i,j))
-        
-        new_domains = {}
-        index = 0
-        for d in domains:
-            if len(domains[d]) !=0:
-                new_domains[index] = domains[d]
-                index += 1
-                
-        return new_domains
-
     grid = makeGrid(size,seed)
-    domains = getDomains(grid, p)
-    #if devmod: return domains
-    x = np.arange(size+2)
-    X,Y = np.meshgrid(x,x)
-    xx = np.concatenate([list(domains[i]) for i in domains])
+    labels, sizes = hoshen_kopelman(grid < p)
     
     if devmod:
-       return domains, xx
+       return labels, sizes
     else:
+        x = np.arange(size+2)
+        X,Y = np.meshgrid(x,x)
         fig, ax = plt.subplots()
         # background
         ax.scatter(X,Y, c='black')
 
         # colors
-        colors = sns.color_palette("hls", len(domains))
+        colors = np.array(sns.color_palette("hls", len(sizes))).reshape(-1,3)
         np.random.shuffle(colors)
-        colors = np.concatenate([[colors[i]]*len(domains[i]) for i in domains])
+        xx = np.argwhere(labels)
 
         # plot
-        ax.scatter(xx[:,0], xx[:,1], c=colors, marker=marker)
+        ax.scatter(xx[:,0], xx[:,1], c=colors[labels[xx[:,0], xx[:,1]]-1], marker=marker)
         ax.set(xticks = [], yticks = [], facecolor='black')
         plt.close()
         
-        return fig, domains
+        return fig, labels, sizes
 
 @function_profiler
 def percolation_many_ps(n_ps, size, seed):
-        Ns = {}
-        for p_ in np.linspace(0.01,.9,n_ps):
-            domains, __ = percolation(size, seed, p_, devmod=True)
-            Ns[p_] = {'number of domains':len(domains),
-                        'domain sizes' : [len(domains[i]) for i in domains]
-                    }
+        # one Newman-Ziff pass gives N(p) for every p
+        Ns = newman_ziff_canonical(newman_ziff(size, seed), np.linspace(0.01,.9,n_ps))
         
         fig, ax = plt.subplots(figsize=(5,2))
-        ax.plot(Ns.keys(),[Ns[i]['number of domains'] for i in Ns] , c='white')
+        ax.plot(Ns['p'], Ns['number of clusters'] , c='white')
         ax.set_xlabel(r'$p$', color='white')
         ax.set_ylabel(r'Number of domains, $N$', color='white')
         plt.close()
@@ -259,18 +1058,14 @@ def percolation_many_ps(n_ps, size, seed):
 @function_profiler
 def animate_many_percolations(size=30 , steps = 10, filename='animation.gif', fps=5):
     def many_perc(size = 30, low=0.01, high=0.9, steps=10, seed=42, marker='.'):
+        # nested frames from a single Newman-Ziff pass
+        ps = np.linspace(low, high, steps)
+        snapshots = newman_ziff(size, seed, snapshot_ps=ps)['snapshots']
         out = {}
-        for p in np.linspace(low, high, steps):
-            domains, xx = percolation(size, seed, p,marker, devmod=True)#[0]
-            N = len(domains)
-            sizes = np.array([len(domains[i]) for i in domains])#.reshape(-1,1)
-            
-            idx = 1 if p> 0.3 else 0
-            idx = 2 if p> 0.7 else idx 
-            
-            out[p] = {'domains' : domains, 
-                        'sizes' : sizes, 
-                        'xx' : xx}
+        for p in ps:
+            labels, sizes = snapshots[p]
+            out[p] = {'labels' : labels, 
+                        'sizes' : sizes}
         return out
 
     def animate(out, filename='animation.gif', fps=5):
@@ -300,13 +1095,12 @@ def animate_many_percolations(size=30 , steps = 10, filename='animation.gif', fp
             ax[1].set(yscale='log')
             
             # imshow
-            domains = out[p]['domains']
-            colors_im = sns.color_palette("hls", len(domains))
-            if len(domains) > 20: np.random.shuffle(colors_im)
-            colors_im = np.concatenate([[colors_im[i]]*len(domains[i]) for i in domains])
+            labels = out[p]['labels']
+            colors_im = np.array(sns.color_palette("hls", len(out[p]['sizes']))).reshape(-1,3)
+            if len(colors_im) > 20: np.random.shuffle(colors_im)
             
-            xx = out[p]['xx']
-            ax_im.scatter(xx[:,0], xx[:,1], c=colors_im, marker='.')
+            xx = np.argwhere(labels)
+            ax_im.scatter(xx[:,0], xx[:,1], c=colors_im[labels[xx[:,0], xx[:,1]]-1], marker='.')
             ax_im.set(xticks = [], yticks = [], facecolor='black')
             
             plt.tight_layout()
@@ -320,73 +1114,84 @@ def animate_many_percolations(size=30 , steps = 10, filename='animation.gif', fp
     out = many_perc(size = size, steps=steps)
     animate(out, filename=filename, fps=fps)
 
+def bethe_lattice_parents(n_nodes, degree=3):
+    # breadth-first numbering: node 0 has `degree` children, every other node degree-1,
+    # so parents[k] < k. The root gets parent -1.
+    k = np.arange(n_nodes)
+    parents = np.where(k <= degree, 0, 1 + (k - degree - 1)//(degree - 1))
+    parents[0] = -1
+    return parents
+
+def bethe_lattice_csr(n_nodes, degree=3):
+    parents = bethe_lattice_parents(n_nodes, degree)
+    child = np.arange(1, n_nodes)
+    return sparse.csr_matrix((np.ones(2*(n_nodes-1)), (np.r_[child, parents[1:]], np.r_[parents[1:], child])), 
+                             shape=(n_nodes, n_nodes))
+
+@jit(nopython=True)
+def _tree_cluster_labels(parents, open_sites, open_bonds):
+    # union-find on a tree: the parent array is the forest and parents come 
+    # before children, so each find is a single lookup
+    n = len(parents)
+    labels = np.zeros(n, dtype=np.int64)
+    count = 0
+    for k in range(n):
+        if not open_sites[k]: continue
+        if k > 0 and open_sites[parents[k]] and open_bonds[k]:
+            labels[k] = labels[parents[k]]
+        else:
+            count += 1 ; labels[k] = count
+    return labels, count
+
+@jit(nopython=True)
+def _tree_largest_clusters(parents, r, ps, site):
+    largest = np.zeros(len(ps), dtype=np.int64)
+    ones = np.ones(len(parents), dtype=np.bool_)
+    for i in range(len(ps)):
+        open_ = r < ps[i]
+        labels, count = _tree_cluster_labels(parents, open_ if site else ones, ones if site else open_)
+        sizes = np.bincount(labels, minlength=count+1)
+        largest[i] = sizes[1:].max() if count > 0 else 0
+    return largest
+
 @function_profiler
-def betheLattice(p=0.1, size=62, get_many=False, ps=[.5], degree=3):
-    def makeBetheLattice(n_nodes = 10, degree=3):
-        M = np.zeros((n_nodes,n_nodes))
+def bethe_percolation(n_nodes, ps, degree=3, kind='site', seed=None, largest=True):
+    """
+    Site or bond percolation on a Bethe lattice (regular tree) of n_nodes, one 
+    uniform number per node (or per bond to its parent) shared by all ps. 
+    The number of clusters is counted for every p at once; the largest cluster
+    needs one labelling pass per p.
+    """
+    np.random.seed(seed)
+    ps = np.asarray(ps, dtype=float)
+    parents = bethe_lattice_parents(n_nodes, degree)
+    r = np.random.rand(n_nodes)
+    if kind == 'site':
+        # k starts a cluster when it is open and its parent is not: r_k < p <= r_parent
+        r_parent = np.where(parents >= 0, r[np.maximum(parents, 0)], np.inf)
+        n_clusters = (np.searchsorted(np.sort(r), ps) 
+                      - np.searchsorted(np.sort(np.maximum(r, r_parent)), ps))
+    elif kind == 'bond':
+        # every open bond (to the parent) merges two clusters
+        n_clusters = n_nodes - np.searchsorted(np.sort(r[1:]), ps)
+    else:
+        raise ValueError(f'unknown percolation kind {kind}')
 
-        idx = 1
-        for i, _ in enumerate(M):
-            if i ==0: n =degree
-            else: n = degree-1
-            M[i, idx:idx+n] = 1
-            idx+=n
-        return M+M.T
+    results = {'p' : ps, 'number of clusters' : n_clusters}
+    if largest: results['largest cluster'] = _tree_largest_clusters(parents, r, ps, kind == 'site')
+    return results
 
-    def checkOpenNeighbours(open_neighbours,visited, domain, open_arr):
-        
-        for j in open_neighbours:
-            if j not in visited:
-                domain.append(j)
-                visited.add(j)
-                open_neighbours = np.argwhere(M[j] * open_arr).flatten()
-                open_neighbours = open_neighbours[open_neighbours!=j]
-                visited_, domain_ = checkOpenNeighbours(open_neighbours,visited, domain,open_arr)
-                visited = visited.union(visited_)
-                domain += domain
-        return visited, domain
-        
-    def getDomains(M, p=0.3):
-        
-        open_arr = p>np.random.rand(len(M))
-        visited = set()
-        domains = []
-        for i in range(len(M)):
-
-            if i not in visited:
-                if open_arr[i]:
-                    domain = []
-                    visited.add(i)
-                    domain.append(i)
-
-                    open_neighbours = np.argwhere(M[i] * open_arr).flatten()
-                    open_neighbours = open_neighbours[open_neighbours!=i]
-                    if len(open_neighbours)>0:
-                        visited_, domain_ = checkOpenNeighbours(open_neighbours,visited, domain,open_arr)
-                        visited = visited.union(visited_)
-                        domain += domain
-                    domains.append(set(domain))
-
-        return domains
-                    
-                
-    def draw_from_matrix(M, domains) :
-        
-        inDomain = {}
-        for idx, d in enumerate(domains):
-            for i in d: inDomain[i] = idx   
-        
+@function_profiler
+def betheLattice(p=0.1, size=62, get_many=False, ps=[.5], degree=3, kind='site'):
+    def draw(parents, labels) :
         G = nx.Graph()
-        for i, line in enumerate(M): G.add_node(i)
+        G.add_nodes_from(range(len(parents)))
+        G.add_edges_from(zip(range(1, len(parents)), parents[1:]))
 
-        for i, line in enumerate(M):
-            for j, val in enumerate(line):
-                if (i != j) and (val==1): 
-                    G.add_edge(i, j)
-        palette = sns.color_palette('hls', len(domains))
-        color_map = ['black' if i not in inDomain.keys() else palette[inDomain[i]] for i in range(len(M))]
+        palette = sns.color_palette('hls', labels.max())
+        color_map = ['black' if l == 0 else palette[l-1] for l in labels]
 
-        if len(palette) == 0: color_map = ['orange'] * len(M)
+        if len(palette) == 0: color_map = ['orange'] * len(parents)
 
         fig = plt.figure()
         nx.draw_networkx(G, node_color=color_map, pos=nx.kamada_kawai_layout(G))
@@ -394,35 +1199,76 @@ def betheLattice(p=0.1, size=62, get_many=False, ps=[.5], degree=3):
         return fig
         
     if get_many == False:
-        M = makeBetheLattice(size, degree=degree)
-        domains = getDomains(M,p)
-        return draw_from_matrix(M,domains)
+        parents = bethe_lattice_parents(size, degree)
+        r = np.random.rand(size)
+        ones = np.ones(size, dtype=bool)
+        labels, _ = _tree_cluster_labels(parents, r < p if kind == 'site' else ones, 
+                                                  r < p if kind == 'bond' else ones)
+        return draw(parents, labels)
 
     else:
-        Ns = {}
-        M = makeBetheLattice(size)
-        for p in ps:
-            Ns[p] = len(getDomains(M,p))
-        return Ns
+        Ns = bethe_percolation(size, ps, degree, kind, largest=False)['number of clusters']
+        return dict(zip(ps, Ns))
+
+@jit(nopython=True, parallel=True)
+def _escape_time_kernel(re, im, a, n, R2, eps, tile, counts, stable):
+    # z -> z**a + c per pixel, stopping once |z| > bailout, or (for a > 1) once 
+    # the orbit comes back within eps of a saved point, i.e. it is periodic and 
+    # never escapes. The arithmetic stays in the dtype of re/im, so constants 
+    # are built from the inputs.
+    h, w = len(im), len(re)
+    four = R2 - R2 + 4
+    half_a = a / (a - a + 2)
+    log_a = np.log(a)
+    for t in prange((h + tile - 1)//tile):
+        for i in range(t*tile, min(h, (t+1)*tile)):
+            cy = im[i]
+            for j in range(w):
+                cx = re[j]
+                x, y, r2 = cx - cx, cy - cy, cx - cx
+                x_saved, y_saved, next_save = x, y, 8
+                k = 0
+                while k < n:
+                    if a == 2:
+                        x, y = x*x - y*y + cx, (x + x)*y + cy
+                    else:
+                        rp, theta = r2**half_a, a*np.arctan2(y, x)
+                        x, y = rp*np.cos(theta) + cx, rp*np.sin(theta) + cy
+                    k += 1
+                    r2 = x*x + y*y
+                    if r2 > R2: break
+                    if a > 1:
+                        if abs(x - x_saved) < eps and abs(y - y_saved) < eps:
+                            k = n ; break
+                        if k == next_save:
+                            x_saved, y_saved, next_save = x, y, 2*next_save
+                stable[i, j] = r2 <= four
+                if r2 > R2 and a > 1: 
+                    counts[i, j] = k + 1 - np.log(0.5*np.log(r2))/log_a  # smooth count
+                else:
+                    counts[i, j] = k
 
 @function_profiler
-def run_fractals(size_fractal, a ,n):
-    def stable(z):
-        try: return False if abs(z) > 2 else True
-        except OverflowError: return False
-    stable = np.vectorize(stable)
-
-    def mandelbrot(c, a, n=50):
-        z = 0
-        for i in range(n): z = z**a + c
-        return z
-
-    def makeGrid(resolution, lims=[-1.85, 1.25, -1.45, 1.45]):
-        re = np.linspace(lims[0], lims[1], resolution)[::-1]
-        im = np.linspace(lims[2], lims[3], resolution)
-        re, im = np.meshgrid(re,im)
-        return re+im*1j
+def escape_time(resolution, a=2., n=50, lims=[-1.85, 1.25, -1.45, 1.45], dtype=np.float64, bailout=2.**8, tile=16):
+    """
+    Escape-time render of z -> z**a + c, z_0 = 0, on the same grid as 
+    `run_fractals` (rows: Im, columns: Re reversed). Pixels stop iterating
+    once |z| > bailout or once their orbit is found to be periodic. Returns 
+    smooth iteration counts (n for pixels that never escape) and the `stable`
+    mask (|z| <= 2 after n iterations). Rows are computed in parallel tiles 
+    of `tile` rows, in float32 or float64.
+    """
+    (w, h) = (resolution, resolution) if np.ndim(resolution) == 0 else resolution
+    dtype = np.dtype(dtype).type
+    re = np.linspace(lims[0], lims[1], w, dtype=dtype)[::-1].copy()
+    im = np.linspace(lims[2], lims[3], h, dtype=dtype)
+    counts, stable = np.empty((h, w), dtype=dtype), np.empty((h, w), dtype=np.bool_)
+    eps = dtype(1e-5 if dtype == np.float32 else 1e-12)
+    _escape_time_kernel(re, im, dtype(a), n, dtype(bailout**2), eps, tile, counts, stable)
+    return counts, stable
 
+@function_profiler
+def run_fractals(size_fractal, a ,n, dtype=np.float64):
     def plot_(res):
         fig = plt.figure(figsize=(12,6))
         plt.imshow(res.T, cmap='magma')
@@ -432,46 +1278,210 @@ def run_fractals(size_fractal, a ,n):
         plt.close()
         return fig
 
-    res = stable(mandelbrot(makeGrid(size_fractal,  lims=[-1.85, 1.25, -1.3, 1.3]), a=a, n=n))
+    _, res = escape_time(size_fractal, a, n, lims=[-1.85, 1.25, -1.3, 1.3], dtype=dtype)
     return plot_(res), res
 
+fractal_tile_path = cache_path + 'fractal_tiles/'
+fractal_base_lims = [-2.1, 1.1, -1.6, 1.6]  # square covered by the single tile at zoom 0
+
+class FractalTileCache():
+    """
+    Bounded LRU cache of escape-time tiles, keyed by (zoom, ix, iy, a, n, 
+    tile_size). Holds up to `maxsize` tiles in memory and `maxdisk` npz files
+    in `path`; the least recently used are dropped first.
+    """
+    def __init__(self, maxsize=256, maxdisk=4096, path=fractal_tile_path):
+        self.maxsize, self.maxdisk, self.path = maxsize, maxdisk, path
+        self.tiles = OrderedDict()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def filename(self, key):
+        return self.path + 'tile_z{}_x{}_y{}_a{!r}_n{}_t{}.npz'.format(*key)
+
+    def get(self, key):
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return self.tiles[key]
+        if self.maxdisk and os.path.exists(self.filename(key)):
+            os.utime(self.filename(key))
+            self.disk_hits += 1
+            tile = np.load(self.filename(key))['counts']
+            self._put_memory(key, tile)
+            return tile
+        self.misses += 1
+
+    def put(self, key, tile):
+        self._put_memory(key, tile)
+        if not self.maxdisk: return
+        os.makedirs(self.path, exist_ok=True)
+        np.savez(self.filename(key), counts=tile)
+        files = [self.path + f for f in os.listdir(self.path) if f.endswith('.npz')]
+        if len(files) > self.maxdisk:
+            for f in sorted(files, key=os.path.getmtime)[:len(files) - self.maxdisk]:
+                os.remove(f)
+
+    def _put_memory(self, key, tile):
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.maxsize: self.tiles.popitem(last=False)
+
+_fractal_tile_cache = FractalTileCache()
+
+def _tile_pixel(zoom, tile_size):
+    return (fractal_base_lims[1]-fractal_base_lims[0]) / (2**zoom * tile_size)
+
 @function_profiler
-def fractal_dimension(res):
+def fractal_tile(zoom, ix, iy, a=2., n=50, tile_size=256, cache=_fractal_tile_cache):
+    """
+    Smooth escape counts (float32, rows: Im, columns: Re, both increasing) of 
+    tile (ix, iy) at `zoom`, where zoom level z splits `fractal_base_lims` 
+    into 2**z x 2**z tiles of tile_size**2 pixels. Pixels sit at pixel centres,
+    so neighbouring tiles and zoom levels line up.
+    """
+    key = (zoom, ix, iy, float(a), n, tile_size)
+    tile = cache.get(key) if cache is not None else None
+    if tile is None:
+        d = _tile_pixel(zoom, tile_size)
+        x0, y0 = fractal_base_lims[0] + ix*tile_size*d, fractal_base_lims[2] + iy*tile_size*d
+        x1, y1 = x0 + tile_size*d, y0 + tile_size*d
+        # escape_time reverses the Re axis, so hand it the limits reversed
+        tile, _ = escape_time(tile_size, a, n, lims=[x1 - d/2, x0 + d/2, y0 + d/2, y1 - d/2])
+        tile = tile.astype(np.float32)
+        if cache is not None: cache.put(key, tile)
+    return tile
 
-    def get_box_counts(box_sizes):
+@function_profiler
+def fractal_view(center=(-.35, 0.), zoom=0, a=2., n=50, shape=(512, 512), tile_size=256, cache=_fractal_tile_cache):
+    """
+    (h, w) = `shape` pixels of the zoom level `zoom` centred on `center`
+    (re, im), mosaicked from cached tiles. Rows run along Im, columns along Re.
+    """
+    h, w = shape
+    d = _tile_pixel(zoom, tile_size)
+    px0 = int(np.floor((center[0] - fractal_base_lims[0])/d)) - w//2
+    py0 = int(np.floor((center[1] - fractal_base_lims[2])/d)) - h//2
+    tx0, ty0 = px0//tile_size, py0//tile_size
+    tx1, ty1 = (px0 + w - 1)//tile_size, (py0 + h - 1)//tile_size
+    mosaic = np.block([[fractal_tile(zoom, ix, iy, a, n, tile_size, cache) 
+                            for ix in range(tx0, tx1+1)] for iy in range(ty0, ty1+1)])
+    ox, oy = px0 - tx0*tile_size, py0 - ty0*tile_size
+    return mosaic[oy:oy+h, ox:ox+w]
+
+def fractal_view_progressive(center=(-.35, 0.), zoom=0, a=2., n=50, shape=(512, 512), tile_size=256, coarse_levels=2, cache=_fractal_tile_cache):
+    """
+    Yields (level, image) from `coarse_levels` zoom levels below `zoom` up to 
+    `zoom`. Coarse images cover the same region with 4x fewer pixels per level
+    and are upsampled to `shape`, so a first frame is ready while the sharp 
+    tiles are computed (or read back from the cache).
+    """
+    h, w = shape
+    for level in range(max(zoom - coarse_levels, 0), zoom + 1):
+        k = 2**(zoom - level)
+        img = fractal_view(center, level, a, n, (-(-h//k), -(-w//k)), tile_size, cache)
+        yield level, np.repeat(np.repeat(img, k, axis=0), k, axis=1)[:h, :w]
 
-        boxcounts, SQUARES = {}, {}
-        for box_size in box_sizes:
-            box_size = int(box_size)
-            
-            steps = res.shape[0]//box_size - 1
-            squares = np.zeros((steps, steps))
-            
-            for i in range(steps):
-                for j in range(steps):
-                    _sum = np.sum(res[i*box_size : (i+1)*box_size, 
-                            j*box_size : (j+1)*box_size])
-                    squares[i,j] = 1 if _sum not in [0,box_size**2] else 0
-
-            SQUARES[box_size] = squares.copy()
-            boxcounts[box_size] = np.sum(squares)
-        return boxcounts, SQUARES
-    
-    box_sizes = np.arange(2,np.shape(res)[0]//15, dtype=float)
-    boxcounts, SQUARES = get_box_counts(box_sizes)
-    
+@function_profiler
+def plotFractalView(img, n, center, zoom):
+    fig = plt.figure(figsize=(8,8))
+    plt.imshow(img, cmap='magma', origin='lower', vmin=0, vmax=n)
+    plt.xticks([]); plt.yticks([])
+    plt.title(f'center = {center[0]:.6f} + {center[1]:.6f}i,  zoom level {zoom}', color='blue')
+    plt.close()
+    return fig
+
+def _summed_area_table(mask):
+    # int32 holds counts up to 2**31 pixels
+    S = np.zeros((mask.shape[0]+1, mask.shape[1]+1), dtype=np.int32)
+    np.cumsum(mask, axis=0, out=S[1:, 1:])
+    np.cumsum(S[1:, 1:], axis=1, out=S[1:, 1:])
+    return S
+
+@jit(nopython=True, parallel=True)
+def _box_counts_kernel(mask, box_sizes, boundary, entropy, corr):
+    h, w = mask.shape
+    S = np.zeros((h+1, w+1), dtype=np.int32)
+    for i in range(h):
+        row = 0
+        for j in range(w):
+            row += mask[i, j]
+            S[i+1, j+1] = S[i, j+1] + row
+    total = max(S[h, w], 1)
+    for k in prange(len(box_sizes)):
+        s = box_sizes[k]
+        full, nb, H, C = s*s, 0, 0., 0.
+        for i in range(0, (h//s)*s, s):
+            for j in range(0, (w//s)*s, s):
+                m = np.int64(S[i+s, j+s]) - S[i, j+s] - S[i+s, j] + S[i, j]
+                if m != 0 and m != full: nb += 1
+                if m > 0:
+                    p = m/total
+                    H -= p*np.log(p) ; C += p*p
+        boundary[k], entropy[k], corr[k] = nb, H, C
+
+@function_profiler
+def box_counts(mask, box_sizes=None, method='numpy', keep=[]):
+    """
+    Box counting of a 2d boolean `mask` (any shape) at every box size at once,
+    from a single summed-area table; only whole boxes are counted. Returns a 
+    dict with the box sizes, the number of boundary boxes (partly filled) per
+    size, the Shannon entropy and sum of p**2 of the box masses (for the 
+    information and correlation dimensions), and the box masses of the sizes 
+    in `keep`. method='numba' runs the compiled kernel instead.
+    """
+    mask = np.asarray(mask, dtype=np.uint8)
+    box_sizes = np.arange(2, min(mask.shape)//15) if box_sizes is None else np.asarray(box_sizes)
+    box_sizes = box_sizes.astype(np.int64)
+    S = _summed_area_table(mask) if method != 'numba' or len(keep) else None
+    total = max(mask.sum(), 1)
+    def box_masses(s):
+        T = S[::s, ::s][:mask.shape[0]//s + 1, :mask.shape[1]//s + 1]
+        return T[1:, 1:] - T[:-1, 1:] - T[1:, :-1] + T[:-1, :-1]
+
+    masses = {int(s) : box_masses(int(s)) for s in keep}
+    if method == 'numba':
+        boundary, entropy, corr = (np.zeros(len(box_sizes)) for _ in range(3))
+        _box_counts_kernel(mask, box_sizes, boundary, entropy, corr)
+    else:
+        boundary, entropy, corr = [], [], []
+        for s in box_sizes:
+            m = masses[s] if s in masses else box_masses(s)
+            boundary.append(np.count_nonzero((m != 0) & (m != s*s)))
+            p = m[m > 0] / total
+            entropy.append(-np.sum(p*np.log(p))) ; corr.append(np.sum(p*p))
+
+    return {'box_sizes' : box_sizes, 'boundary' : np.array(boundary), 
+            'entropy' : np.array(entropy), 'corr' : np.array(corr), 'masses' : masses}
+
+def box_dimensions(counts):
+    """
+    Box-counting (capacity), information and correlation dimensions from
+    `box_counts`, as least-squares slopes against log(1/box size).
+    """
+    x = -np.log(counts['box_sizes'])
+    nonzero = counts['boundary'] > 0
+    return {'box' : np.polyfit(x[nonzero], np.log(counts['boundary'][nonzero]), 1)[0],
+            'information' : np.polyfit(x, counts['entropy'], 1)[0],
+            'correlation' : np.polyfit(x, -np.log(counts['corr']), 1)[0]}
+
+@function_profiler
+def fractal_dimension(res, method='numba'):
+    box_sizes = np.arange(2,np.shape(res)[0]//15)
     box_sizes_plot = [box_sizes[0], 
                         box_sizes[len(box_sizes)//2],
                         box_sizes[-1]]
+    counts = box_counts(res, box_sizes, method=method, keep=box_sizes_plot)
+    
     fig, ax = plt.subplots(1,len(box_sizes_plot))
     for i, box_size in enumerate(box_sizes_plot):
-        ax[i].imshow(SQUARES[box_size].T)
+        masses = counts['masses'][box_size]
+        ax[i].imshow(((masses != 0) & (masses != box_size**2)).T)
         ax[i].set(xticks=[],yticks=[])
     plt.close()
     def power_law(x,k,a,b):
         return a*np.exp(k*(b-x))
 
-    y = np.log(list(boxcounts.values()))
+    y = np.log(counts['boundary'])
     x = np.log(res.shape[0]/box_sizes)
     
     def linear(x,a,b):
@@ -493,24 +1503,34 @@ def fractal_dimension(res):
     ax.legend(facecolor='beige')
     ax.grid()
     plt.close()
-    return fig, fig2
+    return fig, fig2, counts
 
 # Phase Transitions and Critical Phenomena
 @function_profiler
-def ising_1d(size, beta, nsteps):
+def ising_1d(size, beta, nsteps, backend='python'):
     chain = np.zeros(size) ; chain[chain<.5] = -1; chain[chain>=.5] = 1
     chain_MF = chain.copy()
 
     # normal approach
     CHAINS, dEs = [], []
-    for _ in range(nsteps):
-        # pick random site
-        i = np.random.randint(0,size-1)
-        dE = (sum(chain[i-1:i+2])-chain[i])*chain[i]
-        if np.random.rand()<np.exp(-beta*dE):
-            chain[i] *= -1
-        CHAINS.append(chain.copy())
-        dEs.append(dE)
+    if backend == 'packed':
+        # nsteps counts sweeps, dEs are the energy changes between sweeps
+        lattice = PackedIsing(size, beta, nreplicas=1, words=np.zeros((1,size), dtype=np.uint64))
+        energies = [lattice.energy()[0]]
+        for _ in range(nsteps):
+            lattice.sweep()
+            CHAINS.append(lattice.spins(0))
+            energies.append(lattice.energy()[0])
+        dEs = np.diff(energies)
+    else:
+        for _ in range(nsteps):
+            # pick random site
+            i = np.random.randint(0,size-1)
+            dE = (sum(chain[i-1:i+2])-chain[i])*chain[i]
+            if np.random.rand()<np.exp(-beta*dE):
+                chain[i] *= -1
+            CHAINS.append(chain.copy())
+            dEs.append(dE)
     CHAINS = np.array(CHAINS)
 
     # MF
@@ -546,36 +1566,80 @@ def ising_1d(size, beta, nsteps):
 
 # SOC
 ## BakSneppen
+@jit(nopython=True)
+def _segment_tree_update(tree, vals, i):
+    # tree[k] holds the index of the smallest value below node k, leaves at len(vals)+i
+    k = (i + len(vals))//2
+    while k >= 1:
+        a, b = tree[2*k], tree[2*k+1]
+        tree[k] = a if vals[a] <= vals[b] else b
+        k //= 2
+
+@jit(nopython=True)
+def _bak_sneppen_run(vals, tree, size, nsteps, normal, snapshot_every, idx_out, min_out, mean_out, snapshots):
+    total = vals[:size].sum()
+    for step in range(nsteps):
+        m = tree[1]
+        idx_out[step], min_out[step] = m, vals[m]
+        for d in (-1, 0, 1):
+            i = (m + d) % size
+            new = np.random.randn() if normal else np.random.random()
+            total += new - vals[i]
+            vals[i] = new
+            _segment_tree_update(tree, vals, i)
+        mean_out[step] = total/size
+        if snapshot_every > 0 and step % snapshot_every == 0:
+            snapshots[step//snapshot_every] = vals[:size]
+
 @function_profiler
-def bakSneppen(size = 100, nsteps = 10000, random_func='uniform'):
-    random = {
-            "uniform" : np.random.rand,
-            "normal" : np.random.randn,
-        }[random_func]
-    chain = random(size)
-    chains, idx_lst = [], []
-    
-    for n in range(nsteps):
-        min_idx = chain.argmin()
-        idx_lst.append(min_idx)
-        for i in [-1,0,1]: chain[(min_idx+i)%size] = random()
-        chains.append(chain.copy())
+def bak_sneppen(size=100, nsteps=10000, random_func='uniform', snapshot_every=0, seed=None):
+    """
+    Bak-Sneppen chain with the minimum found by a segment tree, O(log size)
+    per step. Records the argmin index and minimum value before every step 
+    and the mean fitness after it, plus the chain after every 
+    `snapshot_every`-th step (none for 0), all in preallocated arrays.
+    """
+    rng = np.random.default_rng(seed)
+    _seed_numba(rng.integers(2**31))
+    P = 1 << int(np.ceil(np.log2(max(size, 2))))
+    vals = np.full(P, np.inf)
+    vals[:size] = rng.random(size) if random_func == 'uniform' else rng.standard_normal(size)
+    tree = np.zeros(2*P, dtype=np.int64)
+    tree[P:] = np.arange(P)
+    for k in range(P-1, 0, -1):
+        a, b = tree[2*k], tree[2*k+1]
+        tree[k] = a if vals[a] <= vals[b] else b
+
+    nsnapshots = -(-nsteps//snapshot_every) if snapshot_every > 0 else 0
+    res = {'idx' : np.empty(nsteps, dtype=np.int64), 'min' : np.empty(nsteps), 'mean' : np.empty(nsteps),
+           'snapshots' : np.empty((nsnapshots, size)), 
+           'snapshot_steps' : np.arange(nsnapshots)*snapshot_every}
+    _bak_sneppen_run(vals, tree, size, nsteps, random_func == 'normal', snapshot_every, 
+                     res['idx'], res['min'], res['mean'], res['snapshots'])
+    res['chain'] = vals[:size].copy()
+    return res
 
-    chains, idx_arr = np.array(chains), np.array(idx_lst)
-    return chains, idx_arr, np.mean(chains, axis=1)
+@function_profiler
+def bakSneppen(size = 100, nsteps = 10000, random_func='uniform', max_snapshots=1000, seed=None):
+    # chains are thinned to at most max_snapshots rows, L holds the mean of every step
+    res = bak_sneppen(size, nsteps, random_func, snapshot_every=max(1, -(-nsteps//max_snapshots)), seed=seed)
+    return res['snapshots'], res['idx'], res['mean']
 
 @function_profiler
 def bakSneppen_plot_imshow(X, size, nsteps):
     fig, ax = plt.subplots()
-    ax.imshow(X, aspect  = size/nsteps/2, vmin=0, vmax=1, cmap='gist_rainbow')
+    ax.imshow(X, aspect  = size/nsteps/2, vmin=0, vmax=1, cmap='gist_rainbow', 
+              extent=[0, size, nsteps, 0], interpolation='nearest')
     plt.close()
     return fig
 
 @function_profiler
-def bakSneppen_plot_initial(chains, skip_init, idx_arr):
+def bakSneppen_plot_initial(L, skip_init, idx_arr):
+    # L is the mean value per step (or the chains, one row per step)
+    L = L.mean(axis=1) if np.ndim(L) == 2 else L
     fig, ax = plt.subplots(2,1, figsize=(6,6), dpi=300, sharex=True)
     
-    ax[0].plot(chains.mean(axis=1))
+    ax[0].plot(L)
     ax[0].axvline(skip_init, c='r', ls='--')
     ax[0].set_ylabel('average value', color="white")
 
@@ -588,92 +1652,118 @@ def bakSneppen_plot_initial(chains, skip_init, idx_arr):
     plt.close()
     return fig
 
+avalanche_dtype = np.dtype([('start', np.int64), ('duration', np.int64), ('span', np.int64)])
+
+def _runs(mask, closed=True):
+    # start and end (exclusive) of every run of True, dropping a run still open at the end
+    edges = np.flatnonzero(np.diff(np.r_[0, np.asarray(mask, dtype=np.int8), 0]))
+    starts, ends = edges[::2], edges[1::2]
+    if closed and len(ends) and ends[-1] == len(mask): 
+        starts, ends = starts[:-1], ends[:-1]
+    return starts, ends
+
+def _segment_reduce(ufunc, x, starts, ends):
+    # ufunc over x[starts[k]:ends[k]] for non-empty segments
+    if len(starts) == 0: return x[:0]
+    return ufunc.reduceat(x, np.ravel(np.c_[starts, ends])[:-1 if ends[-1] == len(x) else None])[::2]
+
 @function_profiler
 def avalanches(idx_arr, skip_init=10):
+    """
+    Bak-Sneppen avalanches: runs of steps whose argmin moves by less than 2
+    sites. Returns a structured array (start, duration, span), one row per 
+    closed run, with the span taken over the argmins after the first step.
+    """
+    idx_arr = np.asarray(idx_arr[skip_init or 0:])
+    starts, ends = _runs(np.abs(np.diff(idx_arr)) < 2)
+    aval = np.empty(len(starts), dtype=avalanche_dtype)
+    aval['start'], aval['duration'] = starts + (skip_init or 0), ends - starts
+    aval['span'] = (_segment_reduce(np.maximum, idx_arr[1:], starts, ends) 
+                    - _segment_reduce(np.minimum, idx_arr[1:], starts, ends))
+    return aval
+
+@function_profiler
+def activity_runs(activity, threshold=0):
+    """
+    Runs of consecutive events with activity > threshold (e.g. topplings per
+    grain of a sandpile). Returns a structured array (start, duration, size),
+    size being the summed activity, one row per closed run.
+    """
+    activity = np.asarray(activity)
+    starts, ends = _runs(activity > threshold)
+    runs = np.empty(len(starts), dtype=[('start', np.int64), ('duration', np.int64), ('size', activity.dtype)])
+    runs['start'], runs['duration'] = starts, ends - starts
+    runs['size'] = _segment_reduce(np.add, activity, starts, ends)
+    return runs
+
+@function_profiler
+def power_law_fit(x, xmin=None, discrete=True, min_tail=50, max_candidates=200, xmin_max=np.inf):
+    """
+    Maximum-likelihood exponent of p(x) ~ x**-alpha for x >= xmin (Clauset, 
+    Shalizi & Newman 2009; the discrete case uses their xmin - 1/2 
+    approximation). Without `xmin`, picks the candidate (up to `xmin_max`)
+    minimising the KS distance between the empirical and fitted tails. Works on the histogram
+    of distinct values, so long series cost one np.unique. When no candidate 
+    leaves min_tail events in the tail, the estimates are nan.
+    """
+    values, counts = np.unique(np.asarray(x)[np.asarray(x) > 0], return_counts=True)
+    if len(values) == 0: raise ValueError('power_law_fit needs at least one positive value')
+    nan_fit = {'alpha' : np.nan, 'alpha_err' : np.nan, 'xmin' : np.nan, 'ks' : np.nan, 'n_tail' : 0, 'n' : counts.sum()}
+    shift = .5 if discrete else 0.
+    n_tail = np.cumsum(counts[::-1])[::-1]  # events >= values[k]
+    log_tail = np.cumsum((counts*np.log(values))[::-1])[::-1]  # only xmin is shifted
     
-    idx_arr = idx_arr[skip_init:]
-    avalanches_dict = {}
-    dict_index, counter, indicies = 0, 0, []
-    
-    for prev, i in zip(idx_arr, idx_arr[1:]):
-        aval = abs(prev -  i)<2
-        
-        if aval: 
-            counter += 1
-            indicies.append(i)
-        elif counter > 0:
-            
-            avalanches_dict[dict_index] = {'tspan':counter, 
-                                           'xspan':max(indicies)-min(indicies)}
-            
-            counter = 0 
-            dict_index += 1 
-            indicies = []
-    return avalanches_dict
+    if xmin is None:
+        candidates = np.flatnonzero((n_tail >= min_tail) & (values <= xmin_max))[:-1]
+        if len(candidates) > max_candidates:
+            candidates = np.unique(np.geomspace(1, len(candidates), max_candidates).astype(int) - 1)
+        if len(candidates) == 0: return nan_fit
+    else:
+        k = np.searchsorted(values, xmin)
+        if k == len(values): raise ValueError(f'no values at or above xmin = {xmin}')
+        candidates = [k]
+
+    best = None
+    for k in candidates:
+        n, xm = n_tail[k], values[k] - shift
+        alpha = 1 + n / (log_tail[k] - n*np.log(xm))
+        ccdf_data = n_tail[k:] / n
+        ccdf_model = ((values[k:] - shift)/xm)**(1 - alpha)
+        ks = np.max(np.abs(ccdf_data - ccdf_model))
+        if best is None or ks < best['ks']:
+            best = {'alpha' : alpha, 'alpha_err' : (alpha - 1)/np.sqrt(n), 'xmin' : values[k], 
+                    'ks' : ks, 'n_tail' : n, 'n' : counts.sum()}
+    return best
 
 @function_profiler
-def skipInit(chains, patience=100, tol=0.01):
-    m = chains.mean(axis=1)
+def skipInit(L, patience=100, tol=0.01):
+    # L is the mean value per step (or the chains, one row per step)
+    m = L.mean(axis=1) if np.ndim(L) == 2 else L
     for i, _ in enumerate(m, start=patience):
         if abs(m[i] - np.mean(m[i-patience:i])) < tol:
             return i
 
 @function_profiler
-def plotAvalanches(idx_arr, skip_init, avalanches_dict):
-
-
-    def power_law(x,k,a):
-        return a*x**(-k)
+def plotAvalanches(idx_arr, skip_init, aval):
     
     scaling = st.select_slider('scaling', options=['linear/linear', 'log/linear', 'linear/log', 'log/log', ])
     scaling = scaling.split('/')
 
     fig, ax = plt.subplots(1,2, figsize=(8,6), dpi=300)
 
-    tspan = [avalanches_dict[i]['tspan'] for i in avalanches_dict]
-    
-    log_min, log_max = np.log10(min(tspan)), np.log10(max(tspan))
-    
-    #a = ax[0].hist(tspan, bins=np.linspace(min(tspan), max(tspan), 20))
-    a = ax[0].hist(tspan, bins=np.logspace(log_min, log_max, 20))
-    counts = ydata = a[0]
-    bins = a[1]
-    xdata = ((bins+np.roll(bins,-1))/2)[:-1]
-    xdata = xdata[ydata!=0]
-    ydata = ydata[ydata!=0]
-    popt, pcov = curve_fit(power_law, xdata, ydata,p0=[10, 200])
-    xplot = np.linspace(min(xdata[:]), max(xdata[:]), 100)
-    # extend xplot by a bit
-    ax[0].plot(xplot, power_law(xplot, *popt), label=f'fit: {round(popt[1],1)}x**{round(popt[0],1)}')
-    #st.write(mid,len(xdata), len(ydata), ydata)
-    ax[0].set_xlabel('avalanche tspan', color='white')
-    ax[0].set_ylabel('occurance frequency', color='white')
-    ax[0].set(xscale = scaling[0], yscale = scaling[1] )
-    ax[0].legend(facecolor='beige',
-                    loc='upper right',
-                    )
-
-    xspan = [avalanches_dict[i]['xspan']+1 for i in avalanches_dict]
-    log_min, log_max = np.log10(min(xspan)), np.log10(max(xspan))
-    a = ax[1].hist(xspan, bins=np.logspace(log_min, log_max, 20))
-    counts = ydata = a[0]
-    bins = a[1]
-    xdata = ((bins+np.roll(bins,-1))/2)[:-1]
-
-    xdata = xdata[ydata!=0]
-    ydata = ydata[ydata!=0]
-
-    popt, pcov = curve_fit(power_law, xdata[:], ydata[:],
-    p0=[1, 200])
-    xplot = np.linspace(min(xdata[:]), max(xdata[:]), 100)
-    ax[1].plot(xplot, power_law(xplot, *popt), label=f'fit: {round(popt[1],3)}x**{round(popt[0],3)}')
-
-
-    ax[1].set_xlabel('avalanche xspan (+1)', color='white')
-    ax[1].set_ylabel('occurance frequency', color='white')
-
-    ax[1].set(xscale = scaling[0], yscale = scaling[1] )
-    ax[1].legend(facecolor='beige')
+    for ax_, x, label in zip(ax, [aval['duration'], aval['span']+1], ['avalanche tspan', 'avalanche xspan (+1)']):
+        bins = np.unique(np.geomspace(x.min(), x.max()+1, 20).astype(int))
+        ax_.hist(x, bins=bins)
+        fit = power_law_fit(x)
+        # expected counts per bin of the fitted tail
+        xplot = bins[bins >= fit['xmin']]
+        ccdf = ((xplot - .5)/(fit['xmin'] - .5))**(1 - fit['alpha'])
+        ax_.plot((xplot[1:]*xplot[:-1])**.5, fit['n_tail']*(ccdf[:-1] - ccdf[1:]), c='r', ls='--',
+                 label=r'MLE: $\alpha$ = ' + f"{fit['alpha']:.2f} ± {fit['alpha_err']:.2f}, " + r'$x_{min}$ = ' + f"{fit['xmin']}")
+        ax_.set_xlabel(label, color='white')
+        ax_.set_ylabel('occurance frequency', color='white')
+        ax_.set(xscale = scaling[0], yscale = scaling[1] )
+        ax_.legend(facecolor='beige', loc='upper right')
 
     plt.tight_layout()
     plt.close()
@@ -681,27 +1771,91 @@ def plotAvalanches(idx_arr, skip_init, avalanches_dict):
 
 @function_profiler
 def accumulate(x):
-    X=np.zeros(len(x)) ; X[0] = x[0]
-    for i, _ in enumerate(x): X[i] = X[i-1]+x[i]
-    return X
-
-@function_profiler
-def randomWalk_2d(nsteps, sigma2=1, seed=42, axisscale='linear', step_size=0):
-    (dx_f, dy_f) = (lambda theta, r=1: r*trig(theta) for trig in (np.cos, np.sin)) 
-    dx_f = lambda theta, r = 1: r*np.cos(theta)
-    dy_f = lambda theta, r = 1: r*np.sin(theta)
+    return np.cumsum(x)
+
+walk_distributions = ['uniform', 'normal', 'bimodal']
+
+def _check_walk_distributions(distributions):
+    unknown = [name for name in distributions if name not in walk_distributions]
+    if unknown: raise ValueError(f'unknown step distribution(s) {unknown}, expected names from {walk_distributions}')
+
+def _walk_angles(rng, name, start, n, nsteps, sigma2):
+    # step directions of steps start..start+n-1, the first step of a walk is along the x-axis
+    if name == 'uniform':
+        thetas = rng.uniform(0, 2*np.pi, n)
+    elif name == 'normal':
+        thetas = rng.standard_normal(n)*sigma2
+    elif name == 'bimodal':
+        # first half of the walk around -1, second half around +1
+        thetas = rng.standard_normal(n)*sigma2 + np.where(np.arange(start, start+n) < nsteps//2, -1, 1)
+    else:
+        _check_walk_distributions([name])
+    if start == 0: thetas[0] = 0
+    return thetas
 
-    np.random.seed(seed)
-    thetas_uniform = np.random.uniform(0,2*np.pi,nsteps)
-    thetas_randn = np.random.randn(nsteps)*sigma2
-    thetas_bimodal = np.concatenate([ np.random.randn(nsteps//2) * sigma2-1, 
-                                    np.random.randn(nsteps//2) * sigma2+1 ])
+def random_walk_chunks(nsteps, distributions=['uniform', 'normal', 'bimodal'], sigma2=1, step_size=0, seed=42, chunk=2**18):
+    """
+    Streams 2d walks with step angles drawn from each of `distributions` and 
+    step lengths u**step_size (u uniform, shared between the walks), `chunk` 
+    steps at a time. Yields (steps, positions), both (ndist, T, 2).
+    """
+    _check_walk_distributions(distributions)
+    rng = np.random.default_rng(seed)
+    pos = np.zeros((len(distributions), 1, 2))
+    for start in range(0, nsteps, chunk):
+        n = min(chunk, nsteps - start)
+        thetas = np.array([_walk_angles(rng, name, start, n, nsteps, sigma2) for name in distributions])
+        lengths = rng.random(n)**step_size
+        steps = np.stack([lengths*np.cos(thetas), lengths*np.sin(thetas)], axis=2)
+        positions = pos + np.cumsum(steps, axis=1)
+        pos = positions[:, -1:]
+        yield steps, positions
+
+def decimate_path(positions, max_points):
+    """
+    Thins (..., T, 2) paths to at most ~max_points vertices by keeping, per
+    bucket of consecutive points, the first and last point and the extremes 
+    in x and y, in order, so the drawn extent of the path is unchanged.
+    """
+    T = positions.shape[-2]
+    k = int(np.ceil(T / max(max_points//6, 1)))
+    if k <= 1: return positions
+    nb = -(-T//k)
+    # the last bucket is padded with the last point
+    pad = [(0, 0)]*(positions.ndim - 2) + [(0, nb*k - T), (0, 0)]
+    buckets = np.pad(positions, pad, mode='edge').reshape(*positions.shape[:-2], nb, k, 2)
+    idx = np.concatenate([np.zeros(buckets.shape[:-2] + (1,), dtype=np.int64), np.full(buckets.shape[:-2] + (1,), k-1),
+                          buckets.argmin(axis=-2), buckets.argmax(axis=-2)], axis=-1)
+    idx.sort(axis=-1)
+    return np.take_along_axis(buckets, idx[..., None], axis=-2).reshape(*positions.shape[:-2], -1, 2)
 
-    thetas_uniform[0], thetas_randn[0], thetas_bimodal[0] = 0, 0, 0 
+@function_profiler
+def random_walk_paths(nsteps, distributions=['uniform', 'normal', 'bimodal'], sigma2=1, step_size=0, seed=42, 
+                      chunk=2**18, max_points=None):
+    """
+    Positions (ndist, nsteps+1, 2), starting at the origin, of the walks of 
+    `random_walk_chunks`. With `max_points`, each chunk is decimated as it 
+    arrives, so the full walk is never held in memory.
+    """
+    return _collect_walk(random_walk_chunks(nsteps, distributions, sigma2, step_size, seed, chunk), 
+                         len(distributions), nsteps, chunk, max_points)[0]
+
+def _collect_walk(chunks, ndist, nsteps, chunk, max_points, keep_steps=0):
+    # concatenates (decimated) positions, keeping the first keep_steps steps
+    max_chunk_points = None if max_points is None else max(6, max_points*min(chunk, nsteps)//max(nsteps, 1))
+    paths, first_steps = [np.zeros((ndist, 1, 2))], None
+    for steps, positions in chunks:
+        if first_steps is None: first_steps = steps[:, :keep_steps]
+        paths.append(positions if max_points is None else decimate_path(positions, max_chunk_points))
+    return np.concatenate(paths, axis=1), first_steps
 
-    rands = [thetas_uniform, thetas_randn, thetas_bimodal]
+@function_profiler
+def randomWalk_2d(nsteps, sigma2=1, seed=42, axisscale='linear', step_size=0, max_points=20000):
     rands_names = 'uniform, normal, bimodal'.split(', ')
-    stepLengths = np.random.rand(nsteps).copy()**step_size
+    # the first 1000 steps for the step panels, the decimated path for the main one
+    chunk = 2**18
+    paths, steps = _collect_walk(random_walk_chunks(nsteps, rands_names, sigma2, step_size, seed, chunk), 
+                                 len(rands_names), nsteps, chunk, max_points, keep_steps=1000)
 
     def plot2():
         colors = 'r g y'.split()
@@ -711,19 +1865,15 @@ def randomWalk_2d(nsteps, sigma2=1, seed=42, axisscale='linear', step_size=0):
         ax1 = [fig.add_subplot(gs[i, 0]) for i in range(3)]
         ax2 = fig.add_subplot(gs[:, 1:])    
         
-        lims = {'xl':0, 'xh':0, 'yl':0, 'yh':0}
-        for i, (r, n, stepLength) in enumerate(zip(rands, rands_names, stepLengths)):
-            dx, dy = dx_f(r, stepLength), dy_f(r, stepLength)
-            dx = np.vstack([np.zeros(len(dx)), dx]).T.flatten()
-            dy = np.vstack([np.zeros(len(dy)), dy]).T.flatten()
+        for i, n in enumerate(rands_names):
+            dx = np.vstack([np.zeros(steps.shape[1]), steps[i, :, 0]]).T.flatten()
+            dy = np.vstack([np.zeros(steps.shape[1]), steps[i, :, 1]]).T.flatten()
             
             ax1[i].plot(dx,dy, lw=1, c=colors[i])
             ax1[i].set(ylim=(-1,1), xlim=(-1,1), 
                         xticks=[], yticks=[],facecolor = "black",)
             
-            x = accumulate(dx)
-            y = accumulate(dy)
-            ax2.plot(x,y, lw=2, label=n,c=colors[i])
+            ax2.plot(paths[i, :, 0], paths[i, :, 1], lw=2, label=n,c=colors[i])
 
         ax2.set(facecolor = "black",# xticks=[], yticks=[],
                 xticklabels=[],
@@ -751,126 +1901,209 @@ def randomWalk_2d(nsteps, sigma2=1, seed=42, axisscale='linear', step_size=0):
     return plot2()
 
 @function_profiler
-def firstReturn1D(nsteps=1000, nwalks=50):
-    lengths = []
-    lines = {}
-    c=st.empty()
-    for idx in range(nwalks):
-        
-        x = [0] 
-        for i in range(nsteps):
-            change = -1 if np.random.rand()< 0.5 else 1
-            x.append(x[i]+change)
-            if x[i+1] == 0: break
-        lines[idx] = x
-
-        fig, ax = plt.subplots(1,2, figsize=(8,3))
-        for idx in lines.keys():
-            x = lines[idx]
+def random_walk_ensemble(nwalks=1000, nsteps=1000, dim=1, kind='lattice', levy_alpha=1.5, absorbing=True,
+                         return_radius=1., leave_radius=1.5, keep_paths=0, seed=None, chunk_size=2**22):
+    """
+    Advances `nwalks` random walkers from the origin together, a chunk of steps
+    at a time. kind='lattice' takes unit steps along one of the `dim` axes and 
+    returns on hitting the origin; 'angle' takes unit steps in a uniformly 
+    random direction and 'levy' steps of Pareto(levy_alpha) length, both 
+    returning on entering |r| < return_radius after having left |r| > 
+    leave_radius. With `absorbing`, walkers stop at their first return.
+    Returns the first-return times (-1 if none within nsteps), the mean 
+    squared displacement and the surviving fraction after each step 
+    (survival[i] = P(return time > i+1)), and the paths
+    of the first `keep_paths` walkers up to their return.
+    """
+    if kind not in ['lattice', 'angle', 'levy']: 
+        raise ValueError(f"unknown walk kind '{kind}', expected one of ['lattice', 'angle', 'levy']")
+    rng = np.random.default_rng(seed)
+    pos = np.zeros((nwalks, dim))
+    has_left = np.zeros(nwalks, dtype=bool)
+    active = np.arange(nwalks)  # walkers still walking
+    res = {'return_time' : np.full(nwalks, -1), 'msd' : np.zeros(nsteps), 'survival' : np.zeros(nsteps),
+           'paths' : [[np.zeros((1, dim))] for _ in range(min(keep_paths, nwalks))]}
+    
+    def steps(n, T):
+        if kind == 'lattice':
+            dx = np.zeros((n, T, dim), dtype=np.int8)
+            np.put_along_axis(dx, rng.integers(0, dim, (n, T, 1)), rng.choice(np.array([-1, 1], dtype=np.int8), (n, T, 1)), axis=2)
+            return dx
+        direction = rng.standard_normal((n, T, dim))
+        direction /= np.linalg.norm(direction, axis=2, keepdims=True)
+        if kind == 'levy': 
+            direction *= (1 - rng.random((n, T, 1)))**(-1/levy_alpha)
+        return direction
+
+    t = 0
+    while t < nsteps and len(active):
+        T = min(nsteps - t, max(1, chunk_size//(len(active)*dim)))
+        path = pos[active, None, :] + np.cumsum(steps(len(active), T), axis=1)
+        r2 = np.sum(path**2, axis=2)
+        if kind == 'lattice':
+            returned = r2 == 0
+        else:
+            left = has_left[active, None] | np.logical_or.accumulate(r2 > leave_radius**2, axis=1)
+            returned = left & (r2 < return_radius**2)
+            has_left[active] = left[:, -1]
+        first = np.where(returned.any(axis=1), returned.argmax(axis=1), T)
+        new = (first < T) & (res['return_time'][active] < 0)
+        res['return_time'][active[new]] = t + first[new] + 1
         
-            ax[0].plot(x, range(len(x)))#, c='orange')
-        ax[0].set_xlabel('x position', color='white')
-        ax[0].set_ylabel('time', color='white')
-        ax[0].set(xticks=[0], yticks=[])
-        ax[1].set(xticks=[0, nsteps//4, nsteps//2, nsteps//4*3, nsteps],
-                xticklabels=[0, nsteps//4, nsteps//2, nsteps//4*3, f'>{nsteps}'])
-        ax[0].grid()
-
-        lengths.append(len(x))
-
-        ax[1].hist(lengths)
-        ax[1].set_xlabel('First return time', color='white')
-        ax[1].set_ylabel('occurance frequency', color='white')
-        #ax[1].set(xticks=[0], yticks=[])
-        ax[1].grid()
-        c.pyplot(fig)
+        # a walker that returns at step j no longer counts as walking at j
+        walking = np.arange(T)[None, :] < first[:, None] if absorbing else np.ones((len(active), T), dtype=bool)
+        res['msd'][t:t+T] = np.sum(r2*walking, axis=0)
+        res['survival'][t:t+T] = np.sum(walking, axis=0)
+        for k in np.flatnonzero(active < len(res['paths'])):
+            res['paths'][active[k]].append(path[k, :first[k]+1] if absorbing else path[k])
+
+        pos[active] = path[:, -1]
+        if absorbing: active = active[first == T]
+        t += T
+
+    res['msd'] /= np.maximum(res['survival'], 1)
+    res['survival'] /= nwalks
+    res['paths'] = [np.concatenate(p) for p in res['paths']]
+    return res
+
+@function_profiler
+def plotFirstReturn(res, nsteps, dim=1):
+    fig, ax = plt.subplots(1,3, figsize=(12,3))
+    for path in res['paths']:
+        if dim == 1: ax[0].plot(path[:, 0], range(len(path)), lw=1)
+        else:        ax[0].plot(path[:, 0], path[:, 1], lw=1)
+    ax[0].set_xlabel('x position', color='white')
+    ax[0].set_ylabel('time' if dim == 1 else 'y position', color='white')
+    ax[0].set(xticks=[0], yticks=[] if dim == 1 else [0])
+    ax[0].grid()
+
+    # walks that never returned are counted at nsteps
+    lengths = np.where(res['return_time'] < 0, nsteps, res['return_time'])
+    ax[1].hist(lengths)
+    ax[1].set(xticks=[0, nsteps//4, nsteps//2, nsteps//4*3, nsteps],
+            xticklabels=[0, nsteps//4, nsteps//2, nsteps//4*3, f'>{nsteps}'])
+    ax[1].set_xlabel('First return time', color='white')
+    ax[1].set_ylabel('occurance frequency', color='white')
+    ax[1].grid()
+
+    t = np.arange(1, nsteps+1)
+    ax[2].plot(t, res['survival'], label='not returned')
+    ax[2].plot(t, res['msd']/res['msd'].max(), label='MSD (scaled)')
+    ax[2].set(xscale='log', yscale='log')
+    ax[2].set_xlabel('time', color='white')
+    ax[2].legend(facecolor='beige')
+    ax[2].grid()
     plt.close()
+    return fig
+
+@function_profiler
+def firstReturn1D(nsteps=1000, nwalks=50):
+    res = random_walk_ensemble(nwalks, nsteps, dim=1, kind='lattice', keep_paths=50)
+    st.pyplot(plotFirstReturn(res, nsteps, dim=1))
 
 @function_profiler
 def firstReturn2D(
-    nsteps=4000, nwalks=20):
-    lengths = []
-    lines = {}
-    c=st.empty()  # empty for plots
-    for idx in range(nwalks):  # walks
-        x, y = np.zeros(nsteps+1), np.zeros(nsteps+1) 
+    nsteps=4000, nwalks=20, kind='angle'):
+    # home is the unit circle, counted once the walker has been further than 3/2 away
+    res = random_walk_ensemble(nwalks, nsteps, dim=2, kind=kind, keep_paths=50, 
+                               return_radius=1., leave_radius=1.5)
+    st.pyplot(plotFirstReturn(res, nsteps, dim=2))
+
+## Sandpile
+@jit(nopython=True)
+def _sandpile_run(arr, sites, snapshot_every, size_out, area_out, duration_out, mean_out, snapshots):
+    # BTW sandpile with open boundaries. Each added grain relaxes in waves: every
+    # site >= 4 topples (as often as it can) once per wave, and the sites it 
+    # pushes over 4 make up the next wave.
+    h, w = arr.shape
+    flat = arr.ravel()
+    N = h*w
+    wave, next_wave = np.empty(N, dtype=np.int64), np.empty(N, dtype=np.int64)
+    queued = np.full(N, -1, dtype=np.int64)   # last wave a site was queued for
+    toppled = np.full(N, -1, dtype=np.int64)  # last grain a site toppled in
+    total, wave_id = flat.sum(), 0
+    for g in range(len(sites)):
+        s = sites[g]
+        flat[s] += 1 ; total += 1
+        size, area, duration, n_wave = 0, 0, 0, 0
+        if flat[s] >= 4:
+            wave[0], n_wave = s, 1
+        while n_wave > 0:
+            duration += 1 ; wave_id += 1
+            n_next = 0
+            for q in range(n_wave):
+                k = wave[q]
+                n = flat[k]//4
+                flat[k] -= 4*n
+                size += n
+                if toppled[k] != g: 
+                    toppled[k] = g ; area += 1
+                i, j = k//w, k%w
+                for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                    ii, jj = i + di, j + dj
+                    if ii < 0 or ii >= h or jj < 0 or jj >= w:
+                        total -= n  # falls off the edge
+                        continue
+                    nb = ii*w + jj
+                    flat[nb] += n
+                    if flat[nb] >= 4 and queued[nb] != wave_id:
+                        queued[nb] = wave_id
+                        next_wave[n_next] = nb ; n_next += 1
+            wave, next_wave, n_wave = next_wave, wave, n_next
+        size_out[g], area_out[g], duration_out[g] = size, area, duration
+        mean_out[g] = total/N
+        if snapshot_every > 0 and g % snapshot_every == 0:
+            snapshots[g//snapshot_every] = arr
 
-        dx_func = lambda theta, r = 1: r*np.cos(theta)
-        dy_func = lambda theta, r = 1: r*np.sin(theta)
+@function_profiler
+def sandpile(size=64, ngrains=10**5, snapshot_every=0, seed=None, arr=None):
+    """
+    2d Bak-Tang-Wiesenfeld sandpile (threshold 4, open boundaries) driven by
+    `ngrains` grains dropped on random sites. Records the avalanche size 
+    (topplings), area (distinct sites toppled) and duration (waves) of 
+    every grain, the mean height after it, and the grid after every 
+    `snapshot_every`-th grain (none for 0).
+    """
+    rng = np.random.default_rng(seed)
+    (h, w) = (size, size) if np.ndim(size) == 0 else size
+    arr = np.zeros((h, w), dtype=np.int64) if arr is None else arr.astype(np.int64)
+    sites = rng.integers(0, h*w, ngrains)
+    nsnapshots = -(-ngrains//snapshot_every) if snapshot_every > 0 else 0
+    res = {'size' : np.empty(ngrains, dtype=np.int64), 'area' : np.empty(ngrains, dtype=np.int64),
+           'duration' : np.empty(ngrains, dtype=np.int64), 'mean' : np.empty(ngrains),
+           'snapshots' : np.empty((nsnapshots, h, w), dtype=np.int64),
+           'snapshot_steps' : np.arange(nsnapshots)*snapshot_every}
+    _sandpile_run(arr, sites, snapshot_every, res['size'], res['area'], res['duration'], res['mean'], res['snapshots'])
+    res['arr'] = arr
+    return res
 
-        thetas = np.random.uniform(0,2*np.pi,nsteps)
-        
-        #stepLengths = np.random.rand(nsteps).copy()**step_size
-        has_left_unit_circle = False
-        for i, theta in enumerate(thetas):
-            dx = dx_func(theta)
-            dy = dy_func(theta)
-            x[i+1] = x[i]+dx
-            y[i+1] = y[i]+dy
-            if has_left_unit_circle == False:
-                if (x[i+1]**2 + y[i+1]**2)**.5 > 3/2:
-                    has_left_unit_circle = True
-            else:
-                if (x[i+1]**2 + y[i+1]**2)**.5 < 1:
-                    x = x[:i+2]
-                    y = y[:i+2]
-                    break
-        lines[idx] = {'x':x, 'y':y}
-        
-        fig, ax = plt.subplots(1,2, figsize=(8,3))
-        for idx in lines.keys():
-            ax[0].plot(lines[idx]['x'], lines[idx]['y'])
-
-        ax[0].set_xlabel('x position', color='white')
-        ax[0].set_ylabel('y position', color='white')
-        ax[0].set(xticks=[0], yticks=[0])
-        ax[1].set(xticks=[0, nsteps//4, nsteps//2, nsteps//4*3, nsteps],
-                xticklabels=[0, nsteps//4, nsteps//2, nsteps//4*3, f'>{nsteps}'])
-        ax[0].grid()
-
-        lengths.append(len(lines[idx]['x']))
-
-        ax[1].hist(lengths)
-        ax[1].set_xlabel('First return time', color='white')
-        ax[1].set_ylabel('occurance frequency', color='white')
-        #ax[1].set(xticks=[0], yticks=[])
-        ax[1].grid()
-        c.pyplot(fig)
+@function_profiler
+def plotSandpileAvalanches(res, skip_init=None):
+    # avalanche statistics in steady state, by default the second half of the run
+    skip_init = len(res['size'])//2 if skip_init is None else skip_init
+    fig, ax = plt.subplots(1,3, figsize=(12,4))
+    for ax_, key in zip(ax, ['size', 'area', 'duration']):
+        x = res[key][skip_init:] ; x = x[x > 0]
+        bins = np.unique(np.geomspace(1, x.max()+1, 30).astype(int))
+        density, _ = np.histogram(x, bins)
+        density = density/np.diff(bins)/len(x)
+        ax_.scatter(bins[:-1][density > 0], density[density > 0], s=8, c='white')
+        # keep xmin well below the finite-size cutoff
+        fit = power_law_fit(x, xmin_max=np.sqrt(x.max()))
+        xplot = bins[bins >= fit['xmin']]
+        ax_.plot(xplot, fit['n_tail']/fit['n']*(fit['alpha']-1)/(fit['xmin']-.5)*((xplot-.5)/(fit['xmin']-.5))**-fit['alpha'],
+                 c='r', ls='--', label=r'MLE: $\alpha$ = ' + f"{fit['alpha']:.2f}, " + r'$x_{min}$ = ' + f"{fit['xmin']}")
+        ax_.set(xscale='log', yscale='log')
+        ax_.set_xlabel(f'avalanche {key}', color='white')
+        ax_.legend(facecolor='beige')
+    ax[0].set_ylabel('probability', color='white')
     plt.close()
+    return fig
 
 @function_profiler
 def bereaucrats(nsteps, size=20):
 
-        def makeGrid(size):
-            arr = np.zeros((size,size))
-            return arr, size**2
-        
-        def fill(arr, N):
-            rand_index = np.random.randint(0,N)
-            who = (rand_index//arr.shape[1], rand_index%arr.shape[1])
-            arr[who] += 1
-            return arr
-
-        def run():
-            arr, N = makeGrid(size)
-            results = {'mean':[], 'arr':[]}
-            
-            for step in range(nsteps):
-                arr = fill(arr, N)  # bring in 1 task
-
-                overfull_args = np.argwhere(arr>=4)  # if someone has 4 tasks redistribute to neighbours
-                for ov in overfull_args:
-                    (i,j) = ov
-                    for pos in [(i+1, j), (i-1, j), (i,j+1), (i,j-1)]:
-                        try: arr[pos] +=1
-                        except: pass
-                    arr[i,j] -= 4
-                results['mean'].append(np.mean(arr)) 
-                results['arr'].append(arr.copy()) 
-
-            return results
-
-        results = run()
+        results = sandpile(size, nsteps, snapshot_every=max(1, nsteps//10))
 
         # plot 1
         c = st.empty()
@@ -881,15 +2114,15 @@ def bereaucrats(nsteps, size=20):
         a = [ax[idx].set(xticks=[], yticks=[], 
                     facecolor='black') for idx in range(5)]
         
-        steps = range(nsteps)[::nsteps//10]
+        steps = results['snapshot_steps']
         
         for val, (i, next) in enumerate(zip(steps, steps[1:])):
             
-            progress_bar.progress(int((i + 1)/nsteps))  # Update progress bar.
+            progress_bar.progress((i + 1)/nsteps)  # Update progress bar.
 
             if val%2==0:  # plot imshow the grid
                 idx = 0 if val==0 else idx+1 
-                ax[idx].imshow(results['arr'][i], cmap="inferno")
+                ax[idx].imshow(results['snapshots'][val], cmap="inferno")
                 ax[idx].set(xticks=[], yticks=[])
                 c.pyplot(fig)
                 
@@ -900,14 +2133,146 @@ def bereaucrats(nsteps, size=20):
             chart.add_rows(new_rows)
 
             # Pretend we're doing some computation that takes time.
-            time.sleep(.1)
+            sleep(.1)
 
         status_text.text('Done!')
 
 
 # Networks
+def _symmetric_csr(i, j, n):
+    # undirected simple graph from an edge list with i != j
+    A = sparse.csr_matrix((np.ones(2*len(i)), (np.r_[i, j], np.r_[j, i])), shape=(n, n))
+    A.data[:] = 1  # merge duplicate edges
+    return A
+
+def _erdos_renyi_edges(n, p, rng):
+    # G(n, p): the number of edges is binomial, the edges one sample without 
+    # replacement of the n(n-1)/2 pairs, mapped to (i, j) with i < j
+    npairs = n*(n-1)//2
+    pairs = rng.choice(npairs, rng.binomial(npairs, p), replace=False)
+    i = (n - 2 - np.floor(np.sqrt(-8.*pairs + 4*n*(n-1) - 7)/2 - .5)).astype(np.int64)
+    j = (pairs + i + 1 - n*(n-1)//2 + (n-i)*((n-i)-1)//2).astype(np.int64)
+    return i, j
+
 @function_profiler
-def makeBetheLattice(n_nodes = 10, degree=3):
+def erdos_renyi_csr(n, p, seed=None):
+    return _symmetric_csr(*_erdos_renyi_edges(n, p, np.random.default_rng(seed)), n)
+
+@jit(nopython=True)
+def _preferential_attachment_edges(n, m):
+    # node t links to m distinct earlier nodes picked from the list of edge 
+    # endpoints, i.e. with probability proportional to degree
+    ends = np.empty(2*m*n, dtype=np.int64)
+    src, dst = np.empty(m*n, dtype=np.int64), np.empty(m*n, dtype=np.int64)
+    nends, nedges = 0, 0
+    for t in range(1, m+1):  # seed: a star on nodes 0..m
+        src[nedges], dst[nedges] = t, 0 ; nedges += 1
+        ends[nends], ends[nends+1] = t, 0 ; nends += 2
+    chosen = np.empty(m, dtype=np.int64)
+    for t in range(m+1, n):
+        k = 0
+        while k < m:
+            c = ends[np.random.randint(nends)]
+            new = True
+            for q in range(k):
+                if chosen[q] == c: new = False
+            if new: 
+                chosen[k] = c ; k += 1
+        for q in range(m):
+            src[nedges], dst[nedges] = t, chosen[q] ; nedges += 1
+            ends[nends], ends[nends+1] = t, chosen[q] ; nends += 2
+    return src[:nedges], dst[:nedges]
+
+@function_profiler
+def preferential_attachment_csr(n, m=2, seed=None):
+    # Barabasi-Albert graph grown from a star on m+1 nodes
+    _seed_numba(np.random.default_rng(seed).integers(2**31))
+    return _symmetric_csr(*_preferential_attachment_edges(n, m), n)
+
+@jit(nopython=True)
+def _brandes(indptr, indices, sources):
+    # Brandes' accumulation of shortest-path dependencies from each source (unweighted)
+    n = len(indptr) - 1
+    bc, sigma, delta = np.zeros(n), np.zeros(n), np.zeros(n)
+    dist, order = np.full(n, -1), np.empty(n, dtype=np.int64)
+    for s in sources:
+        sigma[s], dist[s], order[0] = 1, 0, s
+        head, tail = 0, 1
+        while head < tail:
+            v = order[head] ; head += 1
+            for e in range(indptr[v], indptr[v+1]):
+                w = indices[e]
+                if dist[w] < 0:
+                    dist[w] = dist[v] + 1
+                    order[tail] = w ; tail += 1
+                if dist[w] == dist[v] + 1: sigma[w] += sigma[v]
+        for q in range(tail-1, 0, -1):
+            w = order[q]
+            for e in range(indptr[w], indptr[w+1]):
+                v = indices[e]
+                if dist[v] == dist[w] - 1: delta[v] += sigma[v]/sigma[w]*(1 + delta[w])
+            bc[w] += delta[w]
+        for q in range(tail):  # reset only what was visited
+            w = order[q]
+            sigma[w], delta[w], dist[w] = 0, 0, -1
+    return bc
+
+@function_profiler
+def betweenness_centrality_csr(A, k=None, seed=None):
+    """
+    Normalised betweenness centrality of an undirected graph (as 
+    nx.betweenness_centrality). With `k`, accumulates from k random pivot 
+    sources only and rescales by n/k, an unbiased estimate at k/n of the cost.
+    """
+    A = sparse.csr_matrix(A)
+    n = A.shape[0]
+    sources = np.arange(n) if k is None or k >= n else np.random.default_rng(seed).choice(n, k, replace=False)
+    bc = _brandes(A.indptr.astype(np.int64), A.indices.astype(np.int64), sources)
+    return bc * (n/len(sources)) / ((n-1)*(n-2)) if n > 2 else bc
+
+@function_profiler
+def triangles_csr(A):
+    # triangles through each node: diag(A^3)/2, from the entries of A@A on edges
+    A = sparse.csr_matrix(A, dtype=np.int64)
+    return np.asarray((A @ A).multiply(A).sum(axis=1)).ravel() // 2
+
+@jit(nopython=True)
+def _fundamental_cycle_lengths(indptr, indices):
+    # BFS spanning forest; every non-tree edge (u, v) closes one cycle through their lowest common ancestor
+    n = len(indptr) - 1
+    parent, depth, order = np.full(n, -1), np.full(n, -1), np.empty(n, dtype=np.int64)
+    for root in range(n):
+        if depth[root] >= 0: continue
+        depth[root], order[0], head, tail = 0, root, 0, 1
+        while head < tail:
+            v = order[head] ; head += 1
+            for e in range(indptr[v], indptr[v+1]):
+                w = indices[e]
+                if depth[w] < 0:
+                    depth[w], parent[w] = depth[v] + 1, v
+                    order[tail] = w ; tail += 1
+    lengths = []
+    for u in range(n):
+        for e in range(indptr[u], indptr[u+1]):
+            v = indices[e]
+            if v <= u or parent[v] == u or parent[u] == v: continue
+            a, b, length = u, v, 1
+            while a != b:
+                if depth[a] >= depth[b]: a = parent[a]
+                else:                    b = parent[b]
+                length += 1
+            lengths.append(length)
+    return np.array(lengths, dtype=np.int64)
+
+@function_profiler
+def cycle_lengths_csr(A):
+    # lengths of the cycles of a fundamental cycle basis (BFS tree), like nx.cycle_basis
+    A = sparse.csr_matrix(A)
+    return _fundamental_cycle_lengths(A.indptr.astype(np.int64), A.indices.astype(np.int64))
+
+@function_profiler
+def makeBetheLattice(n_nodes = 10, degree=3, sparse=False):
+    if sparse: return bethe_lattice_csr(n_nodes, degree)
     M = np.zeros((n_nodes,n_nodes))
 
     idx = 1
@@ -920,7 +2285,14 @@ def makeBetheLattice(n_nodes = 10, degree=3):
     return M+M.T
 
 @function_profiler
-def make_network(n_persons = 5,alpha=.4):
+def make_network(n_persons = 5,alpha=.4, sparse=False, seed=None):
+    if sparse:
+        # each pair is linked with probability 1-alpha, isolated persons get one random link
+        rng = np.random.default_rng(seed)
+        i, j = _erdos_renyi_edges(n_persons, 1-alpha, rng)
+        isolated = np.flatnonzero(np.bincount(np.r_[i, j], minlength=n_persons) == 0)
+        partners = (isolated + rng.integers(1, n_persons, len(isolated))) % n_persons
+        return _symmetric_csr(np.r_[i, isolated], np.r_[j, partners], n_persons)
     
     A = np.zeros((n_persons,n_persons))
     for i in range(n_persons):
@@ -933,52 +2305,202 @@ def make_network(n_persons = 5,alpha=.4):
     
     return A
 
+@jit(nopython=True)
+def _match_coarsen(indptr, indices, order):
+    # greedy matching in the given order: each node merges with its first unmatched neighbour
+    n = len(indptr) - 1
+    cluster = np.full(n, -1)
+    count = 0
+    for v in order:
+        if cluster[v] >= 0: continue
+        cluster[v] = count
+        for e in range(indptr[v], indptr[v+1]):
+            w = indices[e]
+            if cluster[w] < 0:
+                cluster[w] = count ; break
+        count += 1
+    return cluster, count
+
+@jit(nopython=True, parallel=True)
+def _barnes_hut_kernel(pos, k2, theta, ix, iy, depth, width, offsets, mass, com, order, start):
+    # depth-first walk of the quadtree for every node; a cell that does not 
+    # contain the node and looks smaller than theta (side/distance) acts as 
+    # one mass at its centre of mass, leaves that must be opened are summed exactly
+    n = len(pos)
+    force = np.zeros((n, 2))
+    for i in prange(n):
+        stack = np.empty((3*depth + 4, 3), dtype=np.int64)  # (level, cx, cy)
+        stack[0, 0], stack[0, 1], stack[0, 2] = 0, 0, 0
+        top = 1
+        fx, fy = 0., 0.
+        while top > 0:
+            top -= 1
+            l, cx, cy = stack[top, 0], stack[top, 1], stack[top, 2]
+            c = offsets[l] + cx*(1 << l) + cy
+            if mass[c] == 0: continue
+            shift = depth - l
+            inside = (ix[i] >> shift) == cx and (iy[i] >> shift) == cy
+            dx, dy = pos[i, 0] - com[c, 0], pos[i, 1] - com[c, 1]
+            r2 = dx*dx + dy*dy
+            side = width/(1 << l)
+            if not inside and side*side < theta*theta*r2:
+                fx += mass[c]*k2*dx/r2 ; fy += mass[c]*k2*dy/r2
+            elif l == depth:
+                leaf = cx*(1 << depth) + cy
+                for q in range(start[leaf], start[leaf+1]):
+                    j = order[q]
+                    if j == i: continue
+                    dx, dy = pos[i, 0] - pos[j, 0], pos[i, 1] - pos[j, 1]
+                    r2 = dx*dx + dy*dy + 1e-12
+                    fx += k2*dx/r2 ; fy += k2*dy/r2
+            else:
+                for q in range(4):
+                    stack[top, 0], stack[top, 1], stack[top, 2] = l+1, 2*cx + q//2, 2*cy + q%2
+                    top += 1
+        force[i, 0], force[i, 1] = fx, fy
+    return force
+
+def _barnes_hut_repulsion(pos, k2, theta=.8, leaf_size=4):
+    """
+    Fruchterman-Reingold repulsion k^2/d on every node, O(n log n) by 
+    Barnes-Hut. The quadtree is stored as one dense grid per level, 2^l x 2^l 
+    cells at level l, down to ~leaf_size nodes per leaf; masses and centres 
+    of mass of every level come from one bincount each.
+    """
+    n = len(pos)
+    depth = int(np.clip(np.ceil(np.log(max(n/leaf_size, 1))/np.log(4)), 1, 12))
+    lo = pos.min(axis=0)
+    width = (pos.max(axis=0) - lo).max() + 1e-12
+    cells = 1 << depth
+    ix, iy = np.minimum(((pos - lo)/width*cells).astype(np.int64), cells-1).T
+    offsets = np.r_[0, np.cumsum(4**np.arange(depth+1))]
+    mass, com = np.zeros(offsets[-1]), np.zeros((offsets[-1], 2))
+    for l in range(depth+1):
+        c = (ix >> (depth - l))*(1 << l) + (iy >> (depth - l))
+        sl = slice(offsets[l], offsets[l+1])
+        mass[sl] = np.bincount(c, minlength=4**l)
+        com[sl, 0], com[sl, 1] = np.bincount(c, pos[:, 0], 4**l), np.bincount(c, pos[:, 1], 4**l)
+    com /= np.maximum(mass, 1)[:, None]
+    leaf = ix*cells + iy
+    order = np.argsort(leaf, kind='stable')
+    start = np.r_[0, np.cumsum(np.bincount(leaf, minlength=cells*cells))]
+    return _barnes_hut_kernel(pos, k2, theta, ix, iy, depth, width, offsets, mass, com, order, start)
+
+@function_profiler
+def force_layout(A, iterations=50, pos=None, seed=None, min_nodes=50):
+    """
+    Multilevel Fruchterman-Reingold layout in the unit square. The graph is 
+    coarsened by matching until it has min_nodes nodes, the coarse layout is 
+    interpolated to the finer level and refined there, with Barnes-Hut 
+    repulsion. An initial `pos` is refined at low temperature instead.
+    """
+    A = sparse.csr_matrix(A, dtype=float)
+    A.setdiag(0) ; A.eliminate_zeros()
+    n = A.shape[0]
+    rng = np.random.default_rng(seed)
+    k = np.sqrt(1/n)
+    t0 = .1
+    if pos is not None:
+        pos, t0 = np.array(pos, dtype=float), k
+    elif n > min_nodes:
+        cluster, m = _match_coarsen(A.indptr.astype(np.int64), A.indices.astype(np.int64), rng.permutation(n))
+        if m < .9*n:  # stop where matching no longer shrinks the graph (e.g. stars)
+            P = sparse.csr_matrix((np.ones(n), (np.arange(n), cluster)), shape=(n, m))
+            coarse = force_layout(P.T @ A @ P, iterations, seed=rng.integers(2**31), min_nodes=min_nodes)
+            pos, t0 = coarse[cluster] + rng.normal(0, k/10, (n, 2)), k
+    if pos is None: pos = rng.uniform(size=(n, 2))
+
+    src, dst = np.repeat(np.arange(n), np.diff(A.indptr)), A.indices
+    for t in np.linspace(t0, 0, iterations, endpoint=False):
+        disp = _barnes_hut_repulsion(pos, k*k)
+        d = pos[src] - pos[dst]
+        d *= np.sqrt((d**2).sum(1))[:, None]/k  # attraction d^2/k; both directions are in the csr
+        disp[:, 0] -= np.bincount(src, d[:, 0], n)
+        disp[:, 1] -= np.bincount(src, d[:, 1], n)
+        length = np.sqrt((disp**2).sum(1)) + 1e-12
+        pos += disp*(np.minimum(length, t)/length)[:, None]
+    return pos
+
+def _graph_hash(A):
+    # structure only, so node states (e.g. sick colouring) do not invalidate a layout
+    A = sparse.csr_matrix(A)
+    A.sort_indices()
+    h = hashlib.sha1(np.array(A.shape, dtype=np.int64).tobytes())
+    h.update(A.indptr.astype(np.int64).tobytes())
+    h.update(A.indices.astype(np.int64).tobytes())
+    return h.hexdigest()
+
+_layout_cache = OrderedDict()
+
+@function_profiler
+def graph_layout(A, iterations=50, seed=0, maxsize=32):
+    """
+    Cached force_layout keyed by the graph structure. A graph sharing most of 
+    its edges with a cached one (e.g. a few links added) starts from that 
+    layout and is only refined.
+    """
+    A = sparse.csr_matrix(A, dtype=bool)
+    key = _graph_hash(A)
+    if key in _layout_cache:
+        _layout_cache.move_to_end(key)
+        return _layout_cache[key][1]
+    warm = [pos for B, pos in reversed(_layout_cache.values()) 
+            if B.shape == A.shape and A.multiply(B).nnz > .8*max(A.nnz, B.nnz)]
+    if warm: pos = force_layout(A, max(10, iterations//5), pos=warm[0], seed=seed)
+    else:    pos = force_layout(A, iterations, seed=seed)
+    _layout_cache[key] = (A, pos)
+    if len(_layout_cache) > maxsize: _layout_cache.popitem(last=False)
+    return pos
+
 @function_profiler
 def draw_from_matrix(M, sick=[], pos=[]):
-    sick = np.zeros(len(M)) if len(sick) == 0 else sick
-    G = nx.Graph()
-    for i, line in enumerate(M):
-        G.add_node(i)
-
-    for i, line in enumerate(M):
-        for j, val in enumerate(line):
-            if (i != j) and (val==1): 
-                G.add_edge(i, j)
-    color_map = ['r' if s==1 else 'white' for s in sick]
-    
-    #pos = nx.nx_agraph.graphviz_layout(G) if len(pos)==0 else pos
+    # edges as one LineCollection, nodes as one scatter
+    A = sparse.csr_matrix(M)
+    n = A.shape[0]
+    sick = np.zeros(n) if len(sick) == 0 else np.asarray(sick)
+    pos = graph_layout(A) if len(pos) == 0 else np.asarray(pos)
+    edges = sparse.triu(A, k=1).tocoo()
     
     fig, ax = plt.subplots()
-    nx.draw_networkx(G, node_color=color_map, edge_color='white')
-    return fig, G
+    ax.add_collection(LineCollection(np.stack([pos[edges.row], pos[edges.col]], 1), colors='white', linewidths=.5, zorder=1))
+    ax.scatter(pos[:, 0], pos[:, 1], c=np.where(sick == 1, 'r', 'white'), s=min(100, 1e4/n), edgecolors='gray', linewidths=.5, zorder=2)
+    ax.set(xticks=[], yticks=[])
+    ax.axis('off')
+    plt.close()
+    return fig, pos
 
 @function_profiler
-def network_analysis(net, G):
+def network_analysis(net, G=None, k=None):
+    # net may be dense or sparse; betweenness from k pivots when k is given
+    net = sparse.csr_matrix(net)
+    net = net - sparse.diags(net.diagonal()) ; net.eliminate_zeros()
     fig, ax = plt.subplots(2,2, figsize=(9,7))
-    ax[0,0].hist(net.sum(axis=1))
+    ax[0,0].hist(np.diff(net.indptr))
     ax[0,0].set_title('Degree distribution', color='white')
     ax[0,0].set_xlabel('Degree', color='white')
     ax[0,0].set_ylabel('Occurance frequency', color='white')
 
-    c = nx.betweenness_centrality(G).values()
+    c = betweenness_centrality_csr(net, k)
     hist = ax[0,1].hist(c)
     ax[0,1].set_title('Centrality distribution', color='white')
     ax[0,1].set_xlabel('Betweenness centrality', color='white')
     #ax[1].set_ylabel('Occurance frequency', color='white')
-    power_law_on_hist(hist, ax=ax[0,1], p0=None, legend=True)
+    try: power_law_on_hist(hist, ax=ax[0,1], p0=None, legend=True)
+    except: pass
     
-    cycles = nx.cycle_basis(G)
+    cycles = cycle_lengths_csr(net)
     
-    hist = ax[1,0].hist([len(c) for c in cycles])
+    hist = ax[1,0].hist(cycles)
     ax[1,0].set_title('Cycle length distribution', color='white')
     ax[1,0].set_xlabel('Cycle length', color='white')
     ax[1,0].set_ylabel('Occurance frequency', color='white')
-    power_law_on_hist(hist, ax=ax[1,0], p0=[.05,11,10,10], legend=True)
+    try: power_law_on_hist(hist, ax=ax[1,0], p0=[.05,11,10,10], legend=True)
+    except: pass
 
-    triangles = nx.triangles(G)
+    triangles = triangles_csr(net)
     #st.write(triangles)
     try:
-        hist = ax[1,1].hist(np.array(list(triangles.values()))+1)
+        hist = ax[1,1].hist(triangles+1)
         
         #ax[1,1].set_ylabel('Occurance frequency', color='white')
         power_law_on_hist(hist, ax=ax[1,1], p0=[.2,1,1,1], legend=True)
@@ -992,70 +2514,319 @@ def network_analysis(net, G):
     plt.close()
     return fig
 
-
-# Agents
+## Epidemics
 @function_profiler
-def game_of_life(size=6, nsteps=4, initial_config = 'boat'):
+def epidemic(A, beta=1., gamma=1., model='SIR', initial=1, t_max=np.inf, seed=None):
     """
-    If the cell is alive, then it stays alive if it has either 2 or 3 live neighbors
-    If the cell is dead, then it springs to life only in the case that it has 3 live neighbors
+    Continuous-time SIR/SIS on an undirected graph: each S-I edge transmits 
+    at rate beta, each infected node recovers at rate gamma. Event driven: 
+    transmissions and recoveries sit in a heap keyed by time, so the cost is 
+    O(events log events) rather than O(steps*nodes). `initial` is the number 
+    of random index cases or an array of nodes. SIS can stay endemic forever, 
+    so it needs a finite t_max. Returns the S, I, R counts 
+    after every event, the final state (0 S, 1 I, 2 R) and the time each node 
+    was last infected (inf if never).
     """
-    initially_filled = {
-                        'boat' : [(2,2), (3,2), (2,3), (4,3), (3,4)],
-                        'ship' : [(2,2), (3,2), (2,3), (4,3), (4,4), (3,4)],
-                        'square' : [(2,2), (3,2), (2,3), (3,3)],
-                        'loaf' : [(2,1), (3,1), (1,2), (4,2), (2,4), (1,3), (3,3)],
-                        'glider' : [(2,2), (3,2), (2,3), (4,3), (2,4), ],
-        }[initial_config]
-
-    def initGrid(size, initially_filled):
-        grid = np.zeros((size,size), dtype=bool)
-        for i in initially_filled: grid[i] = True
-        return grid
+    if model not in ['SIR', 'SIS']: raise ValueError(f"unknown model '{model}'")
+    if model == 'SIS' and not np.isfinite(t_max): raise ValueError('SIS needs a finite t_max')
+    A = sparse.csr_matrix(A)
+    indptr, indices = A.indptr, A.indices
+    n = A.shape[0]
+    rng = np.random.default_rng(seed)
+    seeds = rng.choice(n, initial, replace=False) if np.isscalar(initial) else np.asarray(initial)
+
+    state = np.zeros(n, dtype=np.int8)
+    infected_time = np.full(n, np.inf)
+    t_recover = np.full(n, np.inf)
+    # SIR: each node holds only its earliest pending infection, later ones are skipped on pop
+    t_pending = np.full(n, np.inf)
+    heap = [(0., 1, v) for v in seeds]  # (time, 1: transmission / 0: recovery, node)
+    for v in seeds: t_pending[v] = 0.
+    heapq.heapify(heap)
+
+    counts = {'S' : n, 'I' : 0, 'R' : 0}
+    t_, S, I, R = [0.], [n], [0], [0]
+    while heap:
+        t, kind, v = heapq.heappop(heap)
+        if t > t_max: break
+        if kind == 0:  # recovery
+            state[v] = 2 if model == 'SIR' else 0
+            counts['I'] -= 1 ; counts['R' if model == 'SIR' else 'S'] += 1
+        else:
+            if state[v] != 0 or (model == 'SIR' and t != t_pending[v]): continue
+            state[v], infected_time[v] = 1, t
+            counts['S'] -= 1 ; counts['I'] += 1
+            t_recover[v] = t + rng.exponential(1/gamma)
+            heapq.heappush(heap, (t_recover[v], 0, v))
+            nbrs = indices[indptr[v]:indptr[v+1]]
+            if model == 'SIR':
+                # first transmission on each edge; those after recovery never happen
+                tt = t + rng.exponential(1/beta, len(nbrs))
+                for w, tw in zip(nbrs[tt < t_recover[v]], tt[tt < t_recover[v]]):
+                    if state[w] == 0 and tw < t_pending[w]:
+                        t_pending[w] = tw
+                        heapq.heappush(heap, (tw, 1, w))
+            else:
+                # every transmission attempt during the infectious period: a Poisson process per edge
+                k = rng.poisson(beta*(t_recover[v] - t), len(nbrs))
+                tt = t + rng.uniform(0, t_recover[v] - t, k.sum())
+                for w, tw in zip(np.repeat(nbrs, k), tt):
+                    heapq.heappush(heap, (tw, 1, w))
+        t_.append(t) ; S.append(counts['S']) ; I.append(counts['I']) ; R.append(counts['R'])
 
-    def sumNeighbors(grid, i,j):
-        S = 0
-        for pos in [(i-1, j), (i+1, j), (i, j-1), (i, j+1),
-                    (i-1, j-1), (i+1, j+1), (i+1, j-1), (i-1, j+1)]:
-            if (pos[0] >= 0) and (pos[1] >= 0) and (pos[0] < len(grid)) and (pos[1] < len(grid)):
-                    S += grid[pos]
-        return S
-
-    def update(grid):
-        grid_new = grid.copy()
-        for i in range(size):
-            for j in range(size):
-                if grid[i,j]: # if ego is alive
-                    if sumNeighbors(grid, i, j) not in [2,3]:
-                        grid_new[i,j] = False
-                else:
-                    if sumNeighbors(grid, i, j) ==3:
-                        grid_new[i,j] = True
+    return {'t' : np.array(t_), 'S' : np.array(S), 'I' : np.array(I), 'R' : np.array(R),
+            'state' : state, 'infected_time' : infected_time}
 
-        return grid_new
+@function_profiler
+def outbreak_sizes(A, beta=1., gamma=1., nruns=1000, seed=None):
+    """
+    Final SIR outbreak sizes from a single random index case, for nruns seeds. 
+    The final size of Markovian SIR is the set reachable from the index case 
+    along edges u->v whose first transmission time beats u's recovery time, so 
+    each run is one vectorised draw of those edges and a BFS, with no event queue.
+    """
+    A = sparse.csr_matrix(A)
+    n = A.shape[0]
+    src = np.repeat(np.arange(n), np.diff(A.indptr))
+    rng = np.random.default_rng(seed)
+    sizes = np.empty(nruns, dtype=np.int64)
+    for run in range(nruns):
+        recovery = rng.exponential(1/gamma, n)
+        open_ = rng.exponential(1/beta, len(src)) < recovery[src]
+        T = sparse.csr_matrix((np.ones(open_.sum(), dtype=bool), (src[open_], A.indices[open_])), shape=(n, n))
+        sizes[run] = len(sparse.csgraph.breadth_first_order(T, rng.integers(n), return_predecessors=False))
+    return sizes
 
+@function_profiler
+def plotEpidemic(res, sizes=None):
+    fig, ax = plt.subplots(1, 2 if sizes is not None else 1, figsize=(9, 3))
+    ax_ = ax[0] if sizes is not None else ax
+    for key, c in zip('SIR', ['white', 'r', 'gray']):
+        if key == 'R' and res['R'][-1] == 0: continue
+        ax_.step(res['t'], res[key], where='post', c=c, label=key)
+    ax_.set_xlabel('time', color='white')
+    ax_.set_ylabel('persons', color='white')
+    ax_.legend(facecolor='beige')
+    if sizes is not None:
+        n = len(res['state'])
+        bins = np.unique(np.geomspace(1, n+1, 30).astype(int))
+        ax[1].hist(sizes, bins, color='r')
+        ax[1].set(xscale='log', yscale='log')
+        ax[1].set_xlabel('outbreak size', color='white')
+        ax[1].set_ylabel('runs', color='white')
+    plt.tight_layout()
+    plt.close()
+    return fig
 
-    grid = initGrid(size, initially_filled)
 
-    fig, ax = plt.subplots(1,5)
-    ax[0].imshow(grid)
-    ax[0].set_title('initial', color='white')
+# Agents
+## Game of life
+def _life_neighbours(grid, boundary='periodic'):
+    # number of live neighbours of every cell, as uint8
+    g = grid.astype(np.uint8)
+    if boundary == 'periodic':
+        rows = g + np.roll(g, 1, axis=0) + np.roll(g, -1, axis=0)
+        return rows + np.roll(rows, 1, axis=1) + np.roll(rows, -1, axis=1) - g
+    p = np.pad(g, 1)  # fixed: dead cells beyond the edge
+    rows = p[:-2] + p[1:-1] + p[2:]
+    return rows[:, :-2] + rows[:, 1:-1] + rows[:, 2:] - g
+
+def _life_step_roll(grid, n, boundary):
+    grid = grid.astype(bool)
+    for _ in range(n):
+        count = _life_neighbours(grid, boundary)
+        grid = (count == 3) | (grid & (count == 2))
+    return grid
+
+def _shift_cells(words, d, periodic):
+    # words (h, nwords) hold cells 64*w + b of every row; returns the west (d=1) or east (d=-1) neighbours
+    one, s63 = np.uint64(1), np.uint64(63)
+    if d == 1:
+        carry = np.roll(words, 1, axis=1) >> s63
+        if not periodic: carry[:, 0] = 0
+        return (words << one) | carry
+    carry = np.roll(words, -1, axis=1) << s63
+    if not periodic: carry[:, -1] = 0
+    return (words >> one) | carry
+
+def _life_step_packed(grid, n, boundary):
+    # 64 cells per word, neighbours counted with a bit-sliced 3-bit counter (c2 flags >= 4)
+    h, w = grid.shape
+    periodic = boundary == 'periodic'
+    if periodic and w % 64:
+        raise ValueError('the packed backend needs a width divisible by 64 for periodic boundaries')
+    nwords = -(-w//64)
+    words = np.packbits(np.pad(grid.astype(bool), ((0, 0), (0, 64*nwords - w))), axis=1, bitorder='little').view(np.uint64)
+    valid = np.packbits(np.arange(64*nwords) < w, bitorder='little').view(np.uint64)
+    zero_row = np.zeros((1, nwords), dtype=np.uint64)
+    for _ in range(n):
+        up   = np.roll(words, 1, axis=0) if periodic else np.vstack([zero_row, words[:-1]])
+        down = np.roll(words, -1, axis=0) if periodic else np.vstack([words[1:], zero_row])
+        c0, c1, c2 = (np.zeros_like(words) for _ in range(3))
+        for row in (up, words, down):
+            for x in (_shift_cells(row, 1, periodic), row, _shift_cells(row, -1, periodic)):
+                if x is words: continue
+                c = c0 & x ; c0 ^= x
+                c2 |= c1 & c ; c1 ^= c
+        words = ~c2 & c1 & (c0 | words) & valid
+    return np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')[:, :w].astype(bool)
+
+class _LifeNode():
+    # quadtree node of 2**k x 2**k cells: nw, ne, sw, se children and population n
+    __slots__ = ['k', 'a', 'b', 'c', 'd', 'n']
+    def __init__(self, k, a, b, c, d, n):
+        self.k, self.a, self.b, self.c, self.d, self.n = k, a, b, c, d, n
+
+_life_on, _life_off = _LifeNode(0, None, None, None, None, 1), _LifeNode(0, None, None, None, None, 0)
+
+@lru_cache(maxsize=2**22)
+def _life_join(a, b, c, d):
+    # interned: the same four children always give the same node
+    return _LifeNode(a.k+1, a, b, c, d, a.n + b.n + c.n + d.n)
+
+@lru_cache(maxsize=None)
+def _life_zero(k):
+    return _life_off if k == 0 else _life_join(*(_life_zero(k-1),)*4)
+
+def _life_centre(m):
+    # m padded with an empty border, one level up
+    z = _life_zero(m.k - 1)
+    return _life_join(_life_join(z, z, z, m.a), _life_join(z, z, m.b, z), 
+                      _life_join(z, m.c, z, z), _life_join(m.d, z, z, z))
+
+def _life_inner(m):
+    return _life_join(m.a.d, m.b.c, m.c.b, m.d.a)
+
+def _life_4x4(m):
+    # next generation of the centre 2x2 of a 4x4 node
+    g = np.block([[np.array([[m.a.a.n, m.a.b.n], [m.a.c.n, m.a.d.n]]), np.array([[m.b.a.n, m.b.b.n], [m.b.c.n, m.b.d.n]])],
+                  [np.array([[m.c.a.n, m.c.b.n], [m.c.c.n, m.c.d.n]]), np.array([[m.d.a.n, m.d.b.n], [m.d.c.n, m.d.d.n]])]])
+    nxt = _life_step_roll(g, 1, 'fixed')[1:3, 1:3]
+    leaf = lambda x: _life_on if x else _life_off
+    return _life_join(leaf(nxt[0, 0]), leaf(nxt[0, 1]), leaf(nxt[1, 0]), leaf(nxt[1, 1]))
+
+@lru_cache(maxsize=2**22)
+def _life_successor(m, j):
+    # centre half of m, 2**j generations on (j <= k-2)
+    if m.n == 0: return m.a
+    if m.k == 2: return _life_4x4(m)
+    j = min(j, m.k - 2)
+    a, b, c, d = m.a, m.b, m.c, m.d
+    s = [_life_successor(_life_join(*q), j) for q in (
+            (a.a, a.b, a.c, a.d), (a.b, b.a, a.d, b.c), (b.a, b.b, b.c, b.d),
+            (a.c, a.d, c.a, c.b), (a.d, b.c, c.b, d.a), (b.c, b.d, d.a, d.b),
+            (c.a, c.b, c.c, c.d), (c.b, d.a, c.d, d.c), (d.a, d.b, d.c, d.d))]
+    quads = [(0, 1, 3, 4), (1, 2, 4, 5), (3, 4, 6, 7), (4, 5, 7, 8)]
+    if j < m.k - 2:
+        return _life_join(*(_life_join(s[p].d, s[q].c, s[r].b, s[t].a) for p, q, r, t in quads))
+    return _life_join(*(_life_successor(_life_join(*(s[i] for i in q)), j) for q in quads))
+
+class HashLife():
+    """
+    Game of life on the open plane as a hash-consed quadtree (Gosper's 
+    HashLife). Identical blocks share one node and their futures are 
+    memoised, so regular patterns run for millions of generations. 
+    `origin` is the (row, col) of the root's top-left cell in the 
+    coordinates of the initial grid.
+    """
+    def __init__(self, grid):
+        grid = np.asarray(grid, dtype=bool)
+        k = max(2, int(np.ceil(np.log2(max(grid.shape)))))
+        padded = np.zeros((2**k, 2**k), dtype=bool)
+        padded[:grid.shape[0], :grid.shape[1]] = grid
+        self.root, self.origin, self.generation = self._build(padded), np.array([0, 0]), 0
+
+    def _build(self, g):
+        if not g.any(): return _life_zero(int(np.log2(len(g))))
+        if len(g) == 1: return _life_on
+        h = len(g)//2
+        return _life_join(self._build(g[:h, :h]), self._build(g[:h, h:]), self._build(g[h:, :h]), self._build(g[h:, h:]))
+
+    def _pad(self):
+        self.origin -= 2**(self.root.k - 1)
+        self.root = _life_centre(self.root)
+
+    def step(self, n=1):
+        # one successor call per set bit of n, each on a root padded so nothing escapes
+        for j in range(int(n).bit_length()):
+            if not (n >> j) & 1: continue
+            while self.root.k < j + 2: self._pad()
+            self._pad() ; self._pad()
+            self.origin += 2**(self.root.k - 2)
+            self.root = _life_successor(self.root, j)
+            while self.root.k > 2 and _life_inner(self.root).n == self.root.n:
+                self.origin += 2**(self.root.k - 2)
+                self.root = _life_inner(self.root)
+        self.generation += n
+        return self
+
+    @property
+    def population(self):
+        return self.root.n
+
+    def to_array(self, shape=None, offset=(0, 0)):
+        """
+        Cells of the window of `shape` (default: the root) with top-left 
+        cell at `offset`, in the coordinates of the initial grid.
+        """
+        if shape is None: shape, offset = (2**self.root.k,)*2, self.origin
+        out = np.zeros(shape, dtype=bool)
+        def fill(m, r, c):
+            size = 2**m.k
+            if m.n == 0 or r >= shape[0] or c >= shape[1] or r + size <= 0 or c + size <= 0: return
+            if m.k == 0: out[r, c] = True ; return
+            h = size//2
+            fill(m.a, r, c) ; fill(m.b, r, c+h) ; fill(m.c, r+h, c) ; fill(m.d, r+h, c+h)
+        fill(self.root, *(self.origin - np.asarray(offset)))
+        return out
 
-    grid = update(grid)
-    ax[1].imshow(grid)
-    ax[1].set_title('after 1 itr', color='white')
+@function_profiler
+def life_step(grid, n=1, boundary='periodic', backend='roll'):
+    """
+    The grid after n generations of the game of life. backend='roll' counts
+    neighbours with rolled uint8 sums, 'packed' with bitwise adders on 64 
+    cells per word, both with 'periodic' or 'fixed' (dead beyond the edge) 
+    boundaries. 'hashlife' runs on the open plane (boundary='open') and 
+    returns the window of the original grid.
+    """
+    if backend == 'hashlife' or boundary == 'open':
+        if backend != 'hashlife' or boundary != 'open':
+            raise ValueError("hashlife only runs with boundary='open'")
+        return HashLife(grid).step(n).to_array(np.shape(grid))
+    if boundary not in ['periodic', 'fixed']:
+        raise ValueError(f'unknown boundary {boundary}')
+    return {'roll' : _life_step_roll, 'packed' : _life_step_packed}[backend](np.asarray(grid), n, boundary)
+
+life_patterns = {
+    'boat' : [(2,2), (3,2), (2,3), (4,3), (3,4)],
+    'ship' : [(2,2), (3,2), (2,3), (4,3), (4,4), (3,4)],
+    'square' : [(2,2), (3,2), (2,3), (3,3)],
+    'loaf' : [(2,1), (3,1), (1,2), (4,2), (2,4), (1,3), (3,3)],
+    'glider' : [(2,2), (3,2), (2,3), (4,3), (2,4), ],
+    'glider gun' : [(5,1), (5,2), (6,1), (6,2), (5,11), (6,11), (7,11), (4,12), (8,12), (3,13), (9,13), (3,14), (9,14),
+                    (6,15), (4,16), (8,16), (5,17), (6,17), (7,17), (6,18), (3,21), (4,21), (5,21), (3,22), (4,22), 
+                    (5,22), (2,23), (6,23), (1,25), (2,25), (6,25), (7,25), (3,35), (4,35), (3,36), (4,36)],
+}
 
-    grid = update(grid)
-    ax[2].imshow(grid)
-    ax[2].set_title('after 2 itr', color='white')
+@function_profiler
+def game_of_life(size=6, nsteps=4, initial_config = 'boat', every=1, boundary='fixed', backend='roll'):
+    """
+    If the cell is alive, then it stays alive if it has either 2 or 3 live neighbors
+    If the cell is dead, then it springs to life only in the case that it has 3 live neighbors
+    """
+    grid = np.zeros((size,size), dtype=bool)
+    for i in life_patterns[initial_config]: grid[i] = True
 
-    grid = update(grid)
-    ax[3].imshow(grid)
-    ax[3].set_title('after 3 itr', color='white')
+    fig, ax = plt.subplots(1,nsteps+1)
+    ax[0].imshow(grid)
+    ax[0].set_title('initial', color='white')
+    if backend == 'hashlife': life = HashLife(grid)
 
-    grid = update(grid)
-    ax[4].imshow(grid)
-    ax[4].set_title('after 4 itr', color='white')
+    for i in range(1, nsteps+1):
+        if backend == 'hashlife': grid = life.step(every).to_array(grid.shape)
+        else:                     grid = life_step(grid, every, boundary, backend)
+        ax[i].imshow(grid)
+        ax[i].set_title(f'after {i*every} itr', color='white')
 
     _ = [ax[i].set(xticks=[], yticks=[]) for i in range(len(ax))]
     plt.tight_layout()
@@ -1064,84 +2835,431 @@ def game_of_life(size=6, nsteps=4, initial_config = 'boat'):
     return fig
 
 
+## Foxes and rabbits
+class FoxRabbit():
+    """
+    Struct-of-arrays fox/rabbit population on a size x size map: positions, 
+    kinds (0 rabbit, 1 fox) and days since a fox last ate, one entry per agent.
+    Each step every agent moves to a random neighbouring site (staying put 
+    along an axis that would leave the map), then per site: foxes eat all 
+    rabbits there, foxes that have not eaten in `starve` days die, and every
+    pair of rabbits (on a site without foxes) or of foxes has one offspring.
+    Rabbit litters only fill a site up to `capacity` rabbits, a local 
+    carrying capacity that keeps them from piling up on a few sites.
+    """
+    def __init__(self, size=100, nrabbits=1000, nfoxes=100, starve=3, capacity=4, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.size, self.starve, self.capacity = size, starve, capacity
+        self.pos = self.rng.integers(0, size, (nrabbits + nfoxes, 2))
+        self.kind = np.r_[np.zeros(nrabbits, dtype=np.int8), np.ones(nfoxes, dtype=np.int8)]
+        self.hunger = np.zeros(nrabbits + nfoxes, dtype=np.int32)
+
+    def counts(self):
+        return np.count_nonzero(self.kind == 0), np.count_nonzero(self.kind == 1)
+
+    def occupancy(self):
+        # 1 where a rabbit is, 2 where a fox is (foxes drawn on top)
+        X = np.zeros((self.size, self.size), dtype=np.int8)
+        order = np.argsort(self.kind, kind='stable')
+        X[self.pos[order, 0], self.pos[order, 1]] = self.kind[order] + 1
+        return X
+
+    def step(self):
+        n, size = len(self.kind), self.size
+        new = self.pos + self.rng.integers(-1, 2, (n, 2))
+        inside = (new >= 0) & (new < size)
+        self.pos = np.where(inside, new, self.pos)
+        
+        cell = self.pos[:, 0]*size + self.pos[:, 1]
+        is_fox = self.kind == 1
+        foxes = np.bincount(cell[is_fox], minlength=size**2)
+        rabbits = np.bincount(cell[~is_fox], minlength=size**2)
+        
+        # predation and starvation
+        eaten = ~is_fox & (foxes[cell] > 0)
+        self.hunger[is_fox] = np.where(rabbits[cell[is_fox]] > 0, 0, self.hunger[is_fox] + 1)
+        keep = ~eaten & ~(is_fox & (self.hunger >= self.starve))
+        
+        # one offspring per pair on a site
+        fox_pairs = np.bincount(cell[keep & is_fox], minlength=size**2)//2
+        rabbit_pairs = np.where(foxes == 0, np.clip(np.minimum(rabbits//2, self.capacity - rabbits), 0, None), 0)
+        occupied = np.flatnonzero(fox_pairs | rabbit_pairs)
+        rabbit_births = np.repeat(occupied, rabbit_pairs[occupied])
+        fox_births = np.repeat(occupied, fox_pairs[occupied])
+        births = np.r_[rabbit_births, fox_births]
+        
+        self.pos = np.r_[self.pos[keep], np.c_[births//size, births%size]]
+        self.kind = np.r_[self.kind[keep], np.zeros(len(rabbit_births), dtype=np.int8), np.ones(len(fox_births), dtype=np.int8)]
+        self.hunger = np.r_[self.hunger[keep], np.zeros(len(births), dtype=np.int32)]
+        return self
+
+@function_profiler
+def fox_rabbit(size=100, nrabbits=1000, nfoxes=100, nsteps=1000, starve=3, capacity=4, snapshot_steps=[], seed=None):
+    # population time series (nsteps+1) and occupancy maps at snapshot_steps
+    pop = FoxRabbit(size, nrabbits, nfoxes, starve, capacity, seed)
+    res = {'rabbits' : np.zeros(nsteps+1, dtype=np.int64), 'foxes' : np.zeros(nsteps+1, dtype=np.int64), 'snapshots' : {}}
+    for t in range(nsteps+1):
+        if t > 0: pop.step()
+        res['rabbits'][t], res['foxes'][t] = pop.counts()
+        if t in snapshot_steps: res['snapshots'][t] = pop.occupancy()
+    return res
+
+@function_profiler
+def plotFoxRabbit(res):
+    fig, ax = plt.subplots(1,3,figsize=(16,5))
+    for ax_, t in zip(ax, sorted(res['snapshots'])[:2]):
+        ax_.imshow(res['snapshots'][t], vmin=0, vmax=2)
+        ax_.set_title(f'step {t}', color='white')
+        ax_.set(xticks=[], yticks=[])
+    ax[2].plot(res['rabbits'], label='rabbits')
+    ax[2].plot(res['foxes'], label='foxes')
+    ax[2].set_xlabel('step', color='white')
+    ax[2].set_ylabel('population', color='white')
+    ax[2].legend(facecolor='beige')
+    plt.close()
+    return fig
+
+
 # Econophysics
+## Price data
+price_data_path = 'assets/complex/data/prices/'  # bundled sample, one npz per ticker
+price_cache_path = cache_path + 'prices/'
+price_retry_after = 600  # seconds before a failed download of a ticker is tried again
+_price_download_failures = {}  # ticker -> time of the last failed download
+
+def _price_file(ticker, path):
+    return os.path.join(path, f'{ticker}.npz')
+
+def _read_prices(filename):
+    with np.load(filename) as f: return {key : f[key] for key in f.files}
+
+def _slice_prices(prices, start, end):
+    # rows with start <= date < end; the dates are sorted
+    i, j = np.searchsorted(prices['date'], [start, end])
+    return {key : (val[i:j] if val.ndim else val) for key, val in prices.items()}
+
+def _download_prices(ticker, start, end):
+    data = yf.download(ticker, str(start), str(end), auto_adjust=False, progress=False)
+    if len(data) == 0: raise ValueError(f'no data for {ticker}')
+    close = np.asarray(data['Close'], dtype=float).ravel()
+    adj_close = np.asarray(data['Adj Close'], dtype=float).ravel() if 'Adj Close' in data else close
+    return {'date' : data.index.values.astype('datetime64[D]'), 'close' : close, 'adj_close' : adj_close,
+            'start' : np.datetime64(start, 'D'), 'end' : np.datetime64(end, 'D'), 'source' : np.array('yahoo')}
+
 @function_profiler
-def var_of_stock(ticker = 'GOOGL'):
-    # Set the start and end date
-    start_date = '2020-01-01'
-    end_date = '2022-01-01'
-    # Get the data
-    data = yf.download(ticker, start_date, end_date)
+def load_prices(ticker, start='2020-01-01', end='2022-01-01', offline=False):
+    """
+    Daily prices of `ticker` for start <= date < end, as columns date, close, 
+    adj_close and source. Real stored data covering the range is used as is; 
+    otherwise the range is downloaded (merged with what is cached). Only 
+    offline, or when the download fails, does the synthetic bundled sample 
+    stand in, preferring stored data that covers the range. A failed download 
+    is not retried for `price_retry_after` seconds.
+    """
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    stored = [_read_prices(f) for f in [_price_file(ticker, price_cache_path), _price_file(ticker, price_data_path)] 
+              if os.path.exists(f)]
+    covers = [prices for prices in stored if prices['start'] <= start and prices['end'] >= end]
+    for prices in covers:
+        if str(prices['source']) != 'synthetic': return _slice_prices(prices, start, end)
+
+    if not offline and time() - _price_download_failures.get(ticker, -np.inf) > price_retry_after:
+        try:
+            cached = stored[0] if stored and str(stored[0]['source']) == 'yahoo' else None
+            if cached is not None: start_, end_ = min(start, cached['start']), max(end, cached['end'])
+            else:                  start_, end_ = start, end
+            prices = _download_prices(ticker, start_, end_)
+            os.makedirs(price_cache_path, exist_ok=True)
+            np.savez(_price_file(ticker, price_cache_path), **prices)
+            _price_download_failures.pop(ticker, None)
+            return _slice_prices(prices, start, end)
+        except Exception:
+            _price_download_failures[ticker] = time()
+    if stored: return _slice_prices((covers + stored)[0], start, end)
+    raise FileNotFoundError(f'no price data for {ticker} and it could not be downloaded')
 
-    S_t = data.Close.values
-    x_t = np.log(S_t)
+@function_profiler
+def price_matrix(tickers, start='2020-01-01', end='2022-01-01', column='close', offline=False):
+    # one row per ticker on the dates they all share
+    prices = [load_prices(t, start, end, offline) for t in tickers]
+    dates = prices[0]['date']
+    for p in prices[1:]: dates = np.intersect1d(dates, p['date'])
+    return dates, np.array([p[column][np.searchsorted(p['date'], dates)] for p in prices])
 
-    var_s = {}
-    for s in range(1,25):
-        var = np.mean([(S_t[(i+1)*s]-S_t[i*s])**2 for i in range(1,len(S_t)//s-1)])
-        var_s[s] = (var)
-        #plt.plot(var)
+@function_profiler
+def lagged_moments(x, max_lag=None):
+    """
+    Mean, mean square and variance of the overlapping differences x[t+tau]-x[t] 
+    for every lag 1..max_lag, along the last axis (one row per series). The 
+    cross term sum_t x[t]x[t+tau] comes from one FFT autocorrelation and the 
+    squares from prefix sums, so all lags cost O(n log n) per series.
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    n = x.shape[-1]
+    max_lag = n-1 if max_lag is None else min(max_lag, n-1)
+    x = x - x.mean(axis=-1, keepdims=True)  # differences are shift invariant; keeps the sums small
+    nfft = 2**int(np.ceil(np.log2(2*n)))
+    f = np.fft.rfft(x, nfft)
+    cross = np.fft.irfft(f*f.conj(), nfft)[:, :n]
+    c1 = np.pad(np.cumsum(x, axis=-1), [(0, 0), (1, 0)])
+    c2 = np.pad(np.cumsum(x**2, axis=-1), [(0, 0), (1, 0)])
+
+    lags = np.arange(1, max_lag+1)
+    m = n - lags
+    mean = (c1[:, n, None] - c1[:, lags] - c1[:, m])/m
+    msd = (c2[:, n, None] - c2[:, lags] + c2[:, m] - 2*cross[:, lags])/m
+    return {'lag' : lags, 'mean' : mean, 'msd' : msd, 'var' : msd - mean**2}
+
+@function_profiler
+def var_of_stock(ticker = 'GOOGL', start='2020-01-01', end='2022-01-01', max_lag=24):
+    prices = load_prices(ticker, start, end)
+    S_t = prices['close']
+
+    moments = lagged_moments(S_t, max_lag)
+    lags, var = moments['lag'], moments['var'][0]
 
     fig, ax = plt.subplots(1,2, figsize=(8,5))
-    data["Adj Close"].plot(ax=ax[0])
-    ax[0].set_title(ticker, color='white')
+    ax[0].plot(prices['date'], prices['adj_close'])
+    ax[0].tick_params(axis='x', labelrotation=45)
+    synthetic = ' (synthetic sample)' if str(prices['source']) == 'synthetic' else ''
+    ax[0].set_title(ticker + synthetic, color='white')
     ax[0].set_ylabel(r'Stock price', color='white')
 
-    ax[1].scatter(var_s.keys(), var_s.values())
-    reg = np.polyfit(list(var_s.keys()), list(var_s.values()), 1)
-    x = np.linspace(0,max(var_s.keys()),100)
+    ax[1].scatter(lags, var)
+    reg = np.polyfit(lags, var, 1)
+    x = np.linspace(0,max(lags),100)
     ax[1].plot(x, reg[0]*x+reg[1], c='r', ls='--')
     ax[1].set_xlabel(r'$\tau$', color='white')
     ax[1].set_ylabel(r'var($\tau$)', color='white')
     
     plt.tight_layout()
     plt.close()
-    return fig, data.Close.values
+    return fig, prices
+
+## Hurst exponent
+def _log_scales(n, smin=4, smax=None, nscales=20):
+    smax = n//4 if smax is None else smax
+    return np.unique(np.geomspace(smin, max(smin, smax), nscales).astype(int))
+
+def _prefix(x):
+    # prefix sums along the last axis with a leading zero, so window sums are P[b] - P[a]
+    return np.pad(np.cumsum(x, axis=-1), [(0, 0)]*(x.ndim-1) + [(1, 0)])
+
+def _window_starts(n, s, step):
+    return np.arange(0, n - s + 1, s if step is None else step)
 
 @function_profiler
-def hurstExponent(time_series):
-    def get_hurst_exponent(time_series, max_lag=20):
-        """Returns the Hurst Exponent of the time series"""
-        
-        lags = range(2, max_lag)
+def dfa(x, scales=None, step=None):
+    """
+    Detrended fluctuation analysis (linear detrending) of the increments x, one 
+    series per row. F(s) is the rms residual of the profile about a linear fit 
+    in windows of s points, starting every `step` points (default s, 
+    non-overlapping). The window fits come from prefix sums of y, t*y and y^2, 
+    so every window of every scale is O(1).
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    n = x.shape[-1]
+    scales = _log_scales(n) if scales is None else np.asarray(scales)
+    y = np.cumsum(x - x.mean(axis=-1, keepdims=True), axis=-1)
+    t = np.arange(n)
+    Py, Pty, Pyy = _prefix(y), _prefix(t*y), _prefix(y*y)
+    F = np.empty((x.shape[0], len(scales)))
+    for k, s in enumerate(scales):
+        a = _window_starts(n, s, step) ; b = a + s
+        Sy, Sty, Syy = Py[:, b] - Py[:, a], Pty[:, b] - Pty[:, a], Pyy[:, b] - Pyy[:, a]
+        Sty_c = Sty - (a + (s-1)/2)*Sy  # sum over the window of (t - mean t) y
+        rss = Syy - Sy**2/s - Sty_c**2/(s*(s*s-1)/12)
+        F[:, k] = np.sqrt(np.maximum(rss, 0).mean(axis=-1)/s)
+    return scales, F
 
-        # variances of the lagged differences
-        tau = [np.std( time_series[lag:] - time_series[:-lag]) for lag in lags]
-        
-        # calculate the slope of the log plot -> the Hurst Exponent
-        reg = np.polyfit(np.log(lags), np.log(tau), 1)
+@function_profiler
+def rescaled_range(x, scales=None, step=None):
+    """
+    Mean rescaled range R/S of the increments x in windows of s points starting 
+    every `step` points (default s), one series per row. Window means and 
+    standard deviations come from prefix sums; the range of the cumulative 
+    deviations from one strided view of the profile per scale.
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    n = x.shape[-1]
+    scales = _log_scales(n, smin=8) if scales is None else np.asarray(scales)
+    P, P2 = _prefix(x), _prefix(x*x)
+    RS = np.empty((x.shape[0], len(scales)))
+    for k, s in enumerate(scales):
+        a = _window_starts(n, s, step)
+        mean = (P[:, a+s] - P[:, a])/s
+        std = np.sqrt(np.maximum((P2[:, a+s] - P2[:, a])/s - mean**2, 0))
+        # cumulative deviations Z_j = P[a+j] - P[a] - j*mean, j = 0..s
+        W = np.lib.stride_tricks.sliding_window_view(P, s+1, axis=-1)[:, a]
+        Z = W - W[..., :1] - np.arange(s+1)*mean[..., None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            RS[:, k] = np.nanmean(np.where(std > 0, np.ptp(Z, axis=-1)/std, np.nan), axis=-1)
+    return scales, RS
 
-        return reg[0]
+@function_profiler
+def hurst_exponents(x, method='dfa', scales=None, step=None, max_lag=20):
+    """
+    Hurst exponents of the series x (a path, e.g. prices or a random walk), one 
+    per row, all fitted together:
+        'var' : std of x[t+tau]-x[t] ~ tau^H for tau in 2..max_lag-1,
+        'dfa' : F(s) ~ s^H of the increments,
+        'rs'  : R/S(s) ~ s^H of the increments.
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    if method == 'var':
+        moments = lagged_moments(x, max_lag-1)
+        scales, fluct = moments['lag'][1:], np.sqrt(moments['var'][:, 1:])
+    elif method == 'dfa': scales, fluct = dfa(np.diff(x, axis=-1), scales, step)
+    elif method == 'rs':  scales, fluct = rescaled_range(np.diff(x, axis=-1), scales, step)
+    else: raise ValueError(f"unknown method '{method}'")
+    return np.polyfit(np.log(scales), np.log(fluct).T, 1)[0]
 
-    H = []
-    lags = np.linspace(5,len(time_series),10, dtype=int)
-    for lag in lags:
-        hurst_exp = get_hurst_exponent(time_series, lag)
-        H.append(hurst_exp)
+@function_profiler
+def hurstExponent(time_series, title=''):
+    # H from the lagged differences for every max lag, fitted by running sums over one set of moments
+    n = len(time_series)
+    moments = lagged_moments(time_series, n-2)
+    lags = moments['lag'][1:]
+    logx, logy = np.log(lags), np.log(np.sqrt(np.maximum(moments['var'][0, 1:], 1e-300)))
+    # least squares on lags 2..L for every L at once
+    N = np.arange(1, len(lags)+1)
+    Sx, Sy, Sxx, Sxy = np.cumsum(logx), np.cumsum(logy), np.cumsum(logx**2), np.cumsum(logx*logy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        H_all = (Sxy - Sx*Sy/N)/(Sxx - Sx**2/N)
+
+    max_lags = np.linspace(5, n-1, 10, dtype=int)
+    H = H_all[max_lags - 3]  # fit up to lag max_lag-1, as range(2, max_lag)
     fig, ax = plt.subplots(figsize=(6,3))
-    ax.scatter(lags, H)
+    ax.scatter(max_lags, H)
+    for method, c in zip(['dfa', 'rs'], ['r', 'orange']):
+        ax.axhline(hurst_exponents(time_series, method)[0], c=c, ls='--', label=method.upper())
     ax.set_xlabel(r'Lag, $\tau$', color='white')
     ax.set_ylabel(r'Hurst exponent, $H$', color='white')
+    ax.set_title(title, color='white')
+    ax.legend(facecolor='beige')
     
     plt.close()
     return fig
 
 @function_profiler
-def betHedging(p, noise, invest_per_round, nsteps, win_multiplier=2, loss_multiplier=.5):
-    capital = [1]
-    
-    for i in range(nsteps):
-        prob_loss = 1/(2*(1-p))+np.random.uniform(-1,1,None)*noise
-        if np.random.uniform()>prob_loss:
-            capital.append(capital[i]*win_multiplier)
-        else:
-            capital.append(capital[i]*loss_multiplier)
+def hurstEnsemble(nseries=1000, nsteps=1000, seed=None):
+    # spread of each estimator over an ensemble of random walks, for which H = 1/2
+    walks = np.cumsum(np.random.default_rng(seed).standard_normal((nseries, nsteps)), axis=-1)
+    fig, ax = plt.subplots(figsize=(6,3))
+    for method, c in zip(['var', 'dfa', 'rs'], ['white', 'r', 'orange']):
+        ax.hist(hurst_exponents(walks, method), 40, histtype='step', color=c, label=method.upper())
+    ax.axvline(.5, c='gray', ls='--')
+    ax.set_xlabel(r'Hurst exponent, $H$', color='white')
+    ax.set_ylabel('series', color='white')
+    ax.legend(facecolor='beige')
+    plt.close()
+    return fig
+
+## Bet hedging
+def _win_probability(p, noise):
+    # P(uniform > 1/(2(1-p)) + u*noise), u ~ U(-1, 1): the mean of clip(A - u*noise, 0, 1)
+    with np.errstate(all='ignore'):
+        A = 1 - 1/(2*(1-np.asarray(p, dtype=float)))
+        B = np.asarray(noise, dtype=float)
+        G = lambda v: np.where(v < 0, 0, np.where(v <= 1, v*v/2, v - .5))  # integral of clip(v, 0, 1)
+        return np.where(B > 0, (G(A + B) - G(A - B))/(2*B), np.clip(A, 0, 1))
+
+def _log_returns(invest_per_round, win_multiplier, loss_multiplier):
+    # log capital gained on a win and on a loss when a fraction f is bet
+    f = np.asarray(invest_per_round, dtype=float)
+    with np.errstate(divide='ignore'):
+        return np.log(1 - f + f*win_multiplier), np.log(1 - f + f*loss_multiplier)
+
+@function_profiler
+def bet_hedging_ensemble(p, noise, invest_per_round, nsteps, win_multiplier=2, loss_multiplier=.5, 
+                         nruns=1000, quantiles=[.05, .25, .5, .75, .95], seed=None):
+    """
+    nruns trajectories of log-capital for each investment fraction in 
+    `invest_per_round`, starting from log(1) = 0. The rounds are independent, so 
+    each is a win with the noise-averaged probability, and all fractions share 
+    the same wins: log-capital is a*wins + b*losses, and its quantiles follow 
+    from those of the running number of wins. Returns the quantile bands 
+    (fraction, quantile, step), the growth rate per round with its standard 
+    error, and the exact growth rate.
+    """
+    f = np.atleast_1d(np.asarray(invest_per_round, dtype=float))
+    q = _win_probability(p, noise)
+    rng = np.random.default_rng(seed)
+    wins = np.cumsum(rng.random((nruns, nsteps)) < q, axis=1)
+    wins = np.pad(wins, [(0, 0), (1, 0)])
+    a, b = _log_returns(f, win_multiplier, loss_multiplier)
+    t = np.arange(nsteps+1)
+    quantiles = np.asarray(quantiles)
+    # log-capital increases with the wins when a > b, otherwise the quantiles swap
+    qw = np.quantile(wins, np.r_[quantiles, 1-quantiles], axis=0)
+    qw = np.where((a >= b)[:, None, None], qw[None, :len(quantiles)], qw[None, len(quantiles):])
+    with np.errstate(invalid='ignore'):
+        bands = a[:, None, None]*qw + b[:, None, None]*(t - qw)
+        final = a[:, None]*wins[:, -1] + b[:, None]*(nsteps - wins[:, -1])
+        return {'invest_per_round' : f, 'quantiles' : quantiles, 'bands' : bands, 
+                'growth' : final.mean(axis=1)/nsteps, 'growth_err' : final.std(axis=1)/nsteps/np.sqrt(nruns),
+                'kelly' : q*a + (1-q)*b}
+
+@function_profiler
+def bet_hedging_grid(p, noises, fractions, nsteps, win_multiplier=2, loss_multiplier=.5, nruns=1000, seed=None):
+    """
+    Monte Carlo growth rate per round on the noise x investment-fraction grid, 
+    every point at once: the final number of wins is binomial, drawn once per 
+    run and noise and shared by all fractions. Also returns the exact growth 
+    rate and the Kelly fraction maximising it for each noise.
+    """
+    noises, fractions = np.asarray(noises, dtype=float), np.asarray(fractions, dtype=float)
+    q = _win_probability(p, noises)
+    wins = np.random.default_rng(seed).binomial(nsteps, q[:, None], (len(noises), nruns))
+    a, b = _log_returns(fractions, win_multiplier, loss_multiplier)
+    with np.errstate(invalid='ignore'):
+        growth = (a[None, :, None]*wins[:, None] + b[None, :, None]*(nsteps - wins[:, None])).mean(axis=-1)/nsteps
+        exact = q[:, None]*a + (1-q[:, None])*b
+    return {'noise' : noises, 'invest_per_round' : fractions, 'growth' : growth, 'exact' : exact, 
+            'kelly' : fractions[np.argmax(np.nan_to_num(exact, nan=-np.inf), axis=1)]}
+
+@function_profiler
+def betHedging(p, noise, invest_per_round, nsteps, win_multiplier=2, loss_multiplier=.5, nruns=1000):
+    res = bet_hedging_ensemble(p, noise, invest_per_round, nsteps, win_multiplier, loss_multiplier, nruns)
+    bands, quantiles = res['bands'][0]/np.log(10), res['quantiles']
 
     fig, ax = plt.subplots()
-    plt.plot(capital, c='purple')
+    t = np.arange(nsteps+1)
+    for k in range(len(quantiles)//2):
+        plt.fill_between(t, bands[k], bands[-k-1], color='purple', alpha=.3, lw=0,
+                         label=f'{quantiles[k]:.0%}-{quantiles[-k-1]:.0%}')
+    plt.plot(t, bands[len(quantiles)//2], c='purple', label='median')
+    plt.title(f"growth rate {res['growth'][0]:.3f} ± {res['growth_err'][0]:.3f} per round", color='white')
     plt.xlabel('timestep', color='white')
     fig.patch.set_facecolor((.04,.065,.03))
-    ax.set(yscale='log')
-    plt.ylabel('capital', color='white')
+    plt.ylabel(r'$\log_{10}$ capital', color='white')
+    plt.legend(facecolor='beige')
+    plt.close()
+    return fig
+
+@function_profiler
+def kellyCurves(p, nsteps, win_multiplier=2, loss_multiplier=.5, noises=np.linspace(0, 3, 31), nruns=1000):
+    fractions = np.linspace(0, 1, 51)
+    res = bet_hedging_grid(p, noises, fractions, nsteps, win_multiplier, loss_multiplier, nruns)
+
+    fig, ax = plt.subplots(1, 2, figsize=(10, 4))
+    for i, c in zip(np.linspace(0, len(noises)-1, 4, dtype=int), ['white', 'yellow', 'orange', 'r']):
+        ax[0].scatter(fractions, res['growth'][i], s=6, color=c)
+        ax[0].plot(fractions, res['exact'][i], color=c, label=f"noise = {noises[i]:.1f}")
+    ax[0].axhline(0, c='gray', ls='--')
+    ax[0].set_xlabel('invest per round', color='white')
+    ax[0].set_ylabel('growth rate per round', color='white')
+    ax[0].legend(facecolor='beige')
+
+    growth = np.nan_to_num(res['growth'], nan=-np.inf, neginf=-np.inf)
+    vmax = np.abs(growth[np.isfinite(growth)]).max()
+    im = ax[1].imshow(growth, origin='lower', aspect='auto', cmap='RdBu', vmin=-vmax, vmax=vmax,
+                      extent=[0, 1, noises[0], noises[-1]])
+    ax[1].plot(res['kelly'], noises, c='black', ls='--', label='Kelly fraction')
+    ax[1].set_xlabel('invest per round', color='white')
+    ax[1].set_ylabel('noise', color='white')
+    ax[1].legend(facecolor='beige')
+    plt.colorbar(im, ax=ax[1])
+    plt.tight_layout()
     plt.close()
     return fig